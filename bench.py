@@ -0,0 +1,507 @@
+"""
+Database benchmarks for the bot.
+
+    python bench.py [--iterations N] [--suite all|db|economy]
+    python bench.py --suite economy --save-baseline bench_baseline.json
+    python bench.py --suite economy --compare bench_baseline.json
+
+Everything runs against a throwaway database in a temp directory, never the
+season DB_PATH. bot.py must be importable (OWNER_ID filled in).
+
+The economy suite seeds --users/--tickets/--wagers/--price-points rows and
+times the core economy functions one call at a time (ops/sec, p50, p99).
+The market tick is timed again with --markets markets at the end.
+--compare exits non-zero if any case's p50 got slower than --tolerance.
+Only compare against a baseline saved on the same machine.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import bot
+
+BENCH_USER_ID = 1000
+ECONOMY_USER_ID = 100_000
+BENCH_SEED = 1234
+
+
+def _legacy_connect() -> sqlite3.Connection:
+    # The per-call path db_connect() used before connections were pooled
+    conn = sqlite3.connect(bot.DB_PATH, check_same_thread=False)
+    conn.execute("PRAGMA foreign_keys = ON;")
+    return conn
+
+
+def _legacy_get_user(user_id: int):
+    with bot.db_lock:
+        conn = _legacy_connect()
+        try:
+            return conn.execute(
+                "SELECT user_id, username, balance, last_daily FROM users WHERE user_id = ?",
+                (int(user_id),),
+            ).fetchone()
+        finally:
+            conn.close()
+
+
+def _legacy_add_balance(user_id: int, amount: int) -> None:
+    with bot.db_lock:
+        conn = _legacy_connect()
+        try:
+            conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (int(amount), int(user_id)))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def _pooled_get_user(user_id: int):
+    return bot.get_user(user_id)
+
+
+def _pooled_add_balance(user_id: int, amount: int) -> None:
+    bot.add_balance(user_id, amount)
+
+
+def _time_ops(fn: Callable[[], None], iterations: int) -> Tuple[float, float]:
+    """
+    Returns (ops/sec, mean microseconds per op).
+    """
+    for _ in range(min(50, iterations)):
+        fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    elapsed = time.perf_counter() - start
+    if elapsed <= 0:
+        return float("inf"), 0.0
+    return iterations / elapsed, (elapsed / iterations) * 1e6
+
+
+def bench_connect(iterations: int) -> List[Tuple[str, float, float]]:
+    uid = BENCH_USER_ID
+    cases = [
+        ("get_user (db_connect per call)", lambda: _legacy_get_user(uid)),
+        ("get_user (pooled)", lambda: _pooled_get_user(uid)),
+        ("add_balance (db_connect per call)", lambda: _legacy_add_balance(uid, 1)),
+        ("add_balance (pooled)", lambda: _pooled_add_balance(uid, 1)),
+    ]
+    out = []
+    for name, fn in cases:
+        ops, us = _time_ops(fn, iterations)
+        out.append((name, ops, us))
+    return out
+
+
+async def _spin_burst(submit, iterations: int, concurrency: int) -> float:
+    """
+    Fires `iterations` balance writes from `concurrency` concurrent players.
+    Returns ops/sec.
+    """
+    per_player = max(1, iterations // concurrency)
+
+    async def player(uid: int) -> None:
+        for _ in range(per_player):
+            await submit(uid, 1)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(player(BENCH_USER_ID + i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return (per_player * concurrency) / elapsed if elapsed > 0 else float("inf")
+
+
+def bench_group_commit(iterations: int, concurrency: int = 32) -> List[Tuple[str, float, float]]:
+    """
+    Concurrent balance writes: commit per write vs group commit vs the balance
+    cache, then !buy bursts on one coin with and without trade group commit.
+    Group commit is run under synchronous=NORMAL and FULL because its gain is
+    in shared fsyncs, which WAL + NORMAL commits don't do.
+    """
+    for i in range(concurrency):
+        if bot.get_user(BENCH_USER_ID + i) is None:
+            bot.insert_user(BENCH_USER_ID + i, f"bench{i}")
+    sym = bot.v2_list_markets()[0][0]
+
+    async def per_op(uid: int, amount: int) -> None:
+        await bot.db.run(bot.add_balance, uid, amount)
+
+    async def buy_per_op(uid: int, amount: int) -> None:
+        await bot.db.run(bot.v2_buy_for_user, uid, "bench", sym, amount)
+
+    async def buy_grouped(uid: int, amount: int) -> None:
+        await bot.trade_writes.buy(uid, "bench", sym, amount)
+
+    async def run_sync(mode: str) -> List[Tuple[str, float, float]]:
+        out = []
+        ops = await _spin_burst(per_op, iterations, concurrency)
+        out.append((f"add_balance x{concurrency} (commit each, {mode})", ops, 1e6 / ops))
+        ops = await _spin_burst(bot.balance_writes.add, iterations, concurrency)
+        out.append((f"add_balance x{concurrency} (group commit, {mode})", ops, 1e6 / ops))
+        ops = await _spin_burst(buy_per_op, iterations, concurrency)
+        out.append((f"v2 buy x{concurrency}, one coin (commit each, {mode})", ops, 1e6 / ops))
+        ops = await _spin_burst(buy_grouped, iterations, concurrency)
+        out.append((f"v2 buy x{concurrency}, one coin (group commit, {mode})", ops, 1e6 / ops))
+        return out
+
+    async def run_cache() -> List[Tuple[str, float, float]]:
+        bot.balance_cache.load()
+        ops = await _spin_burst(bot.game_add_balance, iterations, concurrency)
+        await bot.db.run(bot.balance_cache.flush)
+        return [(f"add_balance x{concurrency} (balance cache)", ops, 1e6 / ops)]
+
+    saved_sync = bot.DB_SYNCHRONOUS
+    out: List[Tuple[str, float, float]] = []
+    try:
+        for mode in ("NORMAL", "FULL"):
+            # PRAGMA synchronous is applied when a pooled connection is opened
+            bot.DB_SYNCHRONOUS = mode
+            bot.get_db_pool().close_all()
+            out += asyncio.run(run_sync(mode))
+            bot.db.shutdown()
+        bot.DB_SYNCHRONOUS = saved_sync
+        bot.get_db_pool().close_all()
+        out += asyncio.run(run_cache())
+        return out
+    finally:
+        bot.DB_SYNCHRONOUS = saved_sync
+        bot.db.shutdown()
+        bot.balance_cache.close()
+
+
+# -----------------------------
+# Economy suite
+# -----------------------------
+# (name, ops/sec, p50 us, p99 us)
+EconomyResult = Tuple[str, float, float, float]
+
+
+def _time_samples(
+    fn: Callable[[Any], None],
+    iterations: int,
+    setup: Optional[Callable[[int], Any]] = None,
+    repeat: int = 5,
+) -> Tuple[float, float, float]:
+    """
+    Times fn one call at a time. setup(i) runs untimed before call i and its
+    return value is passed to fn. GC is paused while timing so a collection
+    doesn't land on a random sample.
+
+    Like timeit, ops/sec and p50 come from the best of `repeat` runs (the
+    least disturbed by the rest of the machine); p99 is over every sample.
+    """
+    samples: List[float] = []
+    run_ops: List[float] = []
+    run_p50: List[float] = []
+    i = 0
+    for _ in range(min(20, iterations)):
+        fn(setup(i) if setup else None)
+        i += 1
+    for _ in range(max(1, repeat)):
+        gc.collect()
+        gc.disable()
+        try:
+            run: List[float] = []
+            for _ in range(iterations):
+                arg = setup(i) if setup else None
+                i += 1
+                start = time.perf_counter()
+                fn(arg)
+                run.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+        total = sum(run)
+        run_ops.append(len(run) / total if total > 0 else float("inf"))
+        run_p50.append(statistics.median(run) * 1e6)
+        samples.extend(run)
+    samples.sort()
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6
+    return max(run_ops), min(run_p50), p99
+
+
+def seed_economy(users: int, tickets: int, wagers: int, price_points: int) -> Dict[str, Any]:
+    """
+    Bulk-loads a season-sized database straight through SQL. Returns the ids
+    the cases need (open bet with `wagers` wagers on it, market symbols, ...).
+    """
+    rng = random.Random(BENCH_SEED)
+    now = int(time.time())
+    uids = [ECONOMY_USER_ID + i for i in range(users)]
+    syms = [str(sym).upper() for sym, *_rest in bot.CRYPTO_V2_DEFAULTS]
+
+    with bot.db_lock:
+        conn = bot.db_connect()
+        try:
+            conn.executemany(
+                "INSERT INTO users (user_id, username, balance, last_daily) VALUES (?, ?, ?, ?)",
+                [(uid, f"user{uid}", rng.randint(10_000, 50_000_000), now) for uid in uids],
+            )
+            conn.executemany(
+                "INSERT INTO crypto_v2_holdings (user_id, symbol, coins) VALUES (?, ?, ?)",
+                [(uid, sym, rng.uniform(1.0, 500.0)) for uid in uids for sym in syms[:2]],
+            )
+            conn.executemany(
+                "INSERT INTO lottery_tickets (user_id, n1, n2, n3, n4, n5, pb, bought_ts) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        rng.choice(uids),
+                        *(rng.randint(bot.LOTTERY_MAIN_MIN, bot.LOTTERY_MAIN_MAX) for _ in range(5)),
+                        rng.randint(bot.LOTTERY_PB_MIN, bot.LOTTERY_PB_MAX),
+                        now,
+                    )
+                    for _ in range(tickets)
+                ],
+            )
+            bot._set_lottery_pool_conn(conn, 50_000_000)
+            step = max(1, (7 * 86400) // max(1, price_points))
+            for sym in syms:
+                price = 100.0
+                rows = []
+                for k in range(price_points):
+                    price = max(0.01, price * (1.0 + rng.gauss(0.0, 0.01)))
+                    rows.append((now - (price_points - k) * step, sym, price))
+                conn.executemany("INSERT INTO crypto_v2_prices (ts, symbol, price) VALUES (?, ?, ?)", rows)
+            bot._v2_rebuild_candles_conn(conn)
+            # A tenth of the server on parole so parole_tick_once has work to do
+            paroled = uids[: max(1, users // 10)]
+            conn.executemany("UPDATE users SET paroled = 1 WHERE user_id = ?", [(uid,) for uid in paroled])
+            conn.commit()
+        finally:
+            conn.close()
+
+    return {"uids": uids, "syms": syms, "paroled": paroled, "wagers": wagers, "rng": rng}
+
+
+def _new_bet_with_wagers(uids: List[int], wagers: int, rng: random.Random) -> int:
+    bet_id = bot.create_bet(None, None, uids[0], "bench", ["yes", "no", "maybe"])
+    picked = rng.sample(uids, min(wagers, len(uids)))
+    for uid in picked:
+        bot.place_wager(bet_id, uid, rng.randint(1, 3), 100)
+    return bet_id
+
+
+def bench_economy(iterations: int, seed: Dict[str, Any], repeat: int) -> List[EconomyResult]:
+    uids: List[int] = seed["uids"]
+    syms: List[str] = seed["syms"]
+    paroled: List[int] = seed["paroled"]
+    rng: random.Random = seed["rng"]
+    out: List[EconomyResult] = []
+
+    def case(name: str, fn: Callable[[Any], None], setup: Optional[Callable[[int], Any]] = None, n: int = iterations) -> None:
+        ops, p50, p99 = _time_samples(fn, n, setup, repeat)
+        out.append((name, ops, p50, p99))
+
+    case("get_user", lambda uid: bot.get_user(uid), lambda i: uids[rng.randrange(len(uids))])
+
+    # One wager per user per bet: move to a fresh bet once every user has bet
+    wager_bet = {"id": 0}
+
+    def wager_setup(i: int) -> Tuple[int, int]:
+        slot = i % len(uids)
+        if slot == 0 or wager_bet["id"] == 0:
+            wager_bet["id"] = bot.create_bet(None, None, uids[0], "bench", ["yes", "no"])
+        return wager_bet["id"], uids[slot]
+
+    case("place_wager", lambda a: bot.place_wager(a[0], a[1], 1, 100), wager_setup)
+
+    resolve_n = max(5, iterations // 50)
+    case(
+        f"resolve_bet_and_payout ({seed['wagers']} wagers)",
+        lambda bet_id: bot.resolve_bet_and_payout(bet_id, 1),
+        lambda i: _new_bet_with_wagers(uids, seed["wagers"], rng),
+        resolve_n,
+    )
+
+    case("v2_buy", lambda a: bot.v2_buy(a[0], a[1], 1_000), lambda i: (uids[rng.randrange(len(uids))], syms[0]))
+    case("v2_sell", lambda a: bot.v2_sell(a[0], a[1], 0.01), lambda i: (uids[rng.randrange(len(uids))], syms[0]))
+    case(f"v2_market_tick_once ({len(syms)} markets)", lambda _a: bot.v2_market_tick_once())
+
+    def reset_tax(_i: int) -> None:
+        with bot.db_lock:
+            conn = bot.db_connect()
+            try:
+                conn.execute("DELETE FROM system_state WHERE key = 'last_tax_date'")
+                conn.commit()
+            finally:
+                conn.close()
+
+    saved_weekdays = bot.TAX_WEEKDAYS
+    bot.TAX_WEEKDAYS = set(range(7))
+    try:
+        case(f"run_tax_if_due ({len(uids)} users)", lambda _a: bot.run_tax_if_due(), reset_tax, max(5, iterations // 50))
+    finally:
+        bot.TAX_WEEKDAYS = saved_weekdays
+
+    def reset_parole(_i: int) -> None:
+        now = int(time.time())
+        with bot.db_lock:
+            conn = bot.db_connect()
+            try:
+                # Two missed pay intervals each
+                conn.executemany(
+                    "UPDATE users SET paroled = 1, parole_ts = ?, parole_last_pay_ts = ? WHERE user_id = ?",
+                    [(now - 1800, now - 2 * bot.PAROLE_PAY_INTERVAL_SECONDS, uid) for uid in paroled],
+                )
+                conn.commit()
+            finally:
+                conn.close()
+
+    case(f"parole_tick_once ({len(paroled)} paroled)", lambda _a: bot.parole_tick_once(), reset_parole, max(5, iterations // 20))
+
+    points = bot.v2_get_price_series_since(syms[0], 0)
+    case(f"render_ascii_price_chart ({len(points)} points)", lambda _a: bot.render_ascii_price_chart(points))
+    case("v2_get_candles (7d window)", lambda _a: bot.v2_get_candles(syms[0], int(time.time()) - 7 * 86400))
+
+    pool, tickets = bot.get_lottery_draw_state()
+    draws = [
+        ([rng.randint(bot.LOTTERY_MAIN_MIN, bot.LOTTERY_MAIN_MAX) for _ in range(5)], rng.randint(bot.LOTTERY_PB_MIN, bot.LOTTERY_PB_MAX))
+        for _ in range(64)
+    ]
+
+    def settle(d: Tuple[List[int], int]) -> None:
+        payout = bot.compute_lottery_payouts(pool, tickets, d[0], d[1])
+        bot.settle_lottery_draw(payout.pool_remaining, payout.small_paid, payout.jackpot_paid_net)
+
+    def restore_tickets(i: int) -> Tuple[List[int], int]:
+        with bot.db_lock:
+            conn = bot.db_connect()
+            try:
+                conn.execute("DELETE FROM lottery_tickets")
+                conn.executemany(
+                    "INSERT INTO lottery_tickets (id, user_id, n1, n2, n3, n4, n5, pb, bought_ts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                    tickets,
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        return draws[i % len(draws)]
+
+    case(f"powerball settlement ({len(tickets)} tickets)", settle, restore_tickets, max(5, iterations // 50))
+
+    extra = max(0, seed["markets"] - len(syms))
+    if extra:
+        _add_bench_markets(extra)
+        case(f"v2_market_tick_once ({len(syms) + extra} markets)", lambda _a: bot.v2_market_tick_once())
+    return out
+
+
+def _add_bench_markets(n: int) -> None:
+    with bot.db_lock:
+        conn = bot.db_connect()
+        try:
+            conn.executemany(
+                """
+                INSERT INTO crypto_v2_markets
+                (symbol, name, reserve_money, reserve_coin, fee, created_ts, last_price, last_tick_ts, day_open_price)
+                VALUES (?, ?, ?, ?, ?, 0, ?, 0, ?)
+                """,
+                [(f"BENCH{i}", f"Bench {i}", 10_000_000.0, 10_000.0, bot.CRYPTO_V2_FEE, 1000.0, 1000.0) for i in range(n)],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+    bot.market_book.forget()
+
+
+def _load_baseline(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(path: str, results: List[EconomyResult], params: Dict[str, Any]) -> None:
+    data = {
+        "created": int(time.time()),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "params": params,
+        "results": {name: {"ops": ops, "p50_us": p50, "p99_us": p99} for name, ops, p50, p99 in results},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    print(f"Baseline saved to {path}")
+
+
+def compare_baseline(path: str, results: List[EconomyResult], params: Dict[str, Any], tolerance: float) -> bool:
+    """
+    Prints the change against a saved baseline. Returns False if any case's
+    p50 got worse by more than `tolerance` (0.25 = 25%). p99 is shown but not
+    gated on; it is too sensitive to whatever else the machine is doing.
+    """
+    data = _load_baseline(path)
+    base = data["results"]
+    if data.get("params") != params:
+        print(f"Warning: baseline was recorded with {data.get('params')}, this run used {params}")
+    ok = True
+    print()
+    print(f"{'vs ' + os.path.basename(path):<48} {'ops/sec':>10} {'p50':>9} {'p99':>9}")
+    for name, ops, p50, p99 in results:
+        b = base.get(name)
+        if b is None:
+            print(f"{name:<48} {'(new)':>10}")
+            continue
+        d_ops = (ops / b["ops"] - 1.0) if b["ops"] else 0.0
+        d_p50 = (p50 / b["p50_us"] - 1.0) if b["p50_us"] else 0.0
+        d_p99 = (p99 / b["p99_us"] - 1.0) if b["p99_us"] else 0.0
+        slower = d_p50 > tolerance
+        ok = ok and not slower
+        flag = "  REGRESSION" if slower else ""
+        print(f"{name:<48} {d_ops:>+10.1%} {d_p50:>+9.1%} {d_p99:>+9.1%}{flag}")
+    return ok
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--iterations", type=int, default=2000)
+    ap.add_argument("--suite", choices=["all", "db", "economy"], default="all")
+    ap.add_argument("--users", type=int, default=2000)
+    ap.add_argument("--tickets", type=int, default=5000)
+    ap.add_argument("--wagers", type=int, default=200)
+    ap.add_argument("--price-points", type=int, default=2000, help="price history rows per market")
+    ap.add_argument("--markets", type=int, default=500, help="markets for the second tick case")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--save-baseline", metavar="PATH")
+    ap.add_argument("--compare", metavar="PATH")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    args = ap.parse_args()
+
+    random.seed(BENCH_SEED)
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.DB_PATH = os.path.join(tmp, "bench.db")
+        bot.init_db()
+        bot.insert_user(BENCH_USER_ID, "bench")
+
+        if args.suite in ("all", "economy"):
+            seed = seed_economy(args.users, args.tickets, args.wagers, args.price_points)
+            seed["markets"] = args.markets
+            results = bench_economy(max(50, args.iterations // 4), seed, args.repeat)
+            print(f"{'case':<48} {'ops/sec':>12} {'p50 us':>10} {'p99 us':>10}")
+            for name, ops, p50, p99 in results:
+                print(f"{name:<48} {ops:>12,.0f} {p50:>10.1f} {p99:>10.1f}")
+            params = {k: getattr(args, k) for k in ("iterations", "users", "tickets", "wagers", "price_points", "markets", "repeat")}
+            if args.save_baseline:
+                save_baseline(args.save_baseline, results, params)
+            if args.compare:
+                ok = compare_baseline(args.compare, results, params, args.tolerance)
+            print()
+
+        if args.suite in ("all", "db"):
+            print(f"{'case':<48} {'ops/sec':>12} {'us/op':>10}")
+            for name, ops, us in bench_connect(args.iterations) + bench_group_commit(args.iterations):
+                print(f"{name:<48} {ops:>12,.0f} {us:>10.1f}")
+
+        bot.get_db_pool().close_all()
+
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
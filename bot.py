@@ -1,20 +1,38 @@
 import os
+import sys
 import time
+import bisect
+import heapq
+import itertools
+import operator
 import random
 import sqlite3
 import re
 import asyncio
 import threading
 import math
+import functools
+import contextvars
+import zlib
+import mmap
+import struct
+from array import array
+from contextlib import asynccontextmanager, contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from zoneinfo import ZoneInfo
-from typing import Dict, Optional, Tuple, List, Set, Literal
-from collections import Counter
-from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple, List, Set, Literal
+from collections import Counter, deque
+from dataclasses import dataclass, replace
 
 import discord
 from discord.ext import commands
 
+try:
+    import numpy as np  # optional: vectorizes the market tick (v2_tick_reserves)
+except ImportError:
+    np = None
+
 # ------
 # Global Constants
 # -------
@@ -168,7 +186,20 @@ TAX_WEEKDAYS = {1, 2, 3, 4, 6}  # Wed=2, Thu=3, Fri=4, Sun=6
 # -----------------------------
 CRYPTO_V2_FEE = 0.007          # 0.7% swap fee
 CRYPTO_V2_TICK_SECONDS = 20   # background tick cadence
-
+CRYPTO_V2_TICK_NUMPY = True   # use numpy for the tick when it is installed
+CRYPTO_V2_CANDLE_INTERVALS = (60, 300, 3600, 86400)  # OHLCV rollups kept in crypto_v2_candles (1m, 5m, 1h, 1d)
+CRYPTO_V2_CHART_MAX_CANDLES = 300  # charts use the finest interval that fits the window in this many candles
+CRYPTO_V2_PRICE_RAW_HOURS = 48           # raw crypto_v2_prices rows older than this are compacted into the archive
+CRYPTO_V2_ARCHIVE_KEEP_DAYS = 0          # archived hours older than this are dropped (0 = keep all season)
+CRYPTO_V2_ARCHIVE_SECONDS = 3600         # how often price_archive_daemon runs
+CRYPTO_V2_ARCHIVE_HOURS_PER_RUN = 24     # hours compacted per transaction (a backlog is worked off in steps)
+CRYPTO_V2_RING_POINTS = 2048             # newest price points kept in memory per coin for short charts
+CRYPTO_V2_RING_SLOTS = 64                # coins that get a ring (the rest chart from SQL)
+CRYPTO_V2_RING_MMAP = True               # keep the rings in <db file>-prices.ring so a restart starts warm
+CRYPTO_V2_RING_SUFFIX = "-prices.ring"
+CRYPTO_V2_MARKET_BOOK = True             # serve market reserves from memory (MarketBook); False reads crypto_v2_markets
+
+# Seeded once by the baseline schema migration; coins added here later need a new migration
 CRYPTO_V2_DEFAULTS = [
     ("BLOO", "Bloo Coin",        1000.0,   10_000_000.0),
     ("BDC",  "Devil Coin",       1000.0,   20_000_000.0),
@@ -179,6 +210,73 @@ CRYPTO_V2_DEFAULTS = [
     ("HOP",  "Cadet Coin",       1000.0,   70_000_000.0),
 ]
 
+# -----------------------------
+# SQLite Connection Tuning
+# -----------------------------
+DB_POOL_SIZE = 4                        # idle connections kept open for reuse
+DB_READER_THREADS = 4                   # concurrent readers (WAL lets them run beside the writer)
+DB_STATEMENT_CACHE = 256                # prepared statements cached per connection
+DB_JOURNAL_MODE = "WAL"
+DB_SYNCHRONOUS = "NORMAL"               # OFF | NORMAL | FULL (NORMAL is durable enough under WAL)
+DB_CACHE_SIZE_KB = 16 * 1024            # page cache per connection
+DB_MMAP_SIZE = 128 * 1024 * 1024        # bytes of the db file mapped into memory (0 = off)
+DB_BUSY_TIMEOUT_MS = 5000
+
+# Group commit: balance writes from games that land within the window share one transaction.
+# Only used when the balance cache is off or misses; the win comes from sharing fsyncs,
+# so it is large under DB_SYNCHRONOUS = FULL/EXTRA and small under WAL + NORMAL.
+GROUP_COMMIT_ENABLED = True
+GROUP_COMMIT_WINDOW_MS: Optional[float] = None  # linger for an idle batch; None = 1 ms if commits fsync, else 0
+GROUP_COMMIT_MAX_BATCH = 256
+
+# -----------------------------
+# Guild Partitions
+# -----------------------------
+# True = each guild's economy (users, bets, holdings, tickets, market, tax) lives in its
+# own database file with its own writer thread, lock and balance cache. DB_PATH keeps
+# the guild -> file routing index and serves commands sent outside a guild.
+DB_PARTITION_BY_GUILD = False
+DB_PARTITION_DIR = ""                   # "" = a guilds/ folder next to DB_PATH
+# Balances already in DB_PATH are not copied into guild files (a user's money can't be
+# split between guilds), so partitioning refuses to start on a DB_PATH that has users.
+# True = start anyway: DB_PATH keeps those balances and guilds start fresh.
+DB_PARTITION_ALLOW_EXISTING = False
+
+# -----------------------------
+# Balance Cache (write-back)
+# -----------------------------
+BALANCE_CACHE_ENABLED = True
+BALANCE_JOURNAL_SUFFIX = "-balances.journal"   # next to the db file
+BALANCE_JOURNAL_FSYNC_MS = 50                  # journal appends are fsynced in batches this often
+BALANCE_FLUSH_SECONDS = 5                      # pending deltas are written to users this often
+BALANCE_JOURNAL_COMPACT_BYTES = 1024 * 1024    # rewrite the journal down to pending deltas past this size
+RANK_BUCKET_SIZE = 512                         # leaderboard index bucket size (see RankIndex)
+USERNAME_FLUSH_SECONDS = 30                    # changed display names are written back this often
+
+# -----------------------------
+# Backups
+# -----------------------------
+BACKUP_ENABLED = True
+BACKUP_DIR = ""                       # "" = a backups/ folder next to DB_PATH
+BACKUP_INTERVAL_SECONDS = 6 * 60 * 60
+BACKUP_KEEP = 12                      # snapshots kept per kind (scheduled, manual, pre-restore)
+BACKUP_PAGES_PER_STEP = 256           # pages copied per backup step
+BACKUP_STEP_SLEEP_MS = 5              # pause between steps so the copy never hogs the disk
+
+# -----------------------------
+# Command Locks
+# -----------------------------
+LOCK_STRIPES = 256          # asyncio locks shared by all user/market/bet keys
+LOCK_HOLD_WARN_MS = 250     # log commands that hold a lock longer than this
+
+# -----------------------------
+# Query Instrumentation
+# -----------------------------
+DB_STATS_ENABLED = True
+DB_SLOW_QUERY_MS = 50       # statements slower than this are printed and kept for !dbstats
+DB_SLOW_QUERY_KEEP = 20
+DB_STATS_TOP = 10           # statements listed by !dbstats
+
 # ============================================================
 # Formatting helpers
 # ============================================================
@@ -351,13 +449,488 @@ def parse_time_window(window: str) -> int:
 # Database (SQLite)
 # ============================================================
 
-db_lock = threading.Lock()
+# Histogram bucket upper bounds (ms) for statement and lock-wait timings
+_DB_STAT_BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, float("inf"))
+
+_SQL_NUMBER_RE = re.compile(r"\b\d+(\.\d+)?\b")
+_SQL_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_SQL_IN_LIST_RE = re.compile(r"IN \((\s*\?\s*,)+\s*\?\s*\)", re.IGNORECASE)
+
+class _Histogram:
+    __slots__ = ("counts", "total_ms", "max_ms", "n")
+
+    def __init__(self):
+        self.counts = [0] * len(_DB_STAT_BUCKETS_MS)
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.n = 0
+
+    def add(self, ms: float) -> None:
+        for i, upper in enumerate(_DB_STAT_BUCKETS_MS):
+            if ms <= upper:
+                self.counts[i] += 1
+                break
+        self.total_ms += ms
+        self.n += 1
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def percentile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the q-th quantile (max for the open bucket).
+        """
+        if self.n == 0:
+            return 0.0
+        target = q * self.n
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target and c:
+                upper = _DB_STAT_BUCKETS_MS[i]
+                return self.max_ms if upper == float("inf") else min(upper, self.max_ms)
+        return self.max_ms
+
+class _StatementStats:
+    __slots__ = ("hist", "rows_returned", "rows_changed", "fetch_ms")
+
+    def __init__(self):
+        self.hist = _Histogram()
+        self.rows_returned = 0
+        self.rows_changed = 0
+        self.fetch_ms = 0.0
+
+class QueryStats:
+    """
+    Per-statement timing for everything that goes through a PooledConnection,
+    keyed by normalized SQL (literals -> ?, IN lists collapsed), plus how long
+    db_lock was waited for and held. Read via !dbstats.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._norm_cache: Dict[str, str] = {}
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.statements: Dict[str, _StatementStats] = {}
+            self.lock_wait = _Histogram()
+            self.lock_hold = _Histogram()
+            self.slow: deque = deque(maxlen=DB_SLOW_QUERY_KEEP)
+            # command -> [invocations, total round trips, max round trips]
+            self.commands: Dict[str, List[int]] = {}
+            self.since = time.time()
+
+    def normalize(self, sql: str) -> str:
+        norm = self._norm_cache.get(sql)
+        if norm is None:
+            norm = " ".join(sql.split())
+            norm = _SQL_STRING_RE.sub("?", norm)
+            norm = _SQL_NUMBER_RE.sub("?", norm)
+            norm = _SQL_IN_LIST_RE.sub("IN (...)", norm)
+            if len(self._norm_cache) < 2048:
+                self._norm_cache[sql] = norm
+        return norm
+
+    def record(self, sql: str, ms: float, rows_changed: int) -> str:
+        key = self.normalize(sql)
+        with self._lock:
+            st = self.statements.get(key)
+            if st is None:
+                st = self.statements[key] = _StatementStats()
+            st.hist.add(ms)
+            if rows_changed > 0:
+                st.rows_changed += rows_changed
+            if ms >= DB_SLOW_QUERY_MS:
+                self.slow.append((time.time(), ms, key))
+        if ms >= DB_SLOW_QUERY_MS:
+            print(f"[SLOWSQL] {ms:.1f} ms  {key[:200]}")
+        return key
+
+    def record_fetch(self, key: str, ms: float, rows: int) -> None:
+        with self._lock:
+            st = self.statements.get(key)
+            if st is not None:
+                st.fetch_ms += ms
+                st.rows_returned += rows
+
+    def record_command(self, name: str, trips: int) -> None:
+        with self._lock:
+            st = self.commands.get(name)
+            if st is None:
+                st = self.commands[name] = [0, 0, 0]
+            st[0] += 1
+            st[1] += trips
+            st[2] = max(st[2], trips)
+
+    def record_lock(self, wait_ms: float, hold_ms: float) -> None:
+        with self._lock:
+            self.lock_wait.add(wait_ms)
+            self.lock_hold.add(hold_ms)
+
+    def report_lines(self, top: int = DB_STATS_TOP) -> List[str]:
+        with self._lock:
+            items = sorted(self.statements.items(), key=lambda kv: kv[1].hist.total_ms, reverse=True)[:top]
+            n_statements = sum(st.hist.n for st in self.statements.values())
+            waits, holds = self.lock_wait, self.lock_hold
+            lines = [
+                f"**DB stats** since {datetime.fromtimestamp(self.since).strftime('%Y-%m-%d %H:%M:%S')} "
+                f"— {n_statements:,} statements, {len(self.statements)} distinct",
+                f"db_lock: {waits.n:,} acquisitions | wait avg {waits.total_ms / max(1, waits.n):.2f} ms, "
+                f"p99 {waits.percentile(0.99):.2f} ms, max {waits.max_ms:.1f} ms | "
+                f"hold avg {holds.total_ms / max(1, holds.n):.2f} ms, p99 {holds.percentile(0.99):.2f} ms",
+                "",
+                f"**Top {len(items)} by total time**",
+            ]
+            for key, st in items:
+                h = st.hist
+                lines.append(
+                    f"`{h.total_ms:8.1f} ms` n={h.n:,} avg={h.total_ms / h.n:.2f} p50={h.percentile(0.5):.2f} "
+                    f"p99={h.percentile(0.99):.2f} max={h.max_ms:.1f} rows={st.rows_returned:,} "
+                    f"changed={st.rows_changed:,}\n    `{key[:150]}`"
+                )
+            slow = list(self.slow)
+            cmds = sorted(self.commands.items(), key=lambda kv: kv[1][0], reverse=True)[:top]
+        if cmds:
+            lines.append("")
+            lines.append("**DB round trips per command**")
+            for name, (n, total, most) in cmds:
+                lines.append(f"`{PREFIX}{name}` n={n:,} avg={total / n:.2f} max={most}")
+        if slow:
+            lines.append("")
+            lines.append(f"**Slow queries** (>= {DB_SLOW_QUERY_MS} ms)")
+            for ts, ms, key in reversed(slow[-5:]):
+                lines.append(f"{datetime.fromtimestamp(ts).strftime('%H:%M:%S')} `{ms:.1f} ms` `{key[:150]}`")
+        return lines
+
+query_stats = QueryStats()
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Counts rows (and time) spent fetching a statement's results.
+    """
+
+    stat_key: Optional[str] = None
+    iterated = 0
+
+    def _count(self, start: float, rows: int) -> None:
+        if self.stat_key is not None:
+            query_stats.record_fetch(self.stat_key, (time.perf_counter() - start) * 1000.0, rows)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._count(start, 1 if row is not None else 0)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        start = time.perf_counter()
+        rows = super().fetchmany(*args, **kwargs)
+        self._count(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._count(start, len(rows))
+        return rows
+
+    def __next__(self):
+        try:
+            row = super().__next__()
+        except StopIteration:
+            if self.stat_key is not None and self.iterated:
+                query_stats.record_fetch(self.stat_key, 0.0, self.iterated)
+                self.iterated = 0
+            raise
+        self.iterated += 1
+        return row
+
+class TimedLock:
+    """
+    threading.Lock that reports wait and hold times to query_stats.
+    Used as db_lock, so "waiting for the writer" shows up separately from SQL time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._acquired_at = 0.0
+        self._wait_ms = 0.0
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        start = time.perf_counter()
+        ok = self._lock.acquire(blocking, timeout)
+        if ok:
+            self._acquired_at = time.perf_counter()
+            self._wait_ms = (self._acquired_at - start) * 1000.0
+        return ok
+
+    def release(self) -> None:
+        hold_ms = (time.perf_counter() - self._acquired_at) * 1000.0
+        wait_ms = self._wait_ms
+        self._lock.release()
+        if DB_STATS_ENABLED:
+            query_stats.record_lock(wait_ms, hold_ms)
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+# Guild whose database file this task / thread is working on (None = DB_PATH)
+_db_partition: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("db_partition", default=None)
+
+def partition_db_path(guild_id: Optional[int]) -> str:
+    if guild_id is None:
+        return DB_PATH
+    folder = DB_PARTITION_DIR or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "guilds")
+    stem = os.path.splitext(os.path.basename(DB_PATH))[0]
+    return os.path.join(folder, f"{stem}-g{int(guild_id)}.db")
+
+def active_db_path() -> str:
+    """
+    Database file for the current task or thread: DB_PATH unless a guild
+    partition was entered (see use_partition / enter_guild_partition).
+    """
+    guild_id = _db_partition.get()
+    if guild_id is None:
+        return DB_PATH
+    return partition_db_path(guild_id)
+
+@contextmanager
+def use_partition(guild_id: Optional[int]) -> Iterator[None]:
+    token = _db_partition.set(guild_id)
+    try:
+        yield
+    finally:
+        _db_partition.reset(token)
+
+class PartitionLocal:
+    """
+    One instance of a per-database object per database file; attribute
+    access goes to the instance for active_db_path(). Used for db_lock,
+    balance_cache and balance_writes, so code written against a single
+    database works unchanged inside a guild partition.
+    """
+
+    def __init__(self, factory: Callable[[], object]):
+        self._factory = factory
+        self._by_path: Dict[str, object] = {}
+        self._guard = threading.Lock()
+
+    def current(self):
+        path = active_db_path()
+        obj = self._by_path.get(path)
+        if obj is None:
+            with self._guard:
+                obj = self._by_path.get(path)
+                if obj is None:
+                    obj = self._by_path[path] = self._factory()
+        return obj
+
+    def instances(self) -> List[object]:
+        with self._guard:
+            return list(self._by_path.values())
+
+    def __getattr__(self, name: str):
+        return getattr(self.current(), name)
+
+class PartitionedLock(PartitionLocal):
+    """
+    db_lock: a TimedLock per database file, so guild partitions never wait
+    on each other's writer.
+    """
+
+    def __init__(self):
+        super().__init__(TimedLock)
+        self._held = threading.local()
+
+    def __enter__(self):
+        lock = self.current()
+        lock.acquire()
+        stack = self._held.__dict__.setdefault("stack", [])
+        stack.append(lock)
+        return lock
+
+    def __exit__(self, *exc) -> None:
+        # Release the lock taken in __enter__, even if the partition changed in between
+        self._held.stack.pop().release()
+
+db_lock = PartitionedLock()
 _db_printed = False
 
-def db_connect():
+class PooledConnection(sqlite3.Connection):
+    """
+    Connection handed out by DBConnectionPool.
+
+    close() hands the connection back to its pool instead of tearing it down.
+    Anything left uncommitted is rolled back first, so callers keep the old
+    "close without commit discards the transaction" behaviour.
+    """
+
+    pool: Optional["DBConnectionPool"] = None
+    # Users whose balance / crypto holdings this transaction changed (see unit_of_work)
+    balance_dirty: Set[int]
+    holdings_dirty: Set[int]
+    # (symbol, ts, price) points recorded by this transaction, for price_rings after commit
+    prices_recorded: List[Tuple[str, int, float]]
+    # New market states this transaction made; written back before commit, published after
+    markets_changed: Dict[str, "MarketState"]
+    # Label for the balance_ledger rows this connection writes (see _ledger_note)
+    ledger_reason: str = "other"
+    ledger_ref: Optional[str] = None
+    ledger_ready = False
+
+    def execute(self, sql: str, parameters=()):
+        if not DB_STATS_ENABLED:
+            return super().execute(sql, parameters)
+        cur = self.cursor(InstrumentedCursor)
+        start = time.perf_counter()
+        cur.execute(sql, parameters)
+        ms = (time.perf_counter() - start) * 1000.0
+        cur.stat_key = query_stats.record(sql, ms, cur.rowcount)
+        return cur
+
+    def executemany(self, sql: str, seq_of_parameters):
+        if not DB_STATS_ENABLED:
+            return super().executemany(sql, seq_of_parameters)
+        cur = self.cursor(InstrumentedCursor)
+        start = time.perf_counter()
+        cur.executemany(sql, seq_of_parameters)
+        ms = (time.perf_counter() - start) * 1000.0
+        cur.stat_key = query_stats.record(sql, ms, cur.rowcount)
+        return cur
+
+    def close(self) -> None:
+        pool = self.pool
+        if pool is None:
+            super().close()
+            return
+        pool.release(self)
+
+    def close_for_real(self) -> None:
+        self.pool = None
+        super().close()
+
+class DBConnectionPool:
+    """
+    Keeps long-lived SQLite connections so commands don't pay for
+    connect + PRAGMA setup + teardown on every query.
+
+    A readonly pool hands out query_only connections; under WAL each of
+    their SELECTs reads a committed snapshot and never waits on the writer.
+    """
+
+    def __init__(self, path: str, size: int = DB_POOL_SIZE, readonly: bool = False):
+        self.path = path
+        self.size = max(1, int(size))
+        self.readonly = bool(readonly)
+        self.opened = 0
+        self._idle: List[PooledConnection] = []
+        self._lock = threading.Lock()
+
+    def _open(self) -> PooledConnection:
+        conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            factory=PooledConnection,
+            cached_statements=int(DB_STATEMENT_CACHE),
+        )
+        conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)};")
+        if not self.readonly:
+            conn.execute(f"PRAGMA journal_mode = {DB_JOURNAL_MODE};")
+            conn.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS};")
+        # Negative cache_size is in KiB rather than pages
+        conn.execute(f"PRAGMA cache_size = -{int(DB_CACHE_SIZE_KB)};")
+        conn.execute(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE)};")
+        conn.execute("PRAGMA temp_store = MEMORY;")
+        conn.execute("PRAGMA foreign_keys = ON;")
+        if self.readonly:
+            conn.execute("PRAGMA query_only = ON;")
+        conn.pool = self
+        conn.balance_dirty = set()
+        conn.holdings_dirty = set()
+        conn.prices_recorded = []
+        conn.markets_changed = {}
+        if not self.readonly:
+            _install_ledger_conn(conn)
+        self.opened += 1
+        return conn
+
+    def acquire(self) -> PooledConnection:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._open()
+
+    def release(self, conn: PooledConnection) -> None:
+        dirty = list(conn.balance_dirty)
+        conn.balance_dirty.clear()
+        conn.holdings_dirty.clear()
+        conn.prices_recorded.clear()
+        conn.markets_changed.clear()
+        conn.ledger_reason, conn.ledger_ref = "other", None
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+                if dirty:
+                    # Debits mirror themselves into the balance cache before commit
+                    # (BalanceCache.debit_conn); put the committed balances back
+                    balance_cache.refresh_conn(conn, dirty)
+        except sqlite3.Error:
+            conn.close_for_real()
+            return
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close_for_real()
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close_for_real()
+
+# Pools per database file (DB_PATH, plus one per guild partition)
+_db_pools: Dict[str, DBConnectionPool] = {}
+_db_read_pools: Dict[str, DBConnectionPool] = {}
+_db_pool_lock = threading.Lock()
+
+def get_db_pool() -> DBConnectionPool:
+    path = active_db_path()
+    pool = _db_pools.get(path)
+    if pool is not None:
+        return pool
+    with _db_pool_lock:
+        pool = _db_pools.get(path)
+        if pool is None:
+            pool = _db_pools[path] = DBConnectionPool(path)
+        return pool
+
+def get_db_read_pool() -> DBConnectionPool:
+    path = active_db_path()
+    pool = _db_read_pools.get(path)
+    if pool is not None:
+        return pool
+    with _db_pool_lock:
+        pool = _db_read_pools.get(path)
+        if pool is None:
+            # +1 so the writer thread's own lookups don't churn connections
+            pool = _db_read_pools[path] = DBConnectionPool(path, size=DB_READER_THREADS + 1, readonly=True)
+        return pool
+
+def db_connect() -> PooledConnection:
     global _db_printed
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.execute("PRAGMA foreign_keys = ON;")
+    conn = get_db_pool().acquire()
+    if not conn.ledger_ready:
+        # Opened before the ledger migration ran
+        _install_ledger_conn(conn)
     if not _db_printed:
         _db_printed = True
         try:
@@ -369,6 +942,192 @@ def db_connect():
             print(f"[DB] PRAGMA database_list failed: {e}")
     return conn
 
+def db_connect_read() -> PooledConnection:
+    """
+    Read-only connection for pure lookups. Does not need db_lock.
+    """
+    return get_db_read_pool().acquire()
+
+# Set per command invocation by preload_caller; counts db.run/db.read round trips
+_db_trips: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar("db_trips", default=None)
+
+def _count_trip() -> None:
+    trips = _db_trips.get()
+    if trips is not None:
+        trips[0] += 1
+
+class DBExecutor:
+    """
+    Runs blocking SQLite work off the event loop so a slow query never
+    stalls gateway heartbeats or other commands.
+
+        row = await db.read(get_user, user_id)      # reader pool, runs concurrently
+        ok, msg = await db.run(v2_buy, uid, sym, n)  # single writer thread
+
+    Each database file gets its own writer thread, so guild partitions
+    commit in parallel. The caller's context (and so its partition) is
+    carried into the worker thread.
+    """
+
+    def __init__(self):
+        self._writers: Dict[str, ThreadPoolExecutor] = {}
+        self._readers: Optional[ThreadPoolExecutor] = None
+        self._guard = threading.Lock()
+
+    def _executor(self) -> ThreadPoolExecutor:
+        path = active_db_path()
+        writer = self._writers.get(path)
+        if writer is None:
+            with self._guard:
+                writer = self._writers.get(path)
+                if writer is None:
+                    writer = self._writers[path] = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        return writer
+
+    def _read_executor(self) -> ThreadPoolExecutor:
+        if self._readers is None:
+            self._readers = ThreadPoolExecutor(max_workers=DB_READER_THREADS, thread_name_prefix="db-reader")
+        return self._readers
+
+    async def run(self, fn, *args, **kwargs):
+        _count_trip()
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor(), ctx.run, functools.partial(fn, *args, **kwargs))
+
+    async def read(self, fn, *args, **kwargs):
+        _count_trip()
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self._read_executor(), ctx.run, functools.partial(fn, *args, **kwargs))
+
+    def shutdown(self) -> None:
+        if self._readers is not None:
+            self._readers.shutdown(wait=True)
+            self._readers = None
+        with self._guard:
+            writers, self._writers = self._writers, {}
+        for writer in writers.values():
+            writer.shutdown(wait=True)
+
+db = DBExecutor()
+
+@contextmanager
+def unit_of_work() -> Iterator[PooledConnection]:
+    """
+    One writer transaction for a whole command: its reads, checks and writes
+    share a connection and commit once, instead of each helper opening its own.
+
+        def v2_buy_for_user(user_id, username, sym, money_in):
+            with unit_of_work() as conn:
+                if _touch_user_conn(conn, user_id, username) is None:
+                    return None
+                return _v2_buy_conn(conn, user_id, sym, money_in)
+
+    Call it from the writer thread (await db.run(...)). Returning from the
+    block commits; an exception rolls everything back. Users passed to
+    _balance_changed_conn() / _holdings_changed_conn() are refreshed in the
+    balance cache / net worth board after commit, recorded prices are
+    appended to price_rings, and market states queued with
+    _v2_put_market_conn() are written back and published to market_book.
+    """
+    with db_lock:
+        conn = db_connect()
+        try:
+            yield conn
+            if conn.markets_changed:
+                _v2_write_markets_conn(conn)
+            conn.commit()
+            if conn.markets_changed:
+                market_book.publish(conn.markets_changed.values())
+            if conn.balance_dirty:
+                balance_cache.refresh_conn(conn, list(conn.balance_dirty))
+            if conn.holdings_dirty:
+                balance_cache.refresh_holdings_conn(conn, list(conn.holdings_dirty))
+            if conn.prices_recorded:
+                price_rings.extend(conn.prices_recorded)
+        finally:
+            conn.close()
+
+def _balance_changed_conn(conn: PooledConnection, *user_ids: int) -> None:
+    conn.balance_dirty.update(int(u) for u in user_ids)
+
+def _holdings_changed_conn(conn: PooledConnection, *user_ids: int) -> None:
+    conn.holdings_dirty.update(int(u) for u in user_ids)
+
+# Every users.balance change made through a pooled connection is appended to
+# balance_ledger by these TEMP triggers, inside the same transaction and the
+# same statement (so an executemany is one batch). Writes from anywhere else
+# (sqlite3 shell, scripts) are not ledgered and show up in verify_ledger().
+_LEDGER_TRIGGERS = (
+    """
+    CREATE TEMP TRIGGER IF NOT EXISTS ledger_users_insert AFTER INSERT ON main.users
+    WHEN NEW.balance <> 0
+    BEGIN
+        INSERT INTO balance_ledger (user_id, delta, reason, ref_id, ts)
+        VALUES (NEW.user_id, NEW.balance, ledger_reason(), ledger_ref(), CAST(strftime('%s', 'now') AS INTEGER));
+    END
+    """,
+    """
+    CREATE TEMP TRIGGER IF NOT EXISTS ledger_users_update AFTER UPDATE OF balance ON main.users
+    WHEN NEW.balance IS NOT OLD.balance
+    BEGIN
+        INSERT INTO balance_ledger (user_id, delta, reason, ref_id, ts)
+        VALUES (NEW.user_id, NEW.balance - OLD.balance, ledger_reason(), ledger_ref(), CAST(strftime('%s', 'now') AS INTEGER));
+    END
+    """,
+    """
+    CREATE TEMP TRIGGER IF NOT EXISTS ledger_users_delete AFTER DELETE ON main.users
+    WHEN OLD.balance <> 0
+    BEGIN
+        INSERT INTO balance_ledger (user_id, delta, reason, ref_id, ts)
+        VALUES (OLD.user_id, -OLD.balance, ledger_reason(), ledger_ref(), CAST(strftime('%s', 'now') AS INTEGER));
+    END
+    """,
+)
+
+def _install_ledger_conn(conn: PooledConnection) -> None:
+    """
+    Adds the ledger triggers to a writer connection. A no-op until the
+    migration that creates balance_ledger has run.
+    """
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'balance_ledger'").fetchone()
+    if row is None:
+        return
+    conn.create_function("ledger_reason", 0, lambda: conn.ledger_reason)
+    conn.create_function("ledger_ref", 0, lambda: conn.ledger_ref)
+    for sql in _LEDGER_TRIGGERS:
+        conn.execute(sql)
+    conn.ledger_ready = True
+
+@dataclass
+class DebitResult:
+    """
+    Outcome of a conditional debit. balance is the balance after the debit
+    when ok, the (too small) current balance when insufficient, 0 otherwise.
+    daily is the daily bonus that was credited on the way (see _accrue_daily_conn).
+    """
+    status: Literal["ok", "insufficient", "not_activated"]
+    balance: int = 0
+    daily: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "ok"
+
+def _ledger_note(conn: sqlite3.Connection, reason: str, ref_id: Optional[object] = None) -> Tuple[str, Optional[str]]:
+    """
+    Labels the balance changes this connection makes from now until the next
+    note or until it goes back to the pool. Returns the previous label so a
+    helper running inside someone else's transaction can put it back.
+    """
+    if not isinstance(conn, PooledConnection):
+        return ("other", None)
+    prev = (conn.ledger_reason, conn.ledger_ref)
+    conn.ledger_reason = str(reason)
+    conn.ledger_ref = None if ref_id is None else str(ref_id)
+    return prev
+
 def _column_exists(conn: sqlite3.Connection, table: str, column: str) -> bool:
     cur = conn.execute(f"PRAGMA table_info({table})")
     cols = [r[1] for r in cur.fetchall()]
@@ -447,173 +1206,494 @@ def init_crypto_v2_schema_and_seed(conn: sqlite3.Connection) -> None:
             (sym_u, str(name), float(reserve_money), float(reserve_coin), float(CRYPTO_V2_FEE), now, float(last_price), now, float(last_price)),
         )
 
-    conn.commit()
+def _migration_001_baseline(conn: sqlite3.Connection) -> None:
+    """
+    Schema as of the first versioned release. Also brings databases from older
+    builds (no user_version) up to date: tables are IF NOT EXISTS and missing
+    users/bets columns are backfilled.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL,
+            balance INTEGER NOT NULL,
+            last_daily INTEGER NOT NULL,
+            jailed INTEGER NOT NULL DEFAULT 0,
+            jail_ts INTEGER NOT NULL DEFAULT 0,
+            paroled INTEGER NOT NULL DEFAULT 0,
+            parole_ts INTEGER NOT NULL DEFAULT 0,
+            parole_last_pay_ts INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    # Backfill if older schema
+    if not _column_exists(conn, "users", "jailed"):
+        conn.execute("ALTER TABLE users ADD COLUMN jailed INTEGER NOT NULL DEFAULT 0")
+    if not _column_exists(conn, "users", "jail_ts"):
+        conn.execute("ALTER TABLE users ADD COLUMN jail_ts INTEGER NOT NULL DEFAULT 0")
+    if not _column_exists(conn, "users", "paroled"):
+        conn.execute("ALTER TABLE users ADD COLUMN paroled INTEGER NOT NULL DEFAULT 0")
+    if not _column_exists(conn, "users", "parole_ts"):
+        conn.execute("ALTER TABLE users ADD COLUMN parole_ts INTEGER NOT NULL DEFAULT 0")
+    if not _column_exists(conn, "users", "parole_last_pay_ts"):
+        conn.execute("ALTER TABLE users ADD COLUMN parole_last_pay_ts INTEGER NOT NULL DEFAULT 0")
+
+
+    # Betting tables
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS bets (
+            bet_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER,
+            channel_id INTEGER,
+            creator_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            status TEXT NOT NULL,              -- open|closed|resolved|canceled
+            created_ts INTEGER NOT NULL,
+            closed_ts INTEGER,
+            resolved_ts INTEGER,
+            winning_option INTEGER,
+            bonus_pool INTEGER NOT NULL DEFAULT 0,
+            note TEXT
+        )
+        """
+    )
+    if not _column_exists(conn, "bets", "bonus_pool"):
+        conn.execute("ALTER TABLE bets ADD COLUMN bonus_pool INTEGER NOT NULL DEFAULT 0")
 
-def init_db():
-    with db_lock:
-        conn = db_connect()
-        try:
-            conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT NOT NULL,
-                    balance INTEGER NOT NULL,
-                    last_daily INTEGER NOT NULL,
-                    jailed INTEGER NOT NULL DEFAULT 0,
-                    jail_ts INTEGER NOT NULL DEFAULT 0,
-                    paroled INTEGER NOT NULL DEFAULT 0,
-                    parole_ts INTEGER NOT NULL DEFAULT 0,
-                    parole_last_pay_ts INTEGER NOT NULL DEFAULT 0
-                )
-                """
-            )
-            # Backfill if older schema
-            if not _column_exists(conn, "users", "jailed"):
-                conn.execute("ALTER TABLE users ADD COLUMN jailed INTEGER NOT NULL DEFAULT 0")
-            if not _column_exists(conn, "users", "jail_ts"):
-                conn.execute("ALTER TABLE users ADD COLUMN jail_ts INTEGER NOT NULL DEFAULT 0")
-            if not _column_exists(conn, "users", "paroled"):
-                conn.execute("ALTER TABLE users ADD COLUMN paroled INTEGER NOT NULL DEFAULT 0")
-            if not _column_exists(conn, "users", "parole_ts"):
-                conn.execute("ALTER TABLE users ADD COLUMN parole_ts INTEGER NOT NULL DEFAULT 0")
-            if not _column_exists(conn, "users", "parole_last_pay_ts"):
-                conn.execute("ALTER TABLE users ADD COLUMN parole_last_pay_ts INTEGER NOT NULL DEFAULT 0")
-
-
-            # Betting tables
-            conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS bets (
-                    bet_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    guild_id INTEGER,
-                    channel_id INTEGER,
-                    creator_id INTEGER NOT NULL,
-                    title TEXT NOT NULL,
-                    status TEXT NOT NULL,              -- open|closed|resolved|canceled
-                    created_ts INTEGER NOT NULL,
-                    closed_ts INTEGER,
-                    resolved_ts INTEGER,
-                    winning_option INTEGER,
-                    bonus_pool INTEGER NOT NULL DEFAULT 0,
-                    note TEXT
-                )
-                """
-            )
-            if not _column_exists(conn, "bets", "bonus_pool"):
-                conn.execute("ALTER TABLE bets ADD COLUMN bonus_pool INTEGER NOT NULL DEFAULT 0")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS bet_options (
+            bet_id INTEGER NOT NULL,
+            option_num INTEGER NOT NULL,
+            label TEXT NOT NULL,
+            PRIMARY KEY (bet_id, option_num),
+            FOREIGN KEY (bet_id) REFERENCES bets(bet_id) ON DELETE CASCADE
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS bet_wagers (
+            bet_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            option_num INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            placed_ts INTEGER NOT NULL,
+            PRIMARY KEY (bet_id, user_id, option_num),
+            FOREIGN KEY (bet_id, option_num) REFERENCES bet_options(bet_id, option_num) ON DELETE CASCADE
+        )
+        """
+    )
+    try:
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_bet_one_option_per_user ON bet_wagers (bet_id, user_id)")
+    except sqlite3.IntegrityError:
+        pass
 
-            conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS bet_options (
-                    bet_id INTEGER NOT NULL,
-                    option_num INTEGER NOT NULL,
-                    label TEXT NOT NULL,
-                    PRIMARY KEY (bet_id, option_num),
-                    FOREIGN KEY (bet_id) REFERENCES bets(bet_id) ON DELETE CASCADE
-                )
-                """
-            )
-            conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS bet_wagers (
-                    bet_id INTEGER NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    option_num INTEGER NOT NULL,
-                    amount INTEGER NOT NULL,
-                    placed_ts INTEGER NOT NULL,
-                    PRIMARY KEY (bet_id, user_id, option_num),
-                    FOREIGN KEY (bet_id, option_num) REFERENCES bet_options(bet_id, option_num) ON DELETE CASCADE
-                )
-                """
-            )
-            try:
-                conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_bet_one_option_per_user ON bet_wagers (bet_id, user_id)")
-            except sqlite3.IntegrityError:
-                pass
+    # System state + tax events
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS system_state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tax_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts INTEGER NOT NULL,
+            date_key TEXT NOT NULL,
+            users_taxed INTEGER NOT NULL,
+            total_tax INTEGER NOT NULL
+        )
+        """
+    )
 
-            # System state + tax events
-            conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS system_state (
-                    key TEXT PRIMARY KEY,
-                    value TEXT NOT NULL
-                )
-                """
-            )
-            conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS tax_events (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    ts INTEGER NOT NULL,
-                    date_key TEXT NOT NULL,
-                    users_taxed INTEGER NOT NULL,
-                    total_tax INTEGER NOT NULL
-                )
-                """
-            )
+    # Lottery tickets
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS lottery_tickets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            n1 INTEGER NOT NULL,
+            n2 INTEGER NOT NULL,
+            n3 INTEGER NOT NULL,
+            n4 INTEGER NOT NULL,
+            n5 INTEGER NOT NULL,
+            pb INTEGER NOT NULL,
+            bought_ts INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_lottery_tickets_user_id ON lottery_tickets (user_id)")
 
-            # Lottery tickets
-            conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS lottery_tickets (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    n1 INTEGER NOT NULL,
-                    n2 INTEGER NOT NULL,
-                    n3 INTEGER NOT NULL,
-                    n4 INTEGER NOT NULL,
-                    n5 INTEGER NOT NULL,
-                    pb INTEGER NOT NULL,
-                    bought_ts INTEGER NOT NULL,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
-                )
-                """
-            )
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_lottery_tickets_user_id ON lottery_tickets (user_id)")
+    # Crypto V2 schema and seed
+    init_crypto_v2_schema_and_seed(conn)
 
-            # Crypto V2 schema and seed
-            init_crypto_v2_schema_and_seed(conn)
+def _migration_002_guild_partitions(conn: sqlite3.Connection) -> None:
+    # Routing index for DB_PARTITION_BY_GUILD; only used in DB_PATH itself
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS guild_partitions (
+            guild_id INTEGER PRIMARY KEY,
+            file TEXT NOT NULL,
+            created_ts INTEGER NOT NULL
+        )
+        """
+    )
 
-            conn.commit()
-        finally:
-            conn.close()
+def _migration_003_balance_ledger(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS balance_ledger (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            ref_id TEXT,
+            ts INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_balance_ledger_user ON balance_ledger (user_id, id)")
+    # Per-user ledger sums up to system_state.ledger_checkpoint_id (see verify_ledger)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS balance_ledger_checkpoint (
+            user_id INTEGER PRIMARY KEY,
+            balance INTEGER NOT NULL
+        )
+        """
+    )
+    # Existing balances become each user's opening entry
+    conn.execute(
+        "INSERT INTO balance_ledger (user_id, delta, reason, ts) "
+        "SELECT user_id, balance, 'opening', ? FROM users WHERE balance <> 0",
+        (int(time.time()),),
+    )
 
-# ====================================---------
-# User functions
-# =====================================---
+def _migration_004_users_balance_index(conn: sqlite3.Connection) -> None:
+    # Leaderboard order; get_top_users/get_user_rank fall back to it without the balance cache
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_balance ON users (balance DESC, user_id)")
 
-def get_user(user_id: int) -> Optional[Tuple[int, str, int, int]]:
-    with db_lock:
-        conn = db_connect()
+def _migration_005_price_candles(conn: sqlite3.Connection) -> None:
+    # OHLCV per symbol, interval (seconds) and bucket start; kept current by _v2_candles_conn
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS crypto_v2_candles (
+            symbol TEXT NOT NULL,
+            interval_s INTEGER NOT NULL,
+            bucket_ts INTEGER NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            volume REAL NOT NULL,
+            PRIMARY KEY (symbol, interval_s, bucket_ts)
+        ) WITHOUT ROWID
+        """
+    )
+    _v2_rebuild_candles_conn(conn)
+
+def _migration_006_price_archive(conn: sqlite3.Connection) -> None:
+    # One row per symbol and closed hour of crypto_v2_prices, see _v2_encode_price_hour.
+    # A rowid table on purpose: WITHOUT ROWID would copy the ~1 KB blobs into the interior b-tree pages
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS crypto_v2_price_archive (
+            symbol TEXT NOT NULL,
+            hour_ts INTEGER NOT NULL,
+            points INTEGER NOT NULL,
+            ts_blob BLOB NOT NULL,
+            price_blob BLOB NOT NULL,
+            PRIMARY KEY (symbol, hour_ts)
+        )
+        """
+    )
+
+# Ordered schema migrations: (version, name, fn). PRAGMA user_version records the
+# last one applied. Append new steps at the end; never edit or reorder shipped ones.
+SCHEMA_MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "baseline", _migration_001_baseline),
+    (2, "guild_partitions", _migration_002_guild_partitions),
+    (3, "balance_ledger", _migration_003_balance_ledger),
+    (4, "users_balance_index", _migration_004_users_balance_index),
+    (5, "price_candles", _migration_005_price_candles),
+    (6, "price_archive", _migration_006_price_archive),
+]
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+def migrate_db_conn(conn: sqlite3.Connection) -> int:
+    """
+    Applies pending migrations, each in its own transaction together with the
+    user_version bump. A warm start is a single PRAGMA read.
+    """
+    current = int(conn.execute("PRAGMA user_version").fetchone()[0])
+    if current == SCHEMA_VERSION:
+        return current
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Database schema version {current} is newer than this build supports ({SCHEMA_VERSION}). "
+            f"Refusing to start on {active_db_path()}."
+        )
+
+    for version, name, fn in SCHEMA_MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute("BEGIN")
         try:
-            cur = conn.execute(
-                "SELECT user_id, username, balance, last_daily FROM users WHERE user_id = ?",
-                (int(user_id),),
-            )
-            return cur.fetchone()
-        finally:
-            conn.close()
+            fn(conn)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"[DB] schema migrated to v{version} ({name})")
+    return SCHEMA_VERSION
 
-def insert_user(user_id: int, username: str):
-    now = int(time.time())
+def init_db():
     with db_lock:
         conn = db_connect()
         try:
-            conn.execute(
-                "INSERT INTO users (user_id, username, balance, last_daily) VALUES (?, ?, ?, ?)",
-                (int(user_id), str(username), int(START_BALANCE), now),
-            )
-            conn.commit()
+            migrate_db_conn(conn)
         finally:
             conn.close()
 
-def update_username(user_id: int, username: str):
-    with db_lock:
-        conn = db_connect()
+# -----------------------------
+# Balance ledger
+# -----------------------------
+@dataclass
+class LedgerCheck:
+    from_id: int
+    to_id: int
+    entries: int
+    users: int
+    # (user_id, users.balance, ledger balance)
+    mismatches: List[Tuple[int, int, int]]
+
+def verify_ledger_conn(conn: sqlite3.Connection, full: bool = False) -> LedgerCheck:
+    """
+    Checks users.balance against the ledger. Only entries after the stored
+    checkpoint are summed (one range scan on the primary key); their per-user
+    totals are folded into balance_ledger_checkpoint, then every user is
+    compared against it. full=True rebuilds the checkpoint from the first entry.
+    """
+    from_id = 0 if full else int(_get_state(conn, "ledger_checkpoint_id", "0") or 0)
+    if full:
+        conn.execute("DELETE FROM balance_ledger_checkpoint")
+    to_id = int(conn.execute("SELECT COALESCE(MAX(id), 0) FROM balance_ledger").fetchone()[0])
+    sums = conn.execute(
+        "SELECT user_id, SUM(delta), COUNT(*) FROM balance_ledger WHERE id > ? AND id <= ? GROUP BY user_id",
+        (from_id, to_id),
+    ).fetchall()
+    conn.executemany(
+        "INSERT INTO balance_ledger_checkpoint (user_id, balance) VALUES (?, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET balance = balance + excluded.balance",
+        [(int(uid), int(total)) for uid, total, _n in sums],
+    )
+    _set_state(conn, "ledger_checkpoint_id", str(to_id))
+    mismatches = conn.execute(
+        """
+        SELECT u.user_id, u.balance, COALESCE(c.balance, 0)
+        FROM users u LEFT JOIN balance_ledger_checkpoint c ON c.user_id = u.user_id
+        WHERE u.balance <> COALESCE(c.balance, 0)
+        UNION ALL
+        SELECT c.user_id, 0, c.balance
+        FROM balance_ledger_checkpoint c
+        WHERE c.balance <> 0 AND NOT EXISTS (SELECT 1 FROM users u WHERE u.user_id = c.user_id)
+        """
+    ).fetchall()
+    users = int(conn.execute("SELECT COUNT(*) FROM users").fetchone()[0])
+    return LedgerCheck(
+        from_id=from_id,
+        to_id=to_id,
+        entries=sum(int(n) for _uid, _total, n in sums),
+        users=users,
+        mismatches=[(int(u), int(b), int(l)) for u, b, l in mismatches],
+    )
+
+def verify_ledger(full: bool = False) -> LedgerCheck:
+    with unit_of_work() as conn:
+        return verify_ledger_conn(conn, full)
+
+def get_ledger_entries(user_id: int, limit: int = 10) -> List[Tuple[int, int, str, Optional[str], int]]:
+    """
+    Newest first: (id, delta, reason, ref_id, ts).
+    """
+    conn = db_connect_read()
+    try:
+        return conn.execute(
+            "SELECT id, delta, reason, ref_id, ts FROM balance_ledger WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+            (int(user_id), int(limit)),
+        ).fetchall()
+    finally:
+        conn.close()
+
+# ====================================---------
+# User functions
+# =====================================---
+
+@dataclass
+class UserRow:
+    """
+    Everything commands check about their caller, read in one go by
+    get_user_row(). as_user() is the get_user() tuple.
+    """
+    user_id: int
+    username: str
+    balance: int
+    last_daily: int
+    jailed: bool
+    jail_ts: int
+    paroled: bool
+    parole_ts: int
+    parole_last_pay_ts: int
+
+    def as_user(self) -> Tuple[int, str, int, int]:
+        return (self.user_id, self.username, self.balance, self.last_daily)
+
+def get_user_row(user_id: int) -> Optional[UserRow]:
+    conn = db_connect_read()
+    try:
+        row = conn.execute(
+            """
+            SELECT user_id, username, balance, last_daily, jailed, jail_ts, paroled, parole_ts, parole_last_pay_ts
+            FROM users WHERE user_id = ?
+            """,
+            (int(user_id),),
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    cached = balance_cache.get(row[0])
+    return UserRow(
+        user_id=int(row[0]),
+        username=str(row[1]),
+        balance=int(row[2]) if cached is None else cached,
+        last_daily=int(row[3]),
+        jailed=int(row[4]) == 1,
+        jail_ts=int(row[5]),
+        paroled=int(row[6]) == 1,
+        parole_ts=int(row[7]),
+        parole_last_pay_ts=int(row[8]),
+    )
+
+def get_user(user_id: int) -> Optional[Tuple[int, str, int, int]]:
+    conn = db_connect_read()
+    try:
+        cur = conn.execute(
+            "SELECT user_id, username, balance, last_daily FROM users WHERE user_id = ?",
+            (int(user_id),),
+        )
+        row = cur.fetchone()
+    finally:
+        conn.close()
+    if row is not None:
+        # Game winnings/losses not yet written back live in the balance cache
+        cached = balance_cache.get(row[0])
+        if cached is not None:
+            row = (row[0], row[1], cached, row[3])
+    return row
+
+def _get_user_conn(conn: sqlite3.Connection, user_id: int) -> Optional[Tuple[int, str, int, int]]:
+    """
+    get_user() on an open writer transaction (sees its own uncommitted writes).
+    """
+    row = conn.execute(
+        "SELECT user_id, username, balance, last_daily FROM users WHERE user_id = ?",
+        (int(user_id),),
+    ).fetchone()
+    if row is not None:
+        row = (row[0], row[1], int(row[2]) + balance_cache.unflushed(row[0]), row[3])
+    return row
+
+def _touch_user_conn(conn: sqlite3.Connection, user_id: int, username: Optional[str]) -> Optional[Tuple[int, str, int, int]]:
+    """
+    Activation check + username refresh (what require_activated does) on an open
+    transaction. Returns the user row, or None if the user is not activated.
+    A changed name is queued in usernames, not written here.
+    """
+    row = _get_user_conn(conn, user_id)
+    if row is not None and username is not None:
+        usernames.note(user_id, username, stored=row[1])
+        row = (row[0], str(username), row[2], row[3])
+    return row
+
+def daily_due(last_daily: int, now: Optional[int] = None) -> int:
+    """
+    Daily bonus a user with this last_daily could claim right now (0 if not due).
+    Read paths add it to the displayed balance; it is only credited by the next
+    debit or !daily (see _accrue_daily_conn).
+    """
+    now = int(time.time()) if now is None else int(now)
+    return int(DAILY_CREDITS) if now - int(last_daily) >= DAILY_SECONDS else 0
+
+def _accrue_daily_conn(conn: sqlite3.Connection, user_id: int, now: int) -> Optional[int]:
+    """
+    Credits the daily bonus if it is due, on an open transaction. The due check
+    is the UPDATE's own WHERE, so two claims can't both pay, and when nothing is
+    due no row changes (no ledger entry, no cache refresh). Returns the new
+    balance (pending cache deltas included), or None if nothing was credited.
+    """
+    uid = int(user_id)
+    prev = _ledger_note(conn, "daily")
+    try:
+        rows = conn.execute(
+            "UPDATE users SET balance = balance + ?, last_daily = ? WHERE user_id = ? AND ? - last_daily >= ? RETURNING balance",
+            (int(DAILY_CREDITS), int(now), uid, int(now), int(DAILY_SECONDS)),
+        ).fetchall()
+    finally:
+        _ledger_note(conn, *prev)
+    if not rows:
+        return None
+    # Additive, so deltas still pending in the balance cache are left alone
+    _balance_changed_conn(conn, uid)
+    return int(rows[0][0]) + balance_cache.unflushed(uid)
+
+def _debit_conn(conn: sqlite3.Connection, user_id: int, amount: int, accrue: bool = True) -> DebitResult:
+    """
+    Takes amount from the user only if they can cover it, in one statement:
+    the check and the write can't be split by another writer, and the
+    success path needs no separate read. Deltas still pending in the balance
+    cache count towards the balance, like in _get_user_conn().
+
+    A daily bonus that has come due is credited first, in the same transaction,
+    so it counts towards the stake (lazy accrual, see daily_due()). Pass
+    accrue=False when the user isn't the one acting (a steal target, !take):
+    their bonus waits for their own next command.
+    """
+    uid = int(user_id)
+    amount = int(amount)
+    daily = 0
+    if accrue and _accrue_daily_conn(conn, uid, int(time.time())) is not None:
+        daily = int(DAILY_CREDITS)
+    new_bal = balance_cache.debit_conn(conn, uid, amount)
+    if new_bal is not None:
+        _balance_changed_conn(conn, uid)
+        return DebitResult("ok", new_bal, daily)
+    row = conn.execute("SELECT balance FROM users WHERE user_id = ?", (uid,)).fetchone()
+    if row is None:
+        return DebitResult("not_activated")
+    return DebitResult("insufficient", int(row[0]) + balance_cache.unflushed(uid), daily)
+
+def insert_user(user_id: int, username: str):
+    now = int(time.time())
+    with db_lock:
+        conn = db_connect()
         try:
-            conn.execute("UPDATE users SET username = ? WHERE user_id = ?", (str(username), int(user_id)))
+            _ledger_note(conn, "activate")
+            conn.execute(
+                "INSERT INTO users (user_id, username, balance, last_daily) VALUES (?, ?, ?, ?)",
+                (int(user_id), str(username), int(START_BALANCE), now),
+            )
             conn.commit()
+            balance_cache.set_base(user_id, START_BALANCE)
+            member_index.add_user(user_id)
         finally:
             conn.close()
 
@@ -621,8 +1701,11 @@ def set_balance(user_id: int, balance: int):
     with db_lock:
         conn = db_connect()
         try:
-            conn.execute("UPDATE users SET balance = ? WHERE user_id = ?", (int(balance), int(user_id)))
+            balance_cache.flush_conn(conn, [user_id])
+            _ledger_note(conn, "admin")
+            balance_cache.set_conn(conn, user_id, balance)
             conn.commit()
+            balance_cache.refresh_conn(conn, [user_id])
         finally:
             conn.close()
 
@@ -630,56 +1713,1427 @@ def add_balance(user_id: int, amount: int) -> None:
     with db_lock:
         conn = db_connect()
         try:
+            _ledger_note(conn, "admin")
             conn.execute(
                 "UPDATE users SET balance = balance + ? WHERE user_id = ?",
                 (int(amount), int(user_id)),
             )
             conn.commit()
+            balance_cache.refresh_conn(conn, [user_id])
         finally:
             conn.close()
 
-def apply_daily_if_due(user_id: int) -> int:
-    row = get_user(user_id)
-    if row is None:
-        return 0
-    _, _, balance, last_daily = row
-    now = int(time.time())
-    if now - int(last_daily) >= DAILY_SECONDS:
-        new_balance = int(balance) + int(DAILY_CREDITS)
+def take_balance(user_id: int, username: Optional[str], amount: int) -> Optional[Tuple[int, int]]:
+    """
+    Owner !take: removes up to amount, never below 0, as one conditional debit.
+    Returns (taken, new balance), or None if the user is not activated.
+    """
+    with unit_of_work() as conn:
+        row = _touch_user_conn(conn, user_id, username)
+        if row is None:
+            return None
+        take = min(int(amount), max(0, int(row[2])))
+        if take <= 0:
+            return 0, int(row[2])
+        _ledger_note(conn, "admin")
+        debit = _debit_conn(conn, user_id, take, accrue=False)
+        return take, debit.balance
+
+def apply_balance_batch(ops: List[Tuple[str, int, int]]) -> List[object]:
+    """
+    Applies ("add", user_id, amount) / ("set", user_id, balance) /
+    ("debit", user_id, amount) ops in ONE transaction. Each op runs inside
+    its own SAVEPOINT, so a failing op is rolled back on its own.
+
+    Returns one result per op: the new balance (a DebitResult for debits),
+    None if the user row is missing, or the exception that op raised.
+    """
+    results: List[object] = []
+    with db_lock:
+        conn = db_connect()
+        try:
+            balance_cache.flush_conn(conn, [uid for _op, uid, _amount in ops])
+            _ledger_note(conn, "games")
+            conn.execute("BEGIN")
+            for op, uid, amount in ops:
+                conn.execute("SAVEPOINT balance_op")
+                try:
+                    if op == "debit":
+                        res = _debit_conn(conn, uid, amount)
+                    elif op == "set":
+                        res = balance_cache.set_conn(conn, uid, amount)
+                    elif op == "add":
+                        rows = conn.execute(
+                            "UPDATE users SET balance = balance + ? WHERE user_id = ? RETURNING balance", (int(amount), int(uid))
+                        ).fetchall()
+                        res = int(rows[0][0]) if rows else None
+                    else:
+                        raise ValueError(f"unknown balance op {op!r}")
+                    conn.execute("RELEASE balance_op")
+                    results.append(res)
+                except (sqlite3.Error, ValueError) as e:
+                    conn.execute("ROLLBACK TO balance_op")
+                    conn.execute("RELEASE balance_op")
+                    results.append(e)
+            conn.commit()
+            balance_cache.refresh_conn(conn, [uid for _op, uid, _amount in ops])
+        finally:
+            conn.close()
+    return results
+
+def _group_commit_window_ms() -> float:
+    """
+    How long an idle batch waits for company. Lingering only pays off when a
+    commit costs an fsync: under WAL + synchronous=NORMAL commits don't sync,
+    so ops are still batched while a commit is running but never delayed.
+    """
+    if GROUP_COMMIT_WINDOW_MS is not None:
+        return float(GROUP_COMMIT_WINDOW_MS)
+    sync = str(DB_SYNCHRONOUS).upper()
+    wal = str(DB_JOURNAL_MODE).upper() == "WAL"
+    if sync in ("FULL", "EXTRA") or (sync == "NORMAL" and not wal):
+        return 1.0
+    return 0.0
+
+class _GroupCommitter:
+    """
+    Batches ops submitted from the event loop and hands each batch to
+    _apply() on the writer thread; see BalanceGroupCommitter.
+    """
+
+    def __init__(self):
+        self._pending: List[Tuple[tuple, asyncio.Future]] = []
+        self._timer: Optional[asyncio.Handle] = None
+        self._inflight = False
+
+    def _apply(self, ops: List[tuple]) -> List[object]:
+        raise NotImplementedError
+
+    async def _submit(self, op: tuple):
+        if not GROUP_COMMIT_ENABLED:
+            res = (await db.run(self._apply, [op]))[0]
+            if isinstance(res, Exception):
+                raise res
+            return res
+
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((op, fut))
+        if self._inflight:
+            # The running batch picks these up as soon as it commits
+            pass
+        elif len(self._pending) >= GROUP_COMMIT_MAX_BATCH:
+            self._kick()
+        elif self._timer is None:
+            window_ms = _group_commit_window_ms()
+            if window_ms > 0:
+                self._timer = loop.call_later(window_ms / 1000.0, self._kick)
+            else:
+                # Still picks up ops submitted in the same loop iteration
+                self._timer = loop.call_soon(self._kick)
+        return await fut
+
+    def _kick(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch = self._pending[:GROUP_COMMIT_MAX_BATCH]
+        self._pending = self._pending[GROUP_COMMIT_MAX_BATCH:]
+        if batch:
+            self._inflight = True
+            asyncio.ensure_future(self._flush(batch))
+
+    async def _flush(self, batch: List[Tuple[tuple, asyncio.Future]]) -> None:
+        try:
+            results = await db.run(self._apply, [op for op, _fut in batch])
+        except Exception as e:
+            for _op, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        finally:
+            self._inflight = False
+            if self._pending:
+                self._kick()
+        for (_op, fut), res in zip(batch, results):
+            if fut.done():
+                continue
+            if isinstance(res, Exception):
+                fut.set_exception(res)
+            else:
+                fut.set_result(res)
+
+class BalanceGroupCommitter(_GroupCommitter):
+    """
+    Group commit for the game balance writes (slot, roulette, plinko,
+    blackjack) when the balance cache is disabled or doesn't know the user.
+    Ops that arrive within the linger window, or while the previous batch is
+    still committing, are committed together, so a burst of spins costs one
+    fsync instead of one each. Every caller still gets its own result or
+    exception.
+
+    bench.py measures it under both synchronous=NORMAL and FULL; the gap
+    over commit-per-write depends on how expensive a commit is on the host.
+
+        new_bal = await balance_writes.add(user_id, -bet)
+    """
+
+    def _apply(self, ops: List[tuple]) -> List[object]:
+        return apply_balance_batch(ops)
+
+    async def add(self, user_id: int, amount: int) -> Optional[int]:
+        return await self._submit(("add", int(user_id), int(amount)))
+
+    async def set(self, user_id: int, balance: int) -> Optional[int]:
+        return await self._submit(("set", int(user_id), int(balance)))
+
+    async def debit(self, user_id: int, amount: int) -> DebitResult:
+        return await self._submit(("debit", int(user_id), int(amount)))
+
+balance_writes = PartitionLocal(BalanceGroupCommitter)
+
+class RankIndex:
+    """
+    Order-statistic index over (-balance, user_id), i.e. leaderboard order.
+
+    Keys live in sorted buckets of about RANK_BUCKET_SIZE; a Fenwick tree over
+    the bucket sizes turns "how many keys come before this one" into
+    O(log n), and so does finding the bucket holding position k. Moving a
+    key is a bisect plus an insert/delete in one small list. Not
+    thread-safe: BalanceCache drives it under its own lock.
+    """
+
+    def __init__(self):
+        self._buckets: List[List[Tuple[int, int]]] = []
+        self._maxes: List[Tuple[int, int]] = []
+        self._tree: List[int] = [0]
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def build(self, balances: Dict[int, int]) -> None:
+        keys = sorted((-int(bal), int(uid)) for uid, bal in balances.items())
+        size = RANK_BUCKET_SIZE
+        self._buckets = [keys[i:i + size] for i in range(0, len(keys), size)]
+        self._len = len(keys)
+        self._rebuild()
+
+    def _rebuild(self) -> None:
+        self._maxes = [b[-1] for b in self._buckets]
+        tree = [0] * (len(self._buckets) + 1)
+        for i, b in enumerate(self._buckets, start=1):
+            tree[i] += len(b)
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, i: int, delta: int) -> None:
+        i += 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _before(self, i: int) -> int:
+        # Keys in buckets [0, i)
+        total = 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, pos: int) -> Tuple[int, int]:
+        # (bucket, offset) of the key at position pos
+        i = 0
+        step = 1 << (len(self._tree).bit_length() - 1)
+        while step:
+            nxt = i + step
+            if nxt < len(self._tree) and self._tree[nxt] <= pos:
+                i = nxt
+                pos -= self._tree[nxt]
+            step >>= 1
+        return i, pos
+
+    def insert(self, user_id: int, balance: int) -> None:
+        key = (-int(balance), int(user_id))
+        self._len += 1
+        if not self._buckets:
+            self._buckets = [[key]]
+            self._rebuild()
+            return
+        i = min(bisect.bisect_left(self._maxes, key), len(self._buckets) - 1)
+        b = self._buckets[i]
+        bisect.insort(b, key)
+        self._maxes[i] = b[-1]
+        if len(b) > 2 * RANK_BUCKET_SIZE:
+            half = len(b) // 2
+            self._buckets[i:i + 1] = [b[:half], b[half:]]
+            self._rebuild()
+        else:
+            self._tree_add(i, 1)
+
+    def remove(self, user_id: int, balance: int) -> None:
+        key = (-int(balance), int(user_id))
+        i = bisect.bisect_left(self._maxes, key)
+        if i == len(self._buckets):
+            return
+        b = self._buckets[i]
+        j = bisect.bisect_left(b, key)
+        if j == len(b) or b[j] != key:
+            return
+        del b[j]
+        self._len -= 1
+        if b:
+            self._maxes[i] = b[-1]
+            self._tree_add(i, -1)
+        else:
+            del self._buckets[i]
+            self._rebuild()
+
+    def move(self, user_id: int, old: Optional[int], new: int) -> None:
+        if old == new:
+            return
+        if old is not None:
+            # Most balance changes are small and keep the key in its bucket:
+            # no bucket size changes, so the Fenwick tree is left alone
+            uid = int(user_id)
+            key, new_key = (-int(old), uid), (-int(new), uid)
+            i = bisect.bisect_left(self._maxes, key)
+            if i < len(self._buckets):
+                b = self._buckets[i]
+                lo = self._maxes[i - 1] if i else None
+                if len(b) > 1 and (lo is None or new_key > lo) and new_key < b[-1] and key != b[-1]:
+                    j = bisect.bisect_left(b, key)
+                    if j < len(b) and b[j] == key:
+                        del b[j]
+                        bisect.insort(b, new_key)
+                        return
+            self.remove(uid, old)
+        self.insert(user_id, new)
+
+    def rank(self, user_id: int, balance: int) -> int:
+        """
+        0-based position of the user in leaderboard order.
+        """
+        key = (-int(balance), int(user_id))
+        i = bisect.bisect_left(self._maxes, key)
+        if i == len(self._buckets):
+            return self._len
+        return self._before(i) + bisect.bisect_left(self._buckets[i], key)
+
+    def page(self, offset: int, limit: int) -> List[Tuple[int, int]]:
+        """
+        (user_id, balance) for positions [offset, offset + limit).
+        """
+        out: List[Tuple[int, int]] = []
+        if offset >= self._len or limit <= 0:
+            return out
+        i, j = self._locate(max(0, int(offset)))
+        while i < len(self._buckets) and len(out) < limit:
+            for neg_bal, uid in self._buckets[i][j:j + limit - len(out)]:
+                out.append((uid, -neg_bal))
+            i, j = i + 1, 0
+        return out
+
+class NetWorthBoard:
+    """
+    Players in net worth order: cash + sum(coins * last_price) over their
+    crypto holdings, rounded down to whole money. Owned by BalanceCache.
+
+    Writes only record what changed (O(1)); the next query folds them in:
+    - cash / holdings changes re-rank just those users;
+    - a price move re-rates only that symbol's holders, by coins * price
+      delta from the per-symbol holder table, instead of recomputing everyone.
+    Holders and cash-only players sit in separate RankIndexes and queries
+    merge the two, so when a tick moved most holders only the holder index
+    is rebuilt (one sort); the cash-only players never move on a tick.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cash: Dict[int, int] = {}
+        self._coins: Dict[int, Dict[str, float]] = {}      # user -> symbol -> coins
+        self._holders: Dict[str, Dict[int, float]] = {}    # symbol -> user -> coins
+        self._prices: Dict[str, float] = {}                # prices _crypto is valued at
+        self._crypto: Dict[int, float] = {}
+        self._worth: Dict[int, int] = {}
+        self._dirty: Set[int] = set()
+        self._holder_ranks = RankIndex()
+        self._cash_ranks = RankIndex()
+        self._in_holder_ranks: Set[int] = set()
+        self.loaded = False
+
+    def load(self, balances: Dict[int, int], holdings: List[Tuple[int, str, float]], prices: Dict[str, float]) -> None:
+        with self._lock:
+            self._cash = dict(balances)
+            self._coins = {}
+            self._holders = {}
+            self._prices = dict(prices)
+            self._crypto = {}
+            for uid, sym, coins in holdings:
+                if coins > 0:
+                    self._coins.setdefault(uid, {})[sym] = coins
+                    self._holders.setdefault(sym, {})[uid] = coins
+                    self._crypto[uid] = self._crypto.get(uid, 0.0) + coins * self._prices.get(sym, 0.0)
+            self._worth = {uid: self._value(uid) for uid in self._cash}
+            self._in_holder_ranks = {uid for uid in self._coins if uid in self._worth}
+            self._holder_ranks.build({uid: self._worth[uid] for uid in self._in_holder_ranks})
+            self._cash_ranks.build({uid: w for uid, w in self._worth.items() if uid not in self._in_holder_ranks})
+            self._dirty = set()
+            self.loaded = True
+
+    def set_cash(self, user_id: int, cash: int) -> None:
+        with self._lock:
+            if self.loaded:
+                self._cash[user_id] = cash
+                self._dirty.add(user_id)
+
+    def set_holdings(self, user_id: int, coins: Dict[str, float]) -> None:
+        with self._lock:
+            if not self.loaded:
+                return
+            for sym in self._coins.pop(user_id, {}):
+                self._holders.get(sym, {}).pop(user_id, None)
+            coins = {sym: c for sym, c in coins.items() if c > 0}
+            if coins:
+                self._coins[user_id] = coins
+                for sym, c in coins.items():
+                    self._holders.setdefault(sym, {})[user_id] = c
+            self._crypto[user_id] = sum(c * self._prices.get(sym, 0.0) for sym, c in coins.items())
+            self._dirty.add(user_id)
+
+    def _value(self, uid: int) -> int:
+        return int(math.floor(self._cash.get(uid, 0) + self._crypto.get(uid, 0.0)))
+
+    def _sync_locked(self, prices: Dict[str, float]) -> None:
+        for sym, price in prices.items():
+            delta = price - self._prices.get(sym, 0.0)
+            self._prices[sym] = price
+            if not delta:
+                continue
+            holders = self._holders.get(sym)
+            if holders:
+                crypto = self._crypto
+                for uid, coins in holders.items():
+                    crypto[uid] += coins * delta
+                self._dirty.update(holders)
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        rebuild = sum(1 for uid in dirty if uid in self._coins) * 4 > len(self._holder_ranks)
+        cash, crypto, worth = self._cash, self._crypto, self._worth
+        for uid in dirty:
+            if uid not in cash:
+                continue
+            old = worth.get(uid)
+            new = worth[uid] = int(math.floor(cash[uid] + crypto.get(uid, 0.0)))
+            was_holder = uid in self._in_holder_ranks
+            is_holder = uid in self._coins
+            if was_holder != is_holder:
+                if old is not None:
+                    (self._holder_ranks if was_holder else self._cash_ranks).remove(uid, old)
+                old = None
+                if is_holder:
+                    self._in_holder_ranks.add(uid)
+                else:
+                    self._in_holder_ranks.discard(uid)
+            if is_holder:
+                if not rebuild:
+                    self._holder_ranks.move(uid, old, new)
+            else:
+                self._cash_ranks.move(uid, old, new)
+        if rebuild:
+            self._holder_ranks.build({uid: self._worth[uid] for uid in self._in_holder_ranks})
+
+    def top(self, offset: int, limit: int, prices: Dict[str, float]) -> Optional[List[Tuple[int, int]]]:
+        """
+        (user_id, net worth) in order at these prices, or None if not loaded.
+        Merges both indexes from the top, so deep pages cost O(offset).
+        """
+        with self._lock:
+            if not self.loaded:
+                return None
+            self._sync_locked(prices)
+            end = max(0, int(offset)) + max(0, int(limit))
+            merged = heapq.merge(
+                self._holder_ranks.page(0, end),
+                self._cash_ranks.page(0, end),
+                key=lambda e: (-e[1], e[0]),
+            )
+            return list(itertools.islice(merged, max(0, int(offset)), end))
+
+    def rank(self, user_id: int, prices: Dict[str, float]) -> Optional[Tuple[int, int, int]]:
+        """
+        (0-based position, net worth, number of players), or None if unknown.
+        """
+        with self._lock:
+            if not self.loaded or user_id not in self._cash:
+                return None
+            self._sync_locked(prices)
+            worth = self._worth[user_id]
+            pos = self._holder_ranks.rank(user_id, worth) + self._cash_ranks.rank(user_id, worth)
+            return pos, worth, len(self._holder_ranks) + len(self._cash_ranks)
+
+class BalanceCache:
+    """
+    Authoritative in-memory balance table for the games.
+
+    A user's balance is _base (value last seen committed in users) plus
+    _inflight/_pending (deltas not yet written back). Every delta is
+    appended to an on-disk journal before it is applied; the journal is
+    fsynced in batches by balance_cache_daemon. flush() writes pending
+    deltas back additively and stores the last journal seq it covered in
+    system_state in the same commit, so replay after a crash applies each
+    entry exactly once. flush_conn(conn, user_ids) does the same for just
+    those users and records a per-user seq ("balance_journal_seq:<uid>").
+
+    The ledger sees a flush, not each game: every user in it gets one "games"
+    row with their net delta and ref "journal:<seq>". The journal lines up
+    to that seq are the per-game detail until compaction folds them.
+
+    Code that changes users.balance in SQL may call flush_conn() for its
+    users before it starts (it commits on its own), and calls refresh_conn()
+    after it commits. A flush is not a barrier: new deltas can land right
+    after it, so balances read in SQL add unflushed(), and debits / absolute
+    sets go through debit_conn() / set_conn(), never SET balance = <value read>.
+
+    Nothing slow happens under _lock: fsyncs and journal compaction run on
+    the daemon's worker thread, so add() on the event loop never waits on disk.
+    The only SQL run under it are debit_conn()'s and set_conn()'s single-row
+    UPDATEs, which keep SQL-side writes and try_debit() from racing.
+
+    _ranks mirrors the current balances in leaderboard order; every write
+    below moves the user in it, so !leaders and !rank never sort or scan.
+    worth (NetWorthBoard) is told about the same writes for !networth.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._base: Dict[int, int] = {}
+        self._inflight: Dict[int, int] = {}
+        self._pending: Dict[int, int] = {}
+        self._journal = None
+        self._journal_path = ""
+        self._seq = 0
+        self._dirty_journal = False
+        self._compacting = False
+        self._tail: List[str] = []
+        self._ranks = RankIndex()
+        self.worth = NetWorthBoard()
+        self.loaded = False
+
+    # ---- reads / writes (any thread, O(1)) ----
+
+    def get(self, user_id: int) -> Optional[int]:
+        uid = int(user_id)
+        with self._lock:
+            if not self.loaded or uid not in self._base:
+                return None
+            return self._balance_locked(uid)
+
+    def add(self, user_id: int, delta: int) -> Optional[int]:
+        """
+        Returns the new balance, or None if the user is unknown to the cache.
+        """
+        uid = int(user_id)
+        with self._lock:
+            if not self.loaded or uid not in self._base:
+                return None
+            return self._add_locked(uid, int(delta))
+
+    def top(self, offset: int, limit: int) -> Optional[List[Tuple[int, int]]]:
+        """
+        (user_id, balance) in leaderboard order, or None if the cache is not loaded.
+        """
+        with self._lock:
+            if not self.loaded:
+                return None
+            return self._ranks.page(offset, limit)
+
+    def rank(self, user_id: int) -> Optional[Tuple[int, int, int]]:
+        """
+        (0-based position, balance, number of users), or None if the user is
+        unknown to the cache.
+        """
+        uid = int(user_id)
+        with self._lock:
+            if not self.loaded or uid not in self._base:
+                return None
+            bal = self._balance_locked(uid)
+            return self._ranks.rank(uid, bal), bal, len(self._ranks)
+
+    def _balance_locked(self, uid: int) -> int:
+        return self._base[uid] + self._inflight.get(uid, 0) + self._pending.get(uid, 0)
+
+    def try_debit(self, user_id: int, amount: int) -> Optional["DebitResult"]:
+        """
+        Check-and-debit in one step under the cache lock, the in-memory twin
+        of _debit_conn(). None if the user is unknown to the cache.
+        """
+        uid = int(user_id)
+        amount = int(amount)
+        with self._lock:
+            if not self.loaded or uid not in self._base:
+                return None
+            bal = self._balance_locked(uid)
+            if bal < amount:
+                return DebitResult("insufficient", bal)
+            return DebitResult("ok", self._add_locked(uid, -amount))
+
+    def _add_locked(self, uid: int, delta: int) -> int:
+        old = self._balance_locked(uid)
+        if delta:
+            self._seq += 1
+            line = f"{self._seq}\t{uid}\t{delta}\n"
+            self._journal.write(line)
+            if self._compacting:
+                self._tail.append(line)
+            self._dirty_journal = True
+            self._pending[uid] = self._pending.get(uid, 0) + delta
+            self._ranks.move(uid, old, old + delta)
+            self.worth.set_cash(uid, old + delta)
+        return old + delta
+
+    def _set_base_locked(self, uid: int, balance: int) -> None:
+        old = self._balance_locked(uid) if uid in self._base else None
+        self._base[uid] = balance
+        new = self._balance_locked(uid)
+        self._ranks.move(uid, old, new)
+        self.worth.set_cash(uid, new)
+
+    def unflushed(self, user_id: int) -> int:
+        """
+        Delta not yet in the users table. On the writer thread this is what
+        to add to a balance read inside a transaction.
+        """
+        uid = int(user_id)
+        with self._lock:
+            return self._inflight.get(uid, 0) + self._pending.get(uid, 0)
+
+    def debit_conn(self, conn: sqlite3.Connection, user_id: int, amount: int) -> Optional[int]:
+        """
+        The SQL side of a conditional debit (see _debit_conn). The pending
+        deltas it counts and the UPDATE happen under one hold of _lock, and
+        the new balance is mirrored into _base before the lock is released,
+        so a try_debit() on the event loop can't spend the same funds while
+        this transaction is still open. If it rolls back, the pool's release()
+        re-reads the user. Returns the new balance (pending deltas included),
+        or None if the user can't cover amount or doesn't exist.
+
+        The only statements run under _lock are this and set_conn()'s
+        single-row UPDATE by key.
+        """
+        uid = int(user_id)
+        amount = int(amount)
+        with self._lock:
+            pending = self._inflight.get(uid, 0) + self._pending.get(uid, 0)
+            rows = conn.execute(
+                "UPDATE users SET balance = balance - ? WHERE user_id = ? AND balance + ? >= ? RETURNING balance",
+                (amount, uid, pending, amount),
+            ).fetchall()
+            if not rows:
+                return None
+            if self.loaded and uid in self._base:
+                self._set_base_locked(uid, int(rows[0][0]))
+            return int(rows[0][0]) + pending
+
+    def set_conn(self, conn: sqlite3.Connection, user_id: int, balance: int) -> Optional[int]:
+        """
+        Sets the user's balance to exactly `balance`, pending deltas included:
+        users gets balance minus what is still pending, read under _lock like
+        debit_conn(). Returns the balance, or None if the user doesn't exist.
+        """
+        uid = int(user_id)
+        with self._lock:
+            pending = self._inflight.get(uid, 0) + self._pending.get(uid, 0)
+            rows = conn.execute(
+                "UPDATE users SET balance = ? WHERE user_id = ? RETURNING balance", (int(balance) - pending, uid)
+            ).fetchall()
+            if not rows:
+                return None
+            if self.loaded and uid in self._base:
+                self._set_base_locked(uid, int(rows[0][0]))
+            return int(rows[0][0]) + pending
+
+    def set_base(self, user_id: int, balance: int) -> None:
+        with self._lock:
+            if self.loaded:
+                self._set_base_locked(int(user_id), int(balance))
+
+    # ---- journal ----
+
+    def sync_journal(self) -> None:
+        with self._lock:
+            if self._journal is None or not self._dirty_journal:
+                return
+            self._journal.flush()
+            # fsync a duplicate so a compaction swapping/closing the journal
+            # meanwhile can't leave us syncing a closed or reused descriptor
+            fd = os.dup(self._journal.fileno())
+            self._dirty_journal = False
+        try:
+            os.fsync(fd)
+        except OSError:
+            with self._lock:
+                self._dirty_journal = True
+            raise
+        finally:
+            os.close(fd)
+
+    def journal_bytes(self) -> int:
+        with self._lock:
+            return self._journal.tell() if self._journal is not None else 0
+
+    def _read_journal(self) -> List[Tuple[int, int, int]]:
+        entries: List[Tuple[int, int, int]] = []
+        if not os.path.exists(self._journal_path):
+            return entries
+        with open(self._journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) != 3:
+                    # torn tail write from a crash; nothing after it was synced
+                    break
+                try:
+                    entries.append((int(parts[0]), int(parts[1]), int(parts[2])))
+                except ValueError:
+                    break
+        return entries
+
+    def _reset_journal_locked(self) -> None:
+        """
+        Start an empty journal. Only for load, when nothing is pending.
+        """
+        tmp = self._journal_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.flush()
+            os.fsync(f.fileno())
+        if self._journal is not None:
+            self._journal.close()
+        os.replace(tmp, self._journal_path)
+        self._journal = open(self._journal_path, "a", encoding="utf-8")
+        self._dirty_journal = False
+
+    def compact_journal(self) -> bool:
+        """
+        Rewrites the journal down to one line per user with a pending delta.
+        The new file is written and fsynced without holding _lock (add()
+        keeps appending to the old journal and a copy of those lines is
+        replayed into the new one), then swapped in under the lock.
+        Skipped while a flush is in flight. Returns True if it compacted.
+        """
+        with self._lock:
+            if not self.loaded or self._journal is None or self._compacting or self._inflight:
+                return False
+            pending = [(uid, delta) for uid, delta in self._pending.items() if delta]
+            # Fresh seqs above everything journaled so far; any later flush covers them
+            first_seq = self._seq + 1
+            self._seq += len(pending)
+            self._compacting = True
+            self._tail = []
+            path = self._journal_path
+
+        tmp = path + ".tmp"
+        f = None
+        try:
+            f = open(tmp, "w", encoding="utf-8")
+            f.writelines(f"{first_seq + i}\t{uid}\t{delta}\n" for i, (uid, delta) in enumerate(pending))
+            f.flush()
+            os.fsync(f.fileno())
+            for attempt in range(5):
+                with self._lock:
+                    tail, self._tail = self._tail, []
+                    if not tail or attempt == 4:
+                        if tail:
+                            # Still racing a burst: take the rest unsynced, the daemon syncs it next tick
+                            f.writelines(tail)
+                            self._dirty_journal = True
+                        f.flush()
+                        os.replace(tmp, path)
+                        old, self._journal = self._journal, f
+                        self._compacting = False
+                        f = None
+                        old.close()
+                        return True
+                f.writelines(tail)
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            if f is not None:
+                f.close()
+                with self._lock:
+                    self._compacting = False
+                    self._tail = []
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+        return False
+
+    # ---- database side (writer thread) ----
+
+    def load_conn(self, conn: sqlite3.Connection) -> None:
+        """
+        Replays unflushed journal entries into users, then loads every balance.
+        """
+        self._journal_path = active_db_path() + BALANCE_JOURNAL_SUFFIX
+        flushed_seq = int(_get_state(conn, "balance_journal_seq", "0") or 0)
+        user_seqs = {
+            int(key.split(":", 1)[1]): int(value)
+            for key, value in conn.execute(
+                "SELECT key, value FROM system_state WHERE key LIKE 'balance_journal_seq:%'"
+            ).fetchall()
+        }
+        entries = self._read_journal()
+        replay = [
+            (delta, uid) for seq, uid, delta in entries
+            if seq > max(flushed_seq, user_seqs.get(uid, 0))
+        ]
+        last_seq = max([flushed_seq] + list(user_seqs.values()) + [seq for seq, _uid, _delta in entries])
+        if replay:
+            _ledger_note(conn, "games", "journal")
+            conn.executemany("UPDATE users SET balance = balance + ? WHERE user_id = ?", replay)
+            print(f"[BALANCE] replayed {len(replay)} journal entries past seq {flushed_seq}")
+        _set_state(conn, "balance_journal_seq", str(last_seq))
+        conn.execute("DELETE FROM system_state WHERE key LIKE 'balance_journal_seq:%'")
+        conn.commit()
+
+        rows = conn.execute("SELECT user_id, balance FROM users").fetchall()
+        holdings = [
+            (int(uid), str(sym), float(coins))
+            for uid, sym, coins in conn.execute("SELECT user_id, symbol, coins FROM crypto_v2_holdings").fetchall()
+        ]
+        prices = _v2_prices_conn(conn)
+        with self._lock:
+            self._base = {int(uid): int(bal) for uid, bal in rows}
+            self._inflight = {}
+            self._pending = {}
+            self._ranks.build(self._base)
+            self.worth.load(self._base, holdings, prices)
+            self._seq = last_seq
+            self._reset_journal_locked()
+            self.loaded = True
+
+    def load(self) -> None:
         with db_lock:
             conn = db_connect()
             try:
-                conn.execute(
-                    "UPDATE users SET balance = ?, last_daily = ? WHERE user_id = ?",
-                    (int(new_balance), now, int(user_id)),
+                self.load_conn(conn)
+            finally:
+                conn.close()
+
+    def flush_conn(self, conn: sqlite3.Connection, user_ids: Optional[List[int]] = None) -> int:
+        """
+        Writes pending deltas to users in a transaction of its own and commits
+        it. Returns how many users were written. user_ids limits it to the
+        users a SQL writer is about to work on (None = everyone); costs nothing
+        when those users have no pending deltas.
+
+        Runs under db_lock on the caller's connection, before the caller's own
+        transaction: it raises if one is already open rather than commit half
+        of it. It is not a barrier. Games keep adding deltas on the event loop
+        the moment it returns, so callers still count unflushed() in what they
+        read and change balances relatively (debit_conn / set_conn).
+        """
+        if conn.in_transaction:
+            raise RuntimeError("BalanceCache.flush_conn commits; call it before starting a transaction")
+        with self._lock:
+            if not self.loaded or not self._pending:
+                return 0
+            if user_ids is None:
+                batch, self._pending = self._pending, {}
+            else:
+                batch = {}
+                for uid in {int(u) for u in user_ids}:
+                    if uid in self._pending:
+                        batch[uid] = self._pending.pop(uid)
+                if not batch:
+                    return 0
+            self._inflight = batch
+            upto = self._seq
+        # One ledger row per user for the whole batch, pointing at the journal
+        # seq it runs up to. The caller labels its own writes on this
+        # connection next: give its label back
+        prev_note = _ledger_note(conn, "games", f"journal:{upto}")
+        try:
+            conn.executemany(
+                "UPDATE users SET balance = balance + ? WHERE user_id = ?",
+                [(int(delta), int(uid)) for uid, delta in batch.items() if delta],
+            )
+            if user_ids is None:
+                _set_state(conn, "balance_journal_seq", str(upto))
+                conn.execute("DELETE FROM system_state WHERE key LIKE 'balance_journal_seq:%'")
+            else:
+                # Every journal line for these users up to `upto` is now in users
+                conn.executemany(
+                    "INSERT INTO system_state (key, value) VALUES (?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    [(f"balance_journal_seq:{uid}", str(upto)) for uid in batch],
                 )
-                conn.commit()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            with self._lock:
+                for uid, delta in batch.items():
+                    self._pending[uid] = self._pending.get(uid, 0) + delta
+                self._inflight = {}
+            raise
+        finally:
+            _ledger_note(conn, *prev_note)
+        with self._lock:
+            for uid, delta in batch.items():
+                self._base[uid] = self._base.get(uid, 0) + delta
+            self._inflight = {}
+        return len(batch)
+
+    def flush(self) -> int:
+        with db_lock:
+            conn = db_connect()
+            try:
+                return self.flush_conn(conn)
             finally:
                 conn.close()
-        return int(DAILY_CREDITS)
-    return 0
 
-def get_top_users(limit: int = TOP_N) -> List[Tuple[str, int]]:
-    with db_lock:
-        conn = db_connect()
+    def refresh_conn(self, conn: sqlite3.Connection, user_ids: Optional[List[int]] = None) -> None:
+        """
+        Re-reads committed balances after a SQL-side change. None = every user.
+        """
+        if not self.loaded:
+            return
+        if user_ids is None:
+            rows = conn.execute("SELECT user_id, balance FROM users").fetchall()
+        else:
+            ids = sorted({int(u) for u in user_ids})
+            rows = []
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                marks = ",".join("?" for _ in chunk)
+                rows += conn.execute(f"SELECT user_id, balance FROM users WHERE user_id IN ({marks})", chunk).fetchall()
+        with self._lock:
+            for uid, bal in rows:
+                self._set_base_locked(int(uid), int(bal))
+
+    def refresh_holdings_conn(self, conn: sqlite3.Connection, user_ids: List[int]) -> None:
+        """
+        Re-reads committed crypto holdings for the net worth board after a trade.
+        """
+        if not self.loaded:
+            return
+        ids = sorted({int(u) for u in user_ids})
+        coins: Dict[int, Dict[str, float]] = {uid: {} for uid in ids}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            marks = ",".join("?" for _ in chunk)
+            for uid, sym, c in conn.execute(
+                f"SELECT user_id, symbol, coins FROM crypto_v2_holdings WHERE user_id IN ({marks})", chunk
+            ).fetchall():
+                coins[int(uid)][str(sym)] = float(c)
+        for uid, held in coins.items():
+            self.worth.set_holdings(uid, held)
+
+    def discard(self) -> bool:
+        """
+        Drops every pending delta and empties the journal; add() misses until
+        the next load_conn(). Only for restoring a snapshot, under db_lock.
+        Returns True if the cache was loaded.
+        """
+        while True:
+            with self._lock:
+                if not self._compacting:
+                    was_loaded = self.loaded
+                    self.loaded = False
+                    self._pending = {}
+                    self._inflight = {}
+                    self._base = {}
+                    self._ranks = RankIndex()
+                    self.worth = NetWorthBoard()
+                    if self._journal is not None:
+                        self._reset_journal_locked()
+                    return was_loaded
+            # A compaction owns the journal's tmp file until it swaps; it never needs db_lock
+            time.sleep(0.01)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._journal is not None:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._journal.close()
+                self._journal = None
+            self.loaded = False
+
+balance_cache = PartitionLocal(BalanceCache)
+
+class UsernameCache:
+    """
+    Display names as stored in users.username, plus the ones that changed
+    since. Commands call note() on every invocation; it only queues a write
+    when the name differs from the known one, and username_daemon writes the
+    queued names in one executemany (shutdown flushes the rest). Until then
+    users.username can lag a rename; overlay() patches the newest names in.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names: Dict[int, str] = {}
+        self._dirty: Dict[int, str] = {}
+
+    def note(self, user_id: int, username: str, stored: Optional[str] = None) -> bool:
+        """
+        stored is users.username if the caller just read the row; without it
+        the first note() for a user always queues one write.
+        Returns True if a write was queued.
+        """
+        uid, name = int(user_id), str(username)
+        with self._lock:
+            known = self._names.get(uid, stored)
+            self._names[uid] = name
+            if known == name:
+                return False
+            self._dirty[uid] = name
+            return True
+
+    def overlay(self, names: Dict[int, str]) -> Dict[int, str]:
+        with self._lock:
+            for uid in names:
+                if uid in self._dirty:
+                    names[uid] = self._dirty[uid]
+        return names
+
+    def forget(self) -> None:
+        """
+        Drops the known names (queued writes stay), e.g. after a restore.
+        """
+        with self._lock:
+            self._names = {}
+
+    def flush_conn(self, conn: sqlite3.Connection) -> int:
+        with self._lock:
+            if not self._dirty:
+                return 0
+            batch, self._dirty = self._dirty, {}
         try:
-            cur = conn.execute(
-                "SELECT username, balance FROM users ORDER BY balance DESC, user_id ASC LIMIT ?",
-                (int(limit),),
+            conn.executemany(
+                "UPDATE users SET username = ? WHERE user_id = ?",
+                [(name, uid) for uid, name in batch.items()],
             )
-            return cur.fetchall()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            with self._lock:
+                for uid, name in batch.items():
+                    self._dirty.setdefault(uid, name)
+            raise
+        return len(batch)
+
+    def flush(self) -> int:
+        with db_lock:
+            conn = db_connect()
+            try:
+                return self.flush_conn(conn)
+            finally:
+                conn.close()
+
+usernames = PartitionLocal(UsernameCache)
+
+class GuildMemberIndex:
+    """
+    Activated member ids per guild, so gifteveryone needs neither a member
+    fetch over HTTP nor a scan of users. A guild is indexed on first use from
+    the gateway member cache and then kept current by on_member_join /
+    on_member_remove and by activation. One per database file, like the
+    other caches: an id only counts as activated in the file it lives in.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._activated: Set[int] = set()
+        self._guilds: Dict[int, Set[int]] = {}
+        self.loaded = False
+
+    def load_conn(self, conn: sqlite3.Connection) -> None:
+        ids = {int(r[0]) for r in conn.execute("SELECT user_id FROM users").fetchall()}
+        with self._lock:
+            # Union: an activation committed while this was reading is kept
+            self._activated |= ids
+            self.loaded = True
+
+    def load(self) -> None:
+        conn = db_connect_read()
+        try:
+            self.load_conn(conn)
         finally:
             conn.close()
 
+    def forget(self) -> None:
+        """
+        Drops everything, e.g. after a restore replaced the users table.
+        """
+        with self._lock:
+            self._activated = set()
+            self._guilds = {}
+            self.loaded = False
+
+    def add_user(self, user_id: int) -> None:
+        with self._lock:
+            self._activated.add(int(user_id))
+
+    def index_guild(self, guild_id: int, member_ids: Iterable[int]) -> int:
+        """
+        member_ids: the guild's non-bot members. Needs load() first.
+        """
+        with self._lock:
+            members = self._activated.intersection(int(m) for m in member_ids)
+            self._guilds[int(guild_id)] = members
+            return len(members)
+
+    def indexed(self, guild_id: int) -> bool:
+        return int(guild_id) in self._guilds
+
+    def add_member(self, guild_id: int, user_id: int) -> None:
+        with self._lock:
+            members = self._guilds.get(int(guild_id))
+            if members is not None and int(user_id) in self._activated:
+                members.add(int(user_id))
+
+    def remove_member(self, guild_id: int, user_id: int) -> None:
+        with self._lock:
+            members = self._guilds.get(int(guild_id))
+            if members is not None:
+                members.discard(int(user_id))
+
+    def drop_guild(self, guild_id: int) -> None:
+        with self._lock:
+            self._guilds.pop(int(guild_id), None)
+
+    def members(self, guild_id: int) -> Optional[Set[int]]:
+        """
+        A copy of the guild's activated member ids, or None if not indexed yet.
+        """
+        with self._lock:
+            members = self._guilds.get(int(guild_id))
+            return set(members) if members is not None else None
+
+member_index = PartitionLocal(GuildMemberIndex)
+
+async def game_add_balance(user_id: int, amount: int) -> Optional[int]:
+    """
+    Balance change for the games: an O(1) in-memory update when the balance
+    cache is on, otherwise a group-committed SQL write. Returns the new balance.
+    """
+    if BALANCE_CACHE_ENABLED:
+        new_bal = balance_cache.add(user_id, amount)
+        if new_bal is not None:
+            return new_bal
+    return await balance_writes.add(user_id, amount)
+
+async def game_debit(user_id: int, amount: int, last_daily: Optional[int] = None) -> DebitResult:
+    """
+    Takes a stake for the games only if the user can cover it: one check-and-
+    debit in the balance cache when it is on, otherwise a group-committed
+    conditional UPDATE. No separate balance read.
+
+    The cache doesn't know last_daily, so when the caller's (preloaded)
+    last_daily says a daily bonus is due the debit goes through the database,
+    which credits it in the same transaction.
+    """
+    if BALANCE_CACHE_ENABLED and (last_daily is None or not daily_due(last_daily)):
+        res = balance_cache.try_debit(user_id, amount)
+        if res is not None:
+            return res
+    return await balance_writes.debit(user_id, amount)
+
+async def game_balance(user_id: int) -> Optional[int]:
+    """
+    Current balance for the games, straight from the balance cache when it is on.
+    Returns None if the user is not activated.
+    """
+    if BALANCE_CACHE_ENABLED:
+        bal = balance_cache.get(user_id)
+        if bal is not None:
+            return bal
+    row = await db.read(get_user, user_id)
+    return int(row[2]) if row else None
+
+def _claim_daily_conn(conn: sqlite3.Connection, user_id: int, now: int) -> Optional[Tuple[bool, int, int]]:
+    """
+    Explicit claim on an open transaction. Returns (claimed, balance,
+    seconds_until_next_claim), or None if the user row is missing.
+    """
+    balance = _accrue_daily_conn(conn, user_id, now)
+    if balance is not None:
+        return True, balance, DAILY_SECONDS
+    row = _get_user_conn(conn, user_id)
+    if row is None:
+        return None
+    return False, int(row[2]), DAILY_SECONDS - (now - int(row[3]))
+
+def claim_daily(user_id: int) -> Optional[Tuple[bool, int, int]]:
+    """
+    Returns (claimed, balance, seconds_until_next_claim), or None if the user row is missing.
+    """
+    with unit_of_work() as conn:
+        return _claim_daily_conn(conn, user_id, int(time.time()))
+
+def _named_rows_conn(conn: sqlite3.Connection, ranked: List[Tuple[int, int]]) -> List[Tuple[str, int]]:
+    """
+    (user_id, value) -> (username, value), with renames not yet written back.
+    """
+    if not ranked:
+        return []
+    marks = ",".join("?" for _ in ranked)
+    names = usernames.overlay(dict(conn.execute(
+        f"SELECT user_id, username FROM users WHERE user_id IN ({marks})",
+        [uid for uid, _value in ranked],
+    ).fetchall()))
+    return [(names.get(uid, str(uid)), value) for uid, value in ranked]
+
+def _overlay_rows(rows: List[Tuple[int, str, int]]) -> List[Tuple[str, int]]:
+    names = usernames.overlay({uid: name for uid, name, _value in rows})
+    return [(names[uid], value) for uid, _name, value in rows]
+
+def get_top_users(limit: int = TOP_N, offset: int = 0) -> List[Tuple[str, int]]:
+    """
+    (username, balance) in leaderboard order. With the balance cache loaded
+    the page comes from its rank index and only the names are read.
+    """
+    ranked = balance_cache.top(offset, limit) if BALANCE_CACHE_ENABLED else None
+    conn = db_connect_read()
+    try:
+        if ranked is None:
+            return _overlay_rows(conn.execute(
+                "SELECT user_id, username, balance FROM users ORDER BY balance DESC, user_id ASC LIMIT ? OFFSET ?",
+                (int(limit), int(offset)),
+            ).fetchall())
+        return _named_rows_conn(conn, ranked)
+    finally:
+        conn.close()
+
+def get_user_rank(user_id: int) -> Optional[Tuple[int, int, int]]:
+    """
+    Returns (1-based rank, balance, number of players), or None if the user
+    is not activated. O(log n) from the balance cache's rank index; without
+    it, two counts over idx_users_balance.
+    """
+    if BALANCE_CACHE_ENABLED:
+        res = balance_cache.rank(user_id)
+        if res is not None:
+            pos, bal, total = res
+            return pos + 1, bal, total
+    conn = db_connect_read()
+    try:
+        row = conn.execute("SELECT balance FROM users WHERE user_id = ?", (int(user_id),)).fetchone()
+        if row is None:
+            return None
+        bal = int(row[0])
+        ahead = conn.execute(
+            "SELECT COUNT(*) FROM users WHERE balance > ? OR (balance = ? AND user_id < ?)",
+            (bal, bal, int(user_id)),
+        ).fetchone()[0]
+        total = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        return int(ahead) + 1, bal, int(total)
+    finally:
+        conn.close()
+
+_NET_WORTH_SQL = """
+    SELECT u.user_id, u.username, CAST(u.balance + COALESCE(SUM(h.coins * m.last_price), 0) AS INTEGER) AS worth
+    FROM users u
+    LEFT JOIN crypto_v2_holdings h ON h.user_id = u.user_id
+    LEFT JOIN crypto_v2_markets m ON m.symbol = h.symbol
+    GROUP BY u.user_id
+"""
+
+def get_net_worth_top(limit: int = TOP_N, offset: int = 0) -> List[Tuple[str, int]]:
+    """
+    (username, net worth) in order, net worth being cash plus crypto holdings
+    at current market prices. Served by the balance cache's NetWorthBoard
+    when it is on, else by one grouped query.
+    """
+    conn = db_connect_read()
+    try:
+        ranked = balance_cache.worth.top(offset, limit, _v2_prices_conn(conn)) if BALANCE_CACHE_ENABLED else None
+        if ranked is None:
+            return _overlay_rows(conn.execute(
+                f"SELECT user_id, username, worth FROM ({_NET_WORTH_SQL}) ORDER BY worth DESC, user_id ASC LIMIT ? OFFSET ?",
+                (int(limit), int(offset)),
+            ).fetchall())
+        return _named_rows_conn(conn, ranked)
+    finally:
+        conn.close()
+
+def get_net_worth_rank(user_id: int) -> Optional[Tuple[int, int, int]]:
+    """
+    Returns (1-based rank, net worth, number of players), or None if the user
+    is not activated.
+    """
+    conn = db_connect_read()
+    try:
+        if BALANCE_CACHE_ENABLED:
+            res = balance_cache.worth.rank(int(user_id), _v2_prices_conn(conn))
+            if res is not None:
+                pos, worth, total = res
+                return pos + 1, worth, total
+        row = conn.execute(f"SELECT worth FROM ({_NET_WORTH_SQL}) WHERE user_id = ?", (int(user_id),)).fetchone()
+        if row is None:
+            return None
+        worth = int(row[0])
+        ahead, total = conn.execute(
+            f"SELECT SUM(worth > ? OR (worth = ? AND user_id < ?)), COUNT(*) FROM ({_NET_WORTH_SQL})",
+            (worth, worth, int(user_id)),
+        ).fetchone()
+        return int(ahead) + 1, worth, int(total)
+    finally:
+        conn.close()
+
 def get_all_activated_user_ids() -> Set[int]:
+    conn = db_connect_read()
+    try:
+        cur = conn.execute("SELECT user_id FROM users")
+        return {int(r[0]) for r in cur.fetchall()}
+    finally:
+        conn.close()
+
+def get_usernames(user_ids: List[int]) -> Dict[int, str]:
+    """
+    Stored usernames of the activated users among user_ids, in one IN-query
+    (callers pass at most a message's worth of mentions).
+    """
+    ids = sorted({int(u) for u in user_ids})
+    if not ids:
+        return {}
+    conn = db_connect_read()
+    try:
+        marks = ",".join("?" for _ in ids)
+        rows = conn.execute(f"SELECT user_id, username FROM users WHERE user_id IN ({marks})", ids).fetchall()
+        return {int(uid): name for uid, name in rows}
+    finally:
+        conn.close()
+
+async def guild_activated_ids(guild: discord.Guild) -> Set[int]:
+    """
+    Activated non-bot members of guild, from member_index. The first call per
+    guild (and after a restore) builds its entry from the gateway member cache.
+    """
+    members = member_index.members(guild.id)
+    if members is not None:
+        return members
+    if not member_index.loaded:
+        await db.read(member_index.load)
+    if not guild.chunked:
+        await guild.chunk()
+    count = member_index.index_guild(guild.id, [m.id for m in guild.members if not m.bot])
+    print(f"[MEMBERS] indexed guild {guild.id}: {count} activated of {len(guild.members)} members")
+    return member_index.members(guild.id) or set()
+
+def _gift_conn(conn: sqlite3.Connection, sender_id: int, recipient_id: int, amount: int) -> Tuple[str, int, int]:
+    """
+    Moves amount from sender to recipient on an open transaction.
+    Returns (status, sender_balance, recipient_balance) where status is
+    "ok", "no_sender", "no_recipient" or "insufficient".
+    """
+    rrow = _get_user_conn(conn, recipient_id)
+    if not rrow:
+        srow = _get_user_conn(conn, sender_id)
+        return ("no_recipient", int(srow[2]), 0) if srow else ("no_sender", 0, 0)
+
+    _ledger_note(conn, "gift", recipient_id)
+    debit = _debit_conn(conn, sender_id, amount)
+    if debit.status == "not_activated":
+        return "no_sender", 0, 0
+    if debit.status == "insufficient":
+        return "insufficient", debit.balance, int(rrow[2])
+
+    _ledger_note(conn, "gift", sender_id)
+    conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (int(amount), int(recipient_id)))
+    _balance_changed_conn(conn, recipient_id)
+    return "ok", debit.balance, int(rrow[2]) + int(amount)
+
+def gift_balance(
+    sender_id: int,
+    recipient_id: int,
+    amount: int,
+    sender_name: Optional[str] = None,
+    recipient_name: Optional[str] = None,
+) -> Tuple[str, int, int]:
+    """
+    Moves amount from sender to recipient in one transaction; the optional
+    names are refreshed in the same commit. Returns what _gift_conn returns.
+    """
+    with unit_of_work() as conn:
+        _touch_user_conn(conn, sender_id, sender_name)
+        _touch_user_conn(conn, recipient_id, recipient_name)
+        return _gift_conn(conn, sender_id, recipient_id, amount)
+
+def gift_balance_many(
+    sender_id: int,
+    recipient_ids: List[int],
+    amount_each: int,
+    username_pairs: Optional[List[Tuple[str, int]]] = None,
+) -> Tuple[str, int]:
+    """
+    Pays amount_each to every recipient out of the sender's balance in one transaction.
+    username_pairs, if given, are (username, user_id) rows refreshed in the same commit.
+    Returns (status, sender_balance) where status is "ok", "no_sender" or "insufficient".
+    """
+    total_cost = int(amount_each) * len(recipient_ids)
     with db_lock:
         conn = db_connect()
         try:
-            cur = conn.execute("SELECT user_id FROM users")
-            return {int(r[0]) for r in cur.fetchall()}
+            balance_cache.flush_conn(conn, [sender_id])
+            _ledger_note(conn, "gift")
+            debit = _debit_conn(conn, sender_id, total_cost)
+            if debit.status == "not_activated":
+                return "no_sender", 0
+            if debit.status == "insufficient":
+                return "insufficient", debit.balance
+
+            _ledger_note(conn, "gift", sender_id)
+            conn.executemany(
+                "UPDATE users SET balance = balance + ? WHERE user_id = ?",
+                [(int(amount_each), int(rid)) for rid in recipient_ids],
+            )
+            if username_pairs:
+                conn.executemany("UPDATE users SET username = ? WHERE user_id = ?", username_pairs)
+            conn.commit()
+            balance_cache.refresh_conn(conn, [sender_id] + list(recipient_ids))
+            return "ok", debit.balance
         finally:
             conn.close()
 
+def _steal_conn(conn: sqlite3.Connection, thief_id: int, target_id: int, rate: float) -> Optional[Tuple[int, int, int]]:
+    """
+    Moves floor(target balance * rate) (at least 1 if they have anything) to the thief.
+    Returns (stolen, thief_balance, target_balance), or None if either row is missing.
+    """
+    trow = _get_user_conn(conn, target_id)
+    arow = _get_user_conn(conn, thief_id)
+    if not trow or not arow:
+        return None
+
+    tbal = int(trow[2])
+
+    steal_amt = int(math.floor(tbal * rate))
+    if tbal > 0:
+        steal_amt = max(1, steal_amt)
+    steal_amt = min(steal_amt, tbal)
+
+    if steal_amt <= 0:
+        return 0, int(arow[2]), tbal
+
+    _ledger_note(conn, "steal", thief_id)
+    debit = _debit_conn(conn, target_id, steal_amt, accrue=False)
+    if not debit.ok:
+        return 0, int(arow[2]), debit.balance
+    _ledger_note(conn, "steal", target_id)
+    conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (int(steal_amt), int(thief_id)))
+    _balance_changed_conn(conn, thief_id)
+    return steal_amt, int(arow[2]) + steal_amt, debit.balance
+
+def steal_balance(thief_id: int, target_id: int, rate: float) -> Optional[Tuple[int, int, int]]:
+    with unit_of_work() as conn:
+        return _steal_conn(conn, thief_id, target_id, rate)
+
 def chunk_mentions(user_ids: List[int], max_len: int = 1900) -> List[str]:
     chunks: List[str] = []
     current = ""
@@ -721,61 +3175,64 @@ def create_bet(guild_id: Optional[int], channel_id: Optional[int], creator_id: i
         finally:
             conn.close()
 
-def get_bet(bet_id: int) -> Optional[Tuple]:
-    with db_lock:
-        conn = db_connect()
-        try:
-            cur = conn.execute(
-                """
-                SELECT bet_id, title, status, creator_id, created_ts, closed_ts, resolved_ts,
-                       winning_option, bonus_pool, note
-                FROM bets
-                WHERE bet_id = ?
-                """,
-                (int(bet_id),),
-            )
-            return cur.fetchone()
-        finally:
-            conn.close()
-
-def get_bet_options(bet_id: int) -> List[Tuple[int, str]]:
-    with db_lock:
-        conn = db_connect()
-        try:
-            cur = conn.execute(
-                "SELECT option_num, label FROM bet_options WHERE bet_id = ? ORDER BY option_num ASC",
-                (int(bet_id),),
-            )
-            return [(int(r[0]), str(r[1])) for r in cur.fetchall()]
-        finally:
-            conn.close()
-
-def get_bet_totals(bet_id: int) -> Tuple[int, Dict[int, int]]:
-    with db_lock:
-        conn = db_connect()
-        try:
-            cur = conn.execute(
-                "SELECT option_num, COALESCE(SUM(amount), 0) FROM bet_wagers WHERE bet_id = ? GROUP BY option_num",
-                (int(bet_id),),
-            )
-            rows = cur.fetchall()
-        finally:
-            conn.close()
+def _get_bet_conn(conn: sqlite3.Connection, bet_id: int) -> Optional[Tuple]:
+    return conn.execute(
+        """
+        SELECT bet_id, title, status, creator_id, created_ts, closed_ts, resolved_ts,
+               winning_option, bonus_pool, note
+        FROM bets
+        WHERE bet_id = ?
+        """,
+        (int(bet_id),),
+    ).fetchone()
+
+def get_bet(bet_id: int) -> Optional[Tuple]:
+    conn = db_connect_read()
+    try:
+        return _get_bet_conn(conn, bet_id)
+    finally:
+        conn.close()
+
+def _get_bet_options_conn(conn: sqlite3.Connection, bet_id: int) -> List[Tuple[int, str]]:
+    cur = conn.execute(
+        "SELECT option_num, label FROM bet_options WHERE bet_id = ? ORDER BY option_num ASC",
+        (int(bet_id),),
+    )
+    return [(int(r[0]), str(r[1])) for r in cur.fetchall()]
+
+def get_bet_options(bet_id: int) -> List[Tuple[int, str]]:
+    conn = db_connect_read()
+    try:
+        return _get_bet_options_conn(conn, bet_id)
+    finally:
+        conn.close()
+
+def _get_bet_totals_conn(conn: sqlite3.Connection, bet_id: int) -> Tuple[int, Dict[int, int]]:
+    rows = conn.execute(
+        "SELECT option_num, COALESCE(SUM(amount), 0) FROM bet_wagers WHERE bet_id = ? GROUP BY option_num",
+        (int(bet_id),),
+    ).fetchall()
     totals = {int(opt): int(s) for opt, s in rows}
     total_pool = sum(totals.values())
     return total_pool, totals
 
+def get_bet_totals(bet_id: int) -> Tuple[int, Dict[int, int]]:
+    conn = db_connect_read()
+    try:
+        return _get_bet_totals_conn(conn, bet_id)
+    finally:
+        conn.close()
+
 def list_open_bets(limit: int = 10) -> List[Tuple[int, str, int]]:
-    with db_lock:
-        conn = db_connect()
-        try:
-            cur = conn.execute(
-                "SELECT bet_id, title, created_ts FROM bets WHERE status = 'open' ORDER BY created_ts DESC LIMIT ?",
-                (int(limit),),
-            )
-            return [(int(r[0]), str(r[1]), int(r[2])) for r in cur.fetchall()]
-        finally:
-            conn.close()
+    conn = db_connect_read()
+    try:
+        cur = conn.execute(
+            "SELECT bet_id, title, created_ts FROM bets WHERE status = 'open' ORDER BY created_ts DESC LIMIT ?",
+            (int(limit),),
+        )
+        return [(int(r[0]), str(r[1]), int(r[2])) for r in cur.fetchall()]
+    finally:
+        conn.close()
 
 def american_odds_str(total_pool: int, opt_pool: int) -> str:
     if total_pool <= 0 or opt_pool <= 0:
@@ -792,85 +3249,98 @@ def american_odds_str(total_pool: int, opt_pool: int) -> str:
     return f"-{odds}"
 
 def get_user_wager_for_bet(bet_id: int, user_id: int) -> Optional[Tuple[int, int]]:
-    with db_lock:
-        conn = db_connect()
-        try:
-            row = conn.execute(
-                "SELECT option_num, amount FROM bet_wagers WHERE bet_id = ? AND user_id = ? LIMIT 1",
-                (int(bet_id), int(user_id)),
-            ).fetchone()
-            if row is None:
-                return None
-            return int(row[0]), int(row[1])
-        finally:
-            conn.close()
-
-def place_wager(bet_id: int, user_id: int, option_num: int, amount: int) -> Tuple[bool, str]:
+    conn = db_connect_read()
+    try:
+        row = conn.execute(
+            "SELECT option_num, amount FROM bet_wagers WHERE bet_id = ? AND user_id = ? LIMIT 1",
+            (int(bet_id), int(user_id)),
+        ).fetchone()
+        if row is None:
+            return None
+        return int(row[0]), int(row[1])
+    finally:
+        conn.close()
+
+def _place_wager_conn(conn: sqlite3.Connection, bet_id: int, user_id: int, option_num: int, amount: int) -> Tuple[bool, str]:
     if amount <= 0:
         return False, "Amount must be a positive whole number."
 
-    bet = get_bet(bet_id)
+    bet = _get_bet_conn(conn, bet_id)
     if bet is None:
         return False, "That bet_id does not exist."
     _, _title, status, _creator, *_rest = bet
     if status != "open":
         return False, f"That bet is not open (status: {status})."
 
-    options = dict(get_bet_options(bet_id))
+    options = dict(_get_bet_options_conn(conn, bet_id))
     if int(option_num) not in options:
         return False, "Invalid option number for this bet."
 
-    row = get_user(user_id)
-    if row is None:
-        return False, f"You are not activated yet. Run `{PREFIX}activate` first."
-
-    bal = int(row[2])
-    if amount > bal:
-        return False, f"You only have **{fmt_money(bal)}** Marcus Money. Your wager (**{fmt_money(amount)}**) is too large."
-
     now = int(time.time())
 
-    with db_lock:
-        conn = db_connect()
-        try:
-            existing_choice = conn.execute(
-                "SELECT option_num FROM bet_wagers WHERE bet_id = ? AND user_id = ? LIMIT 1",
-                (int(bet_id), int(user_id)),
-            ).fetchone()
-
-            if existing_choice is not None:
-                chosen_opt = int(existing_choice[0])
-                if chosen_opt != int(option_num):
-                    return (
-                        False,
-                        f"You already placed a wager on **Option {chosen_opt}** for this bet. "
-                        f"You can only add more to that same option (not switch).",
-                    )
+    existing_choice = conn.execute(
+        "SELECT option_num FROM bet_wagers WHERE bet_id = ? AND user_id = ? LIMIT 1",
+        (int(bet_id), int(user_id)),
+    ).fetchone()
 
-            conn.execute("UPDATE users SET balance = balance - ? WHERE user_id = ?", (int(amount), int(user_id)))
+    if existing_choice is not None:
+        chosen_opt = int(existing_choice[0])
+        if chosen_opt != int(option_num):
+            return (
+                False,
+                f"You already placed a wager on **Option {chosen_opt}** for this bet. "
+                f"You can only add more to that same option (not switch).",
+            )
 
-            existing = conn.execute(
-                "SELECT amount FROM bet_wagers WHERE bet_id = ? AND user_id = ? AND option_num = ?",
-                (int(bet_id), int(user_id), int(option_num)),
-            ).fetchone()
+    _ledger_note(conn, "wager", bet_id)
+    debit = _debit_conn(conn, user_id, amount)
+    if debit.status == "not_activated":
+        return False, f"You are not activated yet. Run `{PREFIX}activate` first."
+    if debit.status == "insufficient":
+        return False, f"You only have **{fmt_money(debit.balance)}** Marcus Money. Your wager (**{fmt_money(amount)}**) is too large."
 
-            if existing is None:
-                conn.execute(
-                    "INSERT INTO bet_wagers (bet_id, user_id, option_num, amount, placed_ts) VALUES (?, ?, ?, ?, ?)",
-                    (int(bet_id), int(user_id), int(option_num), int(amount), now),
-                )
-            else:
-                conn.execute(
-                    "UPDATE bet_wagers SET amount = amount + ?, placed_ts = ? WHERE bet_id = ? AND user_id = ? AND option_num = ?",
-                    (int(amount), now, int(bet_id), int(user_id), int(option_num)),
-                )
+    existing = conn.execute(
+        "SELECT amount FROM bet_wagers WHERE bet_id = ? AND user_id = ? AND option_num = ?",
+        (int(bet_id), int(user_id), int(option_num)),
+    ).fetchone()
 
-            conn.commit()
-        finally:
-            conn.close()
+    if existing is None:
+        conn.execute(
+            "INSERT INTO bet_wagers (bet_id, user_id, option_num, amount, placed_ts) VALUES (?, ?, ?, ?, ?)",
+            (int(bet_id), int(user_id), int(option_num), int(amount), now),
+        )
+    else:
+        conn.execute(
+            "UPDATE bet_wagers SET amount = amount + ?, placed_ts = ? WHERE bet_id = ? AND user_id = ? AND option_num = ?",
+            (int(amount), now, int(bet_id), int(user_id), int(option_num)),
+        )
 
     return True, f"Wager placed: **{fmt_money(amount)}** on **Option {int(option_num)}** ({options[int(option_num)]})."
 
+def place_wager(bet_id: int, user_id: int, option_num: int, amount: int) -> Tuple[bool, str]:
+    with unit_of_work() as conn:
+        return _place_wager_conn(conn, bet_id, user_id, option_num, amount)
+
+def place_wager_for_user(
+    user_id: int, username: str, bet_id: int, option_num: int, amount: int
+) -> Optional[Tuple[bool, str, int, int, int, int]]:
+    """
+    Everything !bet needs in one transaction.
+    Returns (ok, msg, bonus_pool, total_pool, option_pool, balance), or None if
+    the user is not activated.
+    """
+    with unit_of_work() as conn:
+        if _touch_user_conn(conn, user_id, username) is None:
+            return None
+        ok, msg = _place_wager_conn(conn, bet_id, user_id, option_num, amount)
+        if not ok:
+            return ok, msg, 0, 0, 0, 0
+        bet = _get_bet_conn(conn, bet_id)
+        bonus_pool = int(bet[8]) if bet else 0
+        total_pool, totals = _get_bet_totals_conn(conn, bet_id)
+        bal = int(_get_user_conn(conn, user_id)[2])
+        return ok, msg, bonus_pool, int(total_pool), int(totals.get(int(option_num), 0)), bal
+
 def close_bet(bet_id: int) -> Tuple[bool, str]:
     bet = get_bet(bet_id)
     if bet is None:
@@ -921,6 +3391,7 @@ def cancel_bet_and_refund(bet_id: int, note: str = "Canceled and refunded.") ->
                 (int(bet_id),),
             )
             refunds = [(int(uid), int(a)) for uid, a in cur.fetchall()]
+            _ledger_note(conn, "bet_refund", bet_id)
             for uid, amt in refunds:
                 conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (int(amt), int(uid)))
 
@@ -930,6 +3401,7 @@ def cancel_bet_and_refund(bet_id: int, note: str = "Canceled and refunded.") ->
                 (now, str(note), int(bet_id)),
             )
             conn.commit()
+            balance_cache.refresh_conn(conn, [uid for uid, _amt in refunds])
         finally:
             conn.close()
     return True, note
@@ -973,6 +3445,7 @@ def resolve_bet_and_payout(bet_id: int, winning_option: int) -> Tuple[bool, str]
                     (int(bet_id),),
                 )
                 refunds = [(int(uid), int(a)) for uid, a in cur2.fetchall()]
+                _ledger_note(conn, "bet_refund", bet_id)
                 for uid, amt in refunds:
                     conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (int(amt), int(uid)))
 
@@ -981,6 +3454,7 @@ def resolve_bet_and_payout(bet_id: int, winning_option: int) -> Tuple[bool, str]
                     (now, int(winning_option), "No winners. All wagers refunded. Bonus pool not paid out.", int(bet_id)),
                 )
                 conn.commit()
+                balance_cache.refresh_conn(conn, [uid for uid, _amt in refunds])
                 return True, "Resolved: no winners. All wagers refunded. Bonus pool not paid out."
 
             extra_pool = int(losing_pool) + int(bonus_pool)
@@ -999,6 +3473,7 @@ def resolve_bet_and_payout(bet_id: int, winning_option: int) -> Tuple[bool, str]
             for i in range(int(remainder)):
                 winner_rows[i % len(winner_rows)][2] += 1
 
+            _ledger_note(conn, "bet_payout", bet_id)
             for uid, stake, share, _frac in winner_rows:
                 payout = int(stake) + int(share)
                 conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (int(payout), int(uid)))
@@ -1012,6 +3487,7 @@ def resolve_bet_and_payout(bet_id: int, winning_option: int) -> Tuple[bool, str]
                 conn.execute("UPDATE bets SET closed_ts = ? WHERE bet_id = ?", (now, int(bet_id)))
 
             conn.commit()
+            balance_cache.refresh_conn(conn, [r[0] for r in winner_rows])
         finally:
             conn.close()
 
@@ -1029,16 +3505,182 @@ def _v2_price(reserve_money: float, reserve_coin: float) -> float:
         return 0.0
     return float(reserve_money) / float(reserve_coin)
 
-def v2_list_markets() -> List[Tuple[str, str, float, float, float, float]]:
-    with db_lock:
-        conn = db_connect()
+@dataclass(frozen=True)
+class MarketState:
+    """
+    One crypto_v2_markets row. Immutable: a trade or tick makes a new one
+    (dataclasses.replace) and MarketBook swaps it in after commit.
+    """
+    symbol: str
+    name: str
+    reserve_money: float
+    reserve_coin: float
+    last_price: float
+    last_tick_ts: int
+    day_open_price: float
+    fee: float
+
+    @property
+    def price(self) -> float:
+        return _v2_price(self.reserve_money, self.reserve_coin)
+
+    def row(self) -> Tuple[str, str, float, float, float, int, float, float]:
+        return (
+            self.symbol, self.name, self.reserve_money, self.reserve_coin,
+            self.last_price, self.last_tick_ts, self.day_open_price, self.fee,
+        )
+
+_MARKET_COLUMNS = "symbol, name, reserve_money, reserve_coin, last_price, last_tick_ts, day_open_price, fee"
+
+def _market_state(row) -> MarketState:
+    sym, name, rm, rc, last_price, last_tick, day_open, fee = row
+    return MarketState(str(sym), str(name), float(rm), float(rc), float(last_price), int(last_tick), float(day_open), float(fee))
+
+class MarketBook:
+    """
+    Memory-resident copy of crypto_v2_markets, so !price, !crypto, net worth
+    and the trades themselves don't query the markets table.
+
+    Reads take no lock: _states is never changed in place, publish() builds
+    a new dict (in symbol order) and swaps the reference, so a reader always
+    sees one consistent set of MarketStates.
+
+    Writers never change the book directly. They queue the new state on
+    their connection (_v2_put_market_conn); unit_of_work writes the queued
+    rows back in the same transaction and publishes them once it committed,
+    so the book never shows a trade that was rolled back.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()  # writers only: load() vs publish()
+        self._states: Dict[str, MarketState] = {}
+        self.loaded = False
+
+    def load_conn(self, conn: sqlite3.Connection) -> None:
+        # Held throughout, so a state committed while this reads is published after it
+        with self._lock:
+            if self.loaded:
+                return
+            rows = conn.execute(f"SELECT {_MARKET_COLUMNS} FROM crypto_v2_markets ORDER BY symbol ASC").fetchall()
+            self._states = {str(r[0]): _market_state(r) for r in rows}
+            self.loaded = True
+
+    def load(self) -> None:
+        conn = db_connect_read()
         try:
-            rows = conn.execute(
-                "SELECT symbol, name, reserve_money, reserve_coin, day_open_price, fee FROM crypto_v2_markets ORDER BY symbol ASC"
-            ).fetchall()
+            self.load_conn(conn)
         finally:
             conn.close()
 
+    def forget(self) -> None:
+        """
+        Drops the book; the next use reloads it (after a restore, or after
+        markets were inserted by hand).
+        """
+        with self._lock:
+            self._states = {}
+            self.loaded = False
+
+    def publish(self, states: Iterable[MarketState]) -> None:
+        with self._lock:
+            if not self.loaded:
+                return
+            merged = dict(self._states)
+            added = False
+            for st in states:
+                added = added or st.symbol not in merged
+                merged[st.symbol] = st
+            if added:
+                merged = dict(sorted(merged.items()))
+            self._states = merged
+
+    def get(self, sym: str) -> Optional[MarketState]:
+        return self._states.get(sym)
+
+    def states(self) -> List[MarketState]:
+        return list(self._states.values())
+
+market_book = PartitionLocal(MarketBook)
+
+def _v2_book() -> Optional[MarketBook]:
+    """
+    The loaded market book, or None when CRYPTO_V2_MARKET_BOOK is off.
+    """
+    if not CRYPTO_V2_MARKET_BOOK:
+        return None
+    book = market_book.current()
+    if not book.loaded:
+        book.load()
+    return book
+
+def _v2_market_conn(conn: PooledConnection, sym: str) -> Optional[MarketState]:
+    """
+    The market as this transaction sees it: its own queued state first, then
+    the book (or the table when the book is off).
+    """
+    pending = conn.markets_changed.get(sym)
+    if pending is not None:
+        return pending
+    if CRYPTO_V2_MARKET_BOOK:
+        book = market_book.current()
+        if not book.loaded:
+            book.load_conn(conn)
+        return book.get(sym)
+    row = conn.execute(f"SELECT {_MARKET_COLUMNS} FROM crypto_v2_markets WHERE symbol = ?", (sym,)).fetchone()
+    return _market_state(row) if row else None
+
+def _v2_markets_conn(conn: PooledConnection) -> List[MarketState]:
+    if CRYPTO_V2_MARKET_BOOK:
+        book = market_book.current()
+        if not book.loaded:
+            book.load_conn(conn)
+        states = book.states()
+    else:
+        rows = conn.execute(f"SELECT {_MARKET_COLUMNS} FROM crypto_v2_markets ORDER BY symbol ASC").fetchall()
+        states = [_market_state(r) for r in rows]
+    return [conn.markets_changed.get(st.symbol, st) for st in states]
+
+def _v2_put_market_conn(conn: PooledConnection, state: MarketState) -> None:
+    conn.markets_changed[state.symbol] = state
+
+def _v2_write_markets_conn(conn: PooledConnection) -> None:
+    """
+    Writes the queued market states back, one row per market however many
+    trades in this transaction touched it.
+    """
+    conn.executemany(
+        """
+        UPDATE crypto_v2_markets
+        SET reserve_money = ?, reserve_coin = ?, last_price = ?, last_tick_ts = ?, day_open_price = ?
+        WHERE symbol = ?
+        """,
+        [
+            (st.reserve_money, st.reserve_coin, st.last_price, st.last_tick_ts, st.day_open_price, st.symbol)
+            for st in conn.markets_changed.values()
+        ],
+    )
+
+def _v2_prices_conn(conn: sqlite3.Connection) -> Dict[str, float]:
+    book = _v2_book()
+    if book is not None:
+        return {st.symbol: st.last_price for st in book.states()}
+    return {
+        str(sym): float(price)
+        for sym, price in conn.execute("SELECT symbol, last_price FROM crypto_v2_markets").fetchall()
+    }
+
+def v2_list_markets() -> List[Tuple[str, str, float, float, float, float]]:
+    book = _v2_book()
+    if book is not None:
+        return [(st.symbol, st.name, st.price, st.day_open_price, st.reserve_money, st.fee) for st in book.states()]
+    conn = db_connect_read()
+    try:
+        rows = conn.execute(
+            "SELECT symbol, name, reserve_money, reserve_coin, day_open_price, fee FROM crypto_v2_markets ORDER BY symbol ASC"
+        ).fetchall()
+    finally:
+        conn.close()
+
     out = []
     for sym, name, rm, rc, day_open, fee in rows:
         price = _v2_price(float(rm), float(rc))
@@ -1049,20 +3691,16 @@ def v2_get_market(sym: str) -> Optional[Tuple[str, str, float, float, float, int
     sym = (sym or "").strip().upper()
     if not sym:
         return None
-    with db_lock:
-        conn = db_connect()
-        try:
-            row = conn.execute(
-                """
-                SELECT symbol, name, reserve_money, reserve_coin, last_price, last_tick_ts, day_open_price, fee
-                FROM crypto_v2_markets
-                WHERE symbol = ?
-                """,
-                (sym,),
-            ).fetchone()
-            return row
-        finally:
-            conn.close()
+    book = _v2_book()
+    if book is not None:
+        st = book.get(sym)
+        return st.row() if st is not None else None
+    conn = db_connect_read()
+    try:
+        row = conn.execute(f"SELECT {_MARKET_COLUMNS} FROM crypto_v2_markets WHERE symbol = ?", (sym,)).fetchone()
+        return _market_state(row).row() if row else None
+    finally:
+        conn.close()
 
 def _v2_set_holding_conn(conn: sqlite3.Connection, user_id: int, sym: str, coins: float) -> None:
     if coins < 0:
@@ -1081,35 +3719,37 @@ def _v2_set_holding_conn(conn: sqlite3.Connection, user_id: int, sym: str, coins
             "UPDATE crypto_v2_holdings SET coins = ? WHERE user_id = ? AND symbol = ?",
             (float(coins), int(user_id), str(sym)),
         )
+    _holdings_changed_conn(conn, user_id)
 
-def v2_get_holding(user_id: int, sym: str) -> float:
+def _v2_get_holding_conn(conn: sqlite3.Connection, user_id: int, sym: str) -> float:
     sym = (sym or "").strip().upper()
     if not sym:
         return 0.0
-    with db_lock:
-        conn = db_connect()
-        try:
-            row = conn.execute(
-                "SELECT coins FROM crypto_v2_holdings WHERE user_id = ? AND symbol = ?",
-                (int(user_id), sym),
-            ).fetchone()
-            return float(row[0]) if row else 0.0
-        finally:
-            conn.close()
+    row = conn.execute(
+        "SELECT coins FROM crypto_v2_holdings WHERE user_id = ? AND symbol = ?",
+        (int(user_id), sym),
+    ).fetchone()
+    return float(row[0]) if row else 0.0
+
+def v2_get_holding(user_id: int, sym: str) -> float:
+    conn = db_connect_read()
+    try:
+        return _v2_get_holding_conn(conn, user_id, sym)
+    finally:
+        conn.close()
 
 def v2_get_portfolio(user_id: int) -> List[Tuple[str, float]]:
-    with db_lock:
-        conn = db_connect()
-        try:
-            cur = conn.execute(
-                "SELECT symbol, coins FROM crypto_v2_holdings WHERE user_id = ? ORDER BY symbol ASC",
-                (int(user_id),),
-            )
-            return [(str(r[0]), float(r[1])) for r in cur.fetchall()]
-        finally:
-            conn.close()
+    conn = db_connect_read()
+    try:
+        cur = conn.execute(
+            "SELECT symbol, coins FROM crypto_v2_holdings WHERE user_id = ? ORDER BY symbol ASC",
+            (int(user_id),),
+        )
+        return [(str(r[0]), float(r[1])) for r in cur.fetchall()]
+    finally:
+        conn.close()
 
-def _v2_record_price_conn(conn: sqlite3.Connection, sym: str, ts: int, price: float) -> None:
+def _v2_record_price_conn(conn: sqlite3.Connection, sym: str, ts: int, price: float, volume: float = 0.0) -> None:
     sym = (sym or "").strip().upper()
     if not sym:
         return
@@ -1121,105 +3761,510 @@ def _v2_record_price_conn(conn: sqlite3.Connection, sym: str, ts: int, price: fl
     if price_f <= 0:
         return
     conn.execute("INSERT INTO crypto_v2_prices (ts, symbol, price) VALUES (?, ?, ?)", (ts_i, sym, price_f))
+    _v2_candles_conn(conn, [(sym, ts_i, price_f, float(volume))])
+    conn.prices_recorded.append((sym, ts_i, price_f))
+
+@dataclass
+class Candle:
+    ts: int  # bucket start
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float  # Marcus Money traded (ticks add none)
+
+def _v2_candles_conn(conn: sqlite3.Connection, points: List[Tuple[str, int, float, float]]) -> None:
+    """
+    Folds (symbol, ts, price, volume) points into every candle interval in one
+    executemany. Points must arrive in time order per symbol (they are written
+    as they happen), so the first one in a bucket is its open and the last its close.
+    """
+    conn.executemany(
+        """
+        INSERT INTO crypto_v2_candles (symbol, interval_s, bucket_ts, open, high, low, close, volume)
+        VALUES (?1, ?2, ?3, ?4, ?4, ?4, ?4, ?5)
+        ON CONFLICT (symbol, interval_s, bucket_ts) DO UPDATE SET
+            high = max(high, excluded.high),
+            low = min(low, excluded.low),
+            close = excluded.close,
+            volume = volume + excluded.volume
+        """,
+        [
+            (sym, iv, ts - ts % iv, price, volume)
+            for sym, ts, price, volume in points
+            for iv in CRYPTO_V2_CANDLE_INTERVALS
+        ],
+    )
+
+def _v2_rebuild_candles_conn(conn: sqlite3.Connection, sym: Optional[str] = None) -> None:
+    """
+    Recomputes candles from crypto_v2_prices (all symbols, or one). Volume
+    isn't in the raw rows, so rebuilt candles have none. Archived hours are
+    not read: only rebuild before any archiving (the migration does).
+    """
+    where = "" if sym is None else "WHERE symbol = :sym"
+    conn.execute(f"DELETE FROM crypto_v2_candles {where}", {"sym": sym})
+    for iv in CRYPTO_V2_CANDLE_INTERVALS:
+        conn.execute(
+            f"""
+            INSERT INTO crypto_v2_candles (symbol, interval_s, bucket_ts, open, high, low, close, volume)
+            SELECT symbol, :iv, bucket,
+                   MAX(CASE WHEN first_rn = 1 THEN price END), MAX(price), MIN(price),
+                   MAX(CASE WHEN last_rn = 1 THEN price END), 0
+            FROM (
+                SELECT symbol, price, ts - ts % :iv AS bucket,
+                       ROW_NUMBER() OVER (PARTITION BY symbol, ts - ts % :iv ORDER BY ts, id) AS first_rn,
+                       ROW_NUMBER() OVER (PARTITION BY symbol, ts - ts % :iv ORDER BY ts DESC, id DESC) AS last_rn
+                FROM crypto_v2_prices {where}
+            )
+            GROUP BY symbol, bucket
+            """,
+            {"iv": int(iv), "sym": sym},
+        )
+
+def _v2_candle_interval(seconds: int, max_candles: int) -> int:
+    for iv in CRYPTO_V2_CANDLE_INTERVALS:
+        if seconds <= iv * max_candles:
+            return iv
+    return CRYPTO_V2_CANDLE_INTERVALS[-1]
+
+def v2_get_candles(sym: str, since_ts: int, max_candles: int = CRYPTO_V2_CHART_MAX_CANDLES) -> Tuple[int, List[Candle]]:
+    """
+    Candles covering since_ts..now at the finest interval that needs at most
+    max_candles of them (the widest interval if none does, so very long windows
+    can return more). Returns (interval_s, candles oldest first).
+    """
+    sym = (sym or "").strip().upper()
+    iv = _v2_candle_interval(max(1, int(time.time()) - int(since_ts)), max(1, int(max_candles)))
+    conn = db_connect_read()
+    try:
+        rows = conn.execute(
+            """
+            SELECT bucket_ts, open, high, low, close, volume
+            FROM crypto_v2_candles
+            WHERE symbol = ? AND interval_s = ? AND bucket_ts >= ?
+            ORDER BY bucket_ts ASC
+            """,
+            (sym, iv, int(since_ts) - int(since_ts) % iv),
+        ).fetchall()
+        return iv, [Candle(int(r[0]), float(r[1]), float(r[2]), float(r[3]), float(r[4]), float(r[5])) for r in rows]
+    finally:
+        conn.close()
+
+def _le_bytes(a: array) -> bytes:
+    if sys.byteorder == "big":
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+def _le_array(typecode: str, data: bytes) -> array:
+    a = array(typecode, data)
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a
+
+def _v2_encode_price_hour(hour_ts: int, points: List[Tuple[int, float]]) -> Tuple[bytes, bytes]:
+    """
+    Packs one symbol-hour of (ts, price) points, sorted by ts, into two
+    zlib-compressed columns: the seconds since the previous point (uint16,
+    the first one since hour_ts) and each price's float64 bits XORed with the
+    previous price's, which leaves mostly zero bytes for slowly moving
+    prices. Lossless; _v2_decode_price_hour reverses it.
+    """
+    stamps = [int(hour_ts)] + [int(ts) for ts, _price in points]
+    deltas = array("H", [b - a for a, b in zip(stamps, stamps[1:])])
+    raw = array("Q", array("d", [float(price) for _ts, price in points]).tobytes())
+    bits = array("Q", [b ^ a for a, b in zip(itertools.chain((0,), raw), raw)])
+    return zlib.compress(_le_bytes(deltas), 9), zlib.compress(_le_bytes(bits), 9)
+
+def _v2_decode_price_hour(hour_ts: int, ts_blob: bytes, price_blob: bytes) -> List[Tuple[int, float]]:
+    stamps = itertools.accumulate(_le_array("H", zlib.decompress(ts_blob)), initial=int(hour_ts))
+    next(stamps)
+    bits = itertools.accumulate(_le_array("Q", zlib.decompress(price_blob)), operator.xor)
+    prices = array("d", array("Q", bits).tobytes())
+    return list(zip(stamps, prices))
+
+def _v2_archive_prices_conn(conn: sqlite3.Connection, now: int) -> int:
+    """
+    Moves raw price rows of closed hours older than CRYPTO_V2_PRICE_RAW_HOURS
+    into crypto_v2_price_archive (at most CRYPTO_V2_ARCHIVE_HOURS_PER_RUN
+    hours, oldest first) and drops archived hours past
+    CRYPTO_V2_ARCHIVE_KEEP_DAYS. Returns the number of symbol-hours written.
+    """
+    cutoff = int(now) - int(CRYPTO_V2_PRICE_RAW_HOURS) * 3600
+    cutoff -= cutoff % 3600
+    if CRYPTO_V2_ARCHIVE_KEEP_DAYS > 0:
+        conn.execute(
+            "DELETE FROM crypto_v2_price_archive WHERE hour_ts < ?",
+            (cutoff - int(CRYPTO_V2_ARCHIVE_KEEP_DAYS) * 86400,),
+        )
+    oldest = conn.execute("SELECT MIN(ts) FROM crypto_v2_prices").fetchone()[0]
+    if oldest is None or int(oldest) >= cutoff:
+        return 0
+    end = min(cutoff, int(oldest) - int(oldest) % 3600 + int(CRYPTO_V2_ARCHIVE_HOURS_PER_RUN) * 3600)
+
+    hours: Dict[Tuple[str, int], List[Tuple[int, float]]] = {}
+    for sym, ts, price in conn.execute(
+        "SELECT symbol, ts, price FROM crypto_v2_prices WHERE ts < ? ORDER BY symbol, ts, id", (end,)
+    ).fetchall():
+        hours.setdefault((str(sym), int(ts) - int(ts) % 3600), []).append((int(ts), float(price)))
+
+    rows = []
+    for (sym, hour_ts), points in hours.items():
+        # A late row for an hour that is already archived: merge, don't overwrite
+        old = conn.execute(
+            "SELECT ts_blob, price_blob FROM crypto_v2_price_archive WHERE symbol = ? AND hour_ts = ?",
+            (sym, hour_ts),
+        ).fetchone()
+        if old is not None:
+            points = sorted(_v2_decode_price_hour(hour_ts, old[0], old[1]) + points, key=lambda p: p[0])
+        ts_blob, price_blob = _v2_encode_price_hour(hour_ts, points)
+        rows.append((sym, hour_ts, len(points), ts_blob, price_blob))
+    conn.executemany(
+        "INSERT OR REPLACE INTO crypto_v2_price_archive (symbol, hour_ts, points, ts_blob, price_blob) VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
+    conn.execute("DELETE FROM crypto_v2_prices WHERE ts < ?", (end,))
+    return len(rows)
+
+def v2_archive_prices_once(now: Optional[int] = None) -> int:
+    with unit_of_work() as conn:
+        return _v2_archive_prices_conn(conn, int(time.time()) if now is None else int(now))
+
+class PriceRings:
+    """
+    The newest CRYPTO_V2_RING_POINTS (ts, price) points of each coin in fixed
+    arrays, so short chart windows need no SQL. Fed after commit with what
+    _v2_record_price_conn recorded (unit_of_work) and by the market tick.
+
+    All rings live in one buffer: a header, one (symbol, written, covered_from)
+    record per slot, then per slot a ts array and a price array. With
+    CRYPTO_V2_RING_MMAP the buffer is a memory-mapped file next to the db, and
+    load() keeps a coin's ring if its newest point still matches the db.
+
+    window() only answers if the ring holds every point of the window: the
+    ring has wrapped past since_ts, or since_ts is after covered_from (the
+    oldest time the ring was seeded from).
+    """
+
+    _HEADER = struct.Struct("<8sqqq")   # magic, capacity, slots, padding
+    _SLOT = struct.Struct("<16sqq")     # symbol, points ever written, covered_from
+    _MAGIC = b"PRING1" + (b"LE" if sys.byteorder == "little" else b"BE")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buf = None
+        self._mm: Optional[mmap.mmap] = None
+        self._slots: Dict[str, int] = {}
+        self._ts: List[memoryview] = []
+        self._px: List[memoryview] = []
+        self.loaded = False
+
+    # ---- layout ----
+
+    def _open_buffer(self, cap: int, nslots: int) -> bool:
+        """
+        Maps (or allocates) the buffer. Returns True if an existing ring file
+        with the same shape was reopened.
+        """
+        size = self._HEADER.size + nslots * self._SLOT.size + nslots * cap * 16
+        warm = False
+        if CRYPTO_V2_RING_MMAP:
+            path = active_db_path() + CRYPTO_V2_RING_SUFFIX
+            with open(path, "a+b") as f:
+                old_size = f.seek(0, os.SEEK_END)
+                if old_size == size:
+                    f.seek(0)
+                    magic, old_cap, old_slots, _pad = self._HEADER.unpack(f.read(self._HEADER.size))
+                    warm = (magic, old_cap, old_slots) == (self._MAGIC, cap, nslots)
+                f.truncate(size)
+                self._mm = self._buf = mmap.mmap(f.fileno(), size)
+            if not warm:
+                self._buf[:size] = bytes(size)
+        else:
+            self._buf = bytearray(size)
+        self._HEADER.pack_into(self._buf, 0, self._MAGIC, cap, nslots, 0)
+        view = memoryview(self._buf)
+        data = self._HEADER.size + nslots * self._SLOT.size
+        self._ts = [view[data + i * cap * 16: data + i * cap * 16 + cap * 8].cast("q") for i in range(nslots)]
+        self._px = [view[data + i * cap * 16 + cap * 8: data + (i + 1) * cap * 16].cast("d") for i in range(nslots)]
+        return warm
+
+    def _meta(self, slot: int) -> Tuple[str, int, int]:
+        name, written, covered_from = self._SLOT.unpack_from(self._buf, self._HEADER.size + slot * self._SLOT.size)
+        return name.rstrip(b"\0").decode(), written, covered_from
+
+    def _set_meta(self, slot: int, sym: str, written: int, covered_from: int) -> None:
+        self._SLOT.pack_into(self._buf, self._HEADER.size + slot * self._SLOT.size, sym.encode()[:16], written, covered_from)
+
+    def _newest(self, slot: int) -> Optional[Tuple[int, float]]:
+        _sym, written, _covered = self._meta(slot)
+        if written == 0:
+            return None
+        i = (written - 1) % len(self._ts[slot])
+        return self._ts[slot][i], self._px[slot][i]
+
+    # ---- load / feed ----
+
+    def load_conn(self, conn: sqlite3.Connection) -> None:
+        cap, nslots = max(1, int(CRYPTO_V2_RING_POINTS)), max(1, int(CRYPTO_V2_RING_SLOTS))
+        # Held throughout, so a point committed while this reads waits and lands after the seed
+        with self._lock:
+            if self.loaded:
+                return
+            warm = self._open_buffer(cap, nslots)
+            old = {self._meta(i)[0]: i for i in range(nslots)} if warm else {}
+            syms = [str(r[0]) for r in conn.execute("SELECT symbol FROM crypto_v2_markets ORDER BY symbol").fetchall()]
+            free = [i for i in range(nslots) if i not in old.values()]
+            self._slots = {}
+            for sym in syms[:nslots]:
+                newest = conn.execute(
+                    "SELECT ts, price FROM crypto_v2_prices WHERE symbol = ? ORDER BY ts DESC, id DESC LIMIT 1", (sym,)
+                ).fetchone()
+                slot = old.pop(sym, None)
+                if slot is not None and newest is not None and self._newest(slot) == (int(newest[0]), float(newest[1])):
+                    self._slots[sym] = slot
+                    continue
+                if slot is None:
+                    slot = free.pop(0) if free else old.popitem()[1]
+                self._slots[sym] = slot
+                self._seed_conn(conn, slot, sym, cap)
+            for slot in old.values():
+                self._set_meta(slot, "", 0, 0)
+            self.loaded = True
+
+    def _seed_conn(self, conn: sqlite3.Connection, slot: int, sym: str, cap: int) -> None:
+        rows = conn.execute(
+            "SELECT ts, price FROM crypto_v2_prices WHERE symbol = ? ORDER BY ts DESC, id DESC LIMIT ?", (sym, cap)
+        ).fetchall()[::-1]
+        for i, (ts, price) in enumerate(rows):
+            self._ts[slot][i] = int(ts)
+            self._px[slot][i] = float(price)
+        covered_from = 0
+        if rows:
+            archived = conn.execute(
+                "SELECT 1 FROM crypto_v2_price_archive WHERE symbol = ? AND hour_ts <= ? LIMIT 1", (sym, int(rows[0][0]))
+            ).fetchone()
+            # Older points exist (beyond the ring or in the archive): cover from the oldest one kept
+            if len(rows) == cap or archived is not None:
+                covered_from = int(rows[0][0])
+        self._set_meta(slot, sym, len(rows), covered_from)
+
+    def load(self) -> None:
+        conn = db_connect_read()
+        try:
+            self.load_conn(conn)
+        finally:
+            conn.close()
+
+    def extend(self, points: Iterable[Tuple[str, int, float]]) -> None:
+        with self._lock:
+            if not self.loaded:
+                return
+            for sym, ts, price in points:
+                slot = self._slots.get(sym)
+                if slot is None:
+                    continue
+                _sym, written, covered_from = self._meta(slot)
+                newest = self._newest(slot)
+                # Committed before load() read it: already seeded
+                if newest is not None and (int(ts) < newest[0] or (int(ts), float(price)) == newest):
+                    continue
+                i = written % len(self._ts[slot])
+                self._ts[slot][i] = int(ts)
+                self._px[slot][i] = float(price)
+                self._set_meta(slot, sym, written + 1, covered_from)
+
+    def reset(self, sym: str) -> None:
+        """
+        Empties a coin's ring after its whole history was deleted; a new coin
+        gets a free slot if there is one.
+        """
+        with self._lock:
+            if not self.loaded:
+                return
+            slot = self._slots.get(sym)
+            if slot is None:
+                used = set(self._slots.values())
+                slot = next((i for i in range(len(self._ts)) if i not in used), None)
+                if slot is None:
+                    return
+                self._slots[sym] = slot
+            self._set_meta(slot, sym, 0, 0)
+
+    def close(self) -> None:
+        """
+        Flushes and unmaps the buffer; the next load() starts over (after a
+        restore the rings no longer match the db and are reseeded).
+        """
+        with self._lock:
+            self.loaded = False
+            self._slots = {}
+            self._ts = []
+            self._px = []
+            self._buf = None
+            if self._mm is not None:
+                self._mm.flush()
+                self._mm.close()
+                self._mm = None
+
+    # ---- read ----
+
+    def window(self, sym: str, since_ts: int) -> Optional[List[Tuple[int, float]]]:
+        """
+        Every point with ts >= since_ts, oldest first, or None if the ring
+        doesn't hold the whole window (or has nothing for the coin).
+        """
+        with self._lock:
+            slot = self._slots.get(sym) if self.loaded else None
+            if slot is None:
+                return None
+            _sym, written, covered_from = self._meta(slot)
+            ts_a, px_a = self._ts[slot], self._px[slot]
+            cap = len(ts_a)
+            n = min(written, cap)
+            if n == 0:
+                return None
+            start = (written - n) % cap
+            oldest = ts_a[start]
+            if written > cap:
+                # Wrapped: points older than the oldest kept one were overwritten
+                if since_ts < oldest:
+                    return None
+            elif since_ts < covered_from:
+                return None
+            # bisect each stored run on its own (no key= so this works before 3.10)
+            since_ts, end = int(since_ts), start + n
+            if end <= cap:
+                first = bisect.bisect_left(ts_a, since_ts, start, end) - start
+            elif since_ts <= ts_a[cap - 1]:
+                first = bisect.bisect_left(ts_a, since_ts, start, cap) - start
+            else:
+                first = cap - start + bisect.bisect_left(ts_a, since_ts, 0, end - cap)
+            return [(ts_a[(start + k) % cap], px_a[(start + k) % cap]) for k in range(first, n)]
+
+price_rings = PartitionLocal(PriceRings)
 
 def v2_get_price_series_since(sym: str, since_ts: int, limit: int = 5000) -> List[Tuple[int, float]]:
+    """
+    (ts, price) points from since_ts on, oldest first: archived hours first,
+    then the raw rows (an hour is in one or the other, never both).
+    """
     sym = (sym or "").strip().upper()
     if not sym:
         return []
     limit = max(50, min(int(limit), 5000))
-    with db_lock:
-        conn = db_connect()
-        try:
-            cur = conn.execute(
-                """
-                SELECT ts, price
-                FROM crypto_v2_prices
-                WHERE symbol = ? AND ts >= ?
-                ORDER BY ts ASC
-                LIMIT ?
-                """,
-                (sym, int(since_ts), int(limit)),
-            )
-            return [(int(r[0]), float(r[1])) for r in cur.fetchall()]
-        finally:
-            conn.close()
+    since_ts = int(since_ts)
+    conn = db_connect_read()
+    try:
+        out: List[Tuple[int, float]] = []
+        for hour_ts, ts_blob, price_blob in conn.execute(
+            """
+            SELECT hour_ts, ts_blob, price_blob
+            FROM crypto_v2_price_archive
+            WHERE symbol = ? AND hour_ts >= ?
+            ORDER BY hour_ts ASC
+            """,
+            (sym, since_ts - since_ts % 3600),
+        ):
+            out.extend(p for p in _v2_decode_price_hour(hour_ts, ts_blob, price_blob) if p[0] >= since_ts)
+            if len(out) >= limit:
+                return out[:limit]
+        cur = conn.execute(
+            """
+            SELECT ts, price
+            FROM crypto_v2_prices
+            WHERE symbol = ? AND ts >= ?
+            ORDER BY ts ASC
+            LIMIT ?
+            """,
+            (sym, since_ts, limit - len(out)),
+        )
+        out.extend((int(r[0]), float(r[1])) for r in cur.fetchall())
+        return out
+    finally:
+        conn.close()
 
-def v2_buy(user_id: int, sym: str, money_in: int) -> Tuple[bool, str]:
+def _v2_buy_conn(conn: sqlite3.Connection, user_id: int, sym: str, money_in: int) -> Tuple[bool, str]:
     sym = (sym or "").strip().upper()
     if money_in <= 0:
         return False, "Buy amount must be a positive whole number."
 
-    row = get_user(user_id)
-    if row is None:
-        return False, f"You are not activated yet. Run `{PREFIX}activate` first."
-    bal = int(row[2])
-    if money_in > bal:
-        return False, f"You only have **{fmt_money(bal)}** Marcus Money. You can’t spend **{fmt_money(money_in)}**."
-
-    with db_lock:
-        conn = db_connect()
-        try:
-            m = conn.execute(
-                "SELECT reserve_money, reserve_coin, fee FROM crypto_v2_markets WHERE symbol = ?",
-                (sym,),
-            ).fetchone()
-            if not m:
-                return False, f"Unknown crypto symbol `{sym}`. Use `{PREFIX}crypto`."
-            reserve_money = float(m[0])
-            reserve_coin = float(m[1])
-            fee = float(m[2])
-
-            if reserve_money <= 0 or reserve_coin <= 0:
-                return False, "Market is illiquid right now. Try later."
+    m = _v2_market_conn(conn, sym)
+    if m is None:
+        return False, f"Unknown crypto symbol `{sym}`. Use `{PREFIX}crypto`."
+    reserve_money = m.reserve_money
+    reserve_coin = m.reserve_coin
+    fee = m.fee
 
-            k = reserve_money * reserve_coin
-            effective_in = float(money_in) * (1.0 - fee)
+    if reserve_money <= 0 or reserve_coin <= 0:
+        return False, "Market is illiquid right now. Try later."
 
-            new_curve_money = reserve_money + effective_in
-            new_curve_coin = k / new_curve_money
-            coins_out = reserve_coin - new_curve_coin
-            if coins_out <= 0:
-                return False, "Trade too small to execute."
+    k = reserve_money * reserve_coin
+    effective_in = float(money_in) * (1.0 - fee)
 
-            reserve_money_new = reserve_money + float(money_in)
-            reserve_coin_new = reserve_coin - coins_out
+    new_curve_money = reserve_money + effective_in
+    new_curve_coin = k / new_curve_money
+    coins_out = reserve_coin - new_curve_coin
+    if coins_out <= 0:
+        return False, "Trade too small to execute."
 
-            if reserve_coin_new <= 0:
-                return False, "Market error: insufficient pool coin reserve."
+    reserve_money_new = reserve_money + float(money_in)
+    reserve_coin_new = reserve_coin - coins_out
 
-            price_before = _v2_price(reserve_money, reserve_coin)
-            price_after = _v2_price(reserve_money_new, reserve_coin_new)
+    if reserve_coin_new <= 0:
+        return False, "Market error: insufficient pool coin reserve."
 
-            conn.execute("UPDATE users SET balance = balance - ? WHERE user_id = ?", (int(money_in), int(user_id)))
+    price_before = _v2_price(reserve_money, reserve_coin)
+    price_after = _v2_price(reserve_money_new, reserve_coin_new)
 
-            h = conn.execute(
-                "SELECT coins FROM crypto_v2_holdings WHERE user_id = ? AND symbol = ?",
-                (int(user_id), sym),
-            ).fetchone()
-            prev = float(h[0]) if h else 0.0
-            _v2_set_holding_conn(conn, int(user_id), sym, prev + float(coins_out))
+    _ledger_note(conn, "crypto_buy", sym)
+    debit = _debit_conn(conn, user_id, money_in)
+    if debit.status == "not_activated":
+        return False, f"You are not activated yet. Run `{PREFIX}activate` first."
+    if debit.status == "insufficient":
+        return False, f"You only have **{fmt_money(debit.balance)}** Marcus Money. You can’t spend **{fmt_money(money_in)}**."
 
-            now = int(time.time())
-            conn.execute(
-                """
-                UPDATE crypto_v2_markets
-                SET reserve_money = ?, reserve_coin = ?, last_price = ?, last_tick_ts = ?
-                WHERE symbol = ?
-                """,
-                (float(reserve_money_new), float(reserve_coin_new), float(price_after), now, sym),
-            )
-            _v2_record_price_conn(conn, sym, now, float(price_after))
+    h = conn.execute(
+        "SELECT coins FROM crypto_v2_holdings WHERE user_id = ? AND symbol = ?",
+        (int(user_id), sym),
+    ).fetchone()
+    prev = float(h[0]) if h else 0.0
+    _v2_set_holding_conn(conn, int(user_id), sym, prev + float(coins_out))
 
-            conn.commit()
-        finally:
-            conn.close()
+    now = int(time.time())
+    _v2_put_market_conn(
+        conn,
+        replace(m, reserve_money=reserve_money_new, reserve_coin=reserve_coin_new, last_price=price_after, last_tick_ts=now),
+    )
+    _v2_record_price_conn(conn, sym, now, float(price_after), float(money_in))
 
     return True, (
         f"Bought **{fmt_coin(coins_out, 3)} {sym}** for **{fmt_money(money_in)}** Marcus Money.\n"
         f"Price: {fmt_coin(price_before, 3)} → {fmt_coin(price_after, 3)} (slippage included)"
     )
 
-def v2_sell(user_id: int, sym: str, coins_in: float) -> Tuple[bool, str]:
+def v2_buy(user_id: int, sym: str, money_in: int) -> Tuple[bool, str]:
+    with unit_of_work() as conn:
+        return _v2_buy_conn(conn, user_id, sym, money_in)
+
+def _v2_buy_for_user_conn(conn: PooledConnection, user_id: int, username: str, sym: str, money_in: int) -> Optional[Tuple[bool, str, int, float]]:
+    if _touch_user_conn(conn, user_id, username) is None:
+        return None
+    sym = (sym or "").strip().upper()
+    ok, msg = _v2_buy_conn(conn, user_id, sym, money_in)
+    bal = int(_get_user_conn(conn, user_id)[2])
+    return ok, msg, bal, _v2_get_holding_conn(conn, user_id, sym)
+
+def v2_buy_for_user(user_id: int, username: str, sym: str, money_in: int) -> Optional[Tuple[bool, str, int, float]]:
+    """
+    Everything !buy needs in one transaction.
+    Returns (ok, msg, balance, holding), or None if the user is not activated.
+    """
+    with unit_of_work() as conn:
+        return _v2_buy_for_user_conn(conn, user_id, username, sym, money_in)
+
+def _v2_sell_conn(conn: sqlite3.Connection, user_id: int, sym: str, coins_in: float) -> Tuple[bool, str]:
     sym = (sym or "").strip().upper()
     try:
         coins_in = float(coins_in)
@@ -1228,171 +4273,291 @@ def v2_sell(user_id: int, sym: str, coins_in: float) -> Tuple[bool, str]:
     if coins_in <= 0:
         return False, "Sell amount must be positive."
 
-    row = get_user(user_id)
+    row = _get_user_conn(conn, user_id)
     if row is None:
         return False, f"You are not activated yet. Run `{PREFIX}activate` first."
 
-    owned = v2_get_holding(user_id, sym)
+    owned = _v2_get_holding_conn(conn, user_id, sym)
     if coins_in > owned + 1e-12:
         return False, f"You only have **{fmt_coin(owned)} {sym}**."
 
-    with db_lock:
-        conn = db_connect()
-        try:
-            m = conn.execute(
-                "SELECT reserve_money, reserve_coin, fee FROM crypto_v2_markets WHERE symbol = ?",
-                (sym,),
-            ).fetchone()
-            if not m:
-                return False, f"Unknown crypto symbol `{sym}`. Use `{PREFIX}crypto`."
-            reserve_money = float(m[0])
-            reserve_coin = float(m[1])
-            fee = float(m[2])
-
-            if reserve_money <= 0 or reserve_coin <= 0:
-                return False, "Market is illiquid right now. Try later."
+    m = _v2_market_conn(conn, sym)
+    if m is None:
+        return False, f"Unknown crypto symbol `{sym}`. Use `{PREFIX}crypto`."
+    reserve_money = m.reserve_money
+    reserve_coin = m.reserve_coin
+    fee = m.fee
 
-            k = reserve_money * reserve_coin
-            effective_in = float(coins_in) * (1.0 - fee)
+    if reserve_money <= 0 or reserve_coin <= 0:
+        return False, "Market is illiquid right now. Try later."
 
-            new_curve_coin = reserve_coin + effective_in
-            new_curve_money = k / new_curve_coin
-            money_out = reserve_money - new_curve_money
-            if money_out <= 0:
-                return False, "Trade too small to execute."
+    k = reserve_money * reserve_coin
+    effective_in = float(coins_in) * (1.0 - fee)
 
-            reserve_coin_new = reserve_coin + float(coins_in)
-            reserve_money_new = reserve_money - money_out
+    new_curve_coin = reserve_coin + effective_in
+    new_curve_money = k / new_curve_coin
+    money_out = reserve_money - new_curve_money
+    if money_out <= 0:
+        return False, "Trade too small to execute."
 
-            price_before = _v2_price(reserve_money, reserve_coin)
-            price_after = _v2_price(reserve_money_new, reserve_coin_new)
+    reserve_coin_new = reserve_coin + float(coins_in)
+    reserve_money_new = reserve_money - money_out
 
-            payout = int(math.floor(money_out))
-            if payout <= 0:
-                return False, "Trade too small after fees."
+    price_before = _v2_price(reserve_money, reserve_coin)
+    price_after = _v2_price(reserve_money_new, reserve_coin_new)
 
-            h = conn.execute(
-                "SELECT coins FROM crypto_v2_holdings WHERE user_id = ? AND symbol = ?",
-                (int(user_id), sym),
-            ).fetchone()
-            prev = float(h[0]) if h else 0.0
-            new_hold = max(0.0, prev - float(coins_in))
-            _v2_set_holding_conn(conn, int(user_id), sym, new_hold)
+    payout = int(math.floor(money_out))
+    if payout <= 0:
+        return False, "Trade too small after fees."
 
-            conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (int(payout), int(user_id)))
+    h = conn.execute(
+        "SELECT coins FROM crypto_v2_holdings WHERE user_id = ? AND symbol = ?",
+        (int(user_id), sym),
+    ).fetchone()
+    prev = float(h[0]) if h else 0.0
+    new_hold = max(0.0, prev - float(coins_in))
+    _v2_set_holding_conn(conn, int(user_id), sym, new_hold)
 
-            now = int(time.time())
-            conn.execute(
-                """
-                UPDATE crypto_v2_markets
-                SET reserve_money = ?, reserve_coin = ?, last_price = ?, last_tick_ts = ?
-                WHERE symbol = ?
-                """,
-                (float(reserve_money_new), float(reserve_coin_new), float(price_after), now, sym),
-            )
-            _v2_record_price_conn(conn, sym, now, float(price_after))
+    _ledger_note(conn, "crypto_sell", sym)
+    conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (int(payout), int(user_id)))
+    _balance_changed_conn(conn, user_id)
 
-            conn.commit()
-        finally:
-            conn.close()
+    now = int(time.time())
+    _v2_put_market_conn(
+        conn,
+        replace(m, reserve_money=reserve_money_new, reserve_coin=reserve_coin_new, last_price=price_after, last_tick_ts=now),
+    )
+    _v2_record_price_conn(conn, sym, now, float(price_after), float(payout))
 
     return True, (
         f"Sold **{fmt_coin(coins_in, 3)} {sym}** for **{fmt_money(payout)}** Marcus Money.\n"
         f"Price: {fmt_coin(price_before, 3)} → {fmt_coin(price_after, 3)} (slippage included)"
     )
 
-def v2_market_tick_once() -> None:
-    now = int(time.time())
-    with db_lock:
-        conn = db_connect()
-        try:
-            rows = conn.execute(
-                "SELECT symbol, reserve_money, reserve_coin, day_open_price, last_tick_ts FROM crypto_v2_markets"
-            ).fetchall()
-
-            # Day open reset at midnight (UTC day boundary based on epoch days)
-            for sym, rm, rc, _day_open, last_tick in rows:
-                price = _v2_price(float(rm), float(rc))
-                if int(now // 86400) != int(int(last_tick) // 86400):
-                    conn.execute(
-                        "UPDATE crypto_v2_markets SET day_open_price = ? WHERE symbol = ?",
-                        (float(price), str(sym)),
-                    )
-
-            for sym, rm, rc, _day_open, _last_tick in rows:
-                sym = str(sym)
-                reserve_money = float(rm)
-                reserve_coin = float(rc)
-                if reserve_money <= 0 or reserve_coin <= 0:
-                    continue
-
-                price_before = _v2_price(reserve_money, reserve_coin)
-                k = reserve_money * reserve_coin
-
-                base_sigma = 0.0015
-                drift_bias = 3.5e-7
-                noise = (sum(random.uniform(-1, 1) for _ in range(6)) / 6.0) * base_sigma - drift_bias
-
-                kind = None
-                shock = 0.0
-                r = random.random()
-                if r < 0.003:
-                    kind = "MOON"
-                    shock = random.uniform(0.01, 0.08)
-                elif r < 0.005:
-                    kind = "CRASH"
-                    shock = -random.uniform(0.01, 0.1)
+def v2_sell(user_id: int, sym: str, coins_in: float) -> Tuple[bool, str]:
+    with unit_of_work() as conn:
+        return _v2_sell_conn(conn, user_id, sym, coins_in)
 
-                drift = -3.5e-8
-                total_move = max(noise + shock - drift, -0.0070)
-                mult = max(0.05, 1.0 + total_move)
-                target_price = price_before * mult
+def v2_sell_for_user(user_id: int, username: str, sym: str, coins_in: Optional[float]) -> Optional[Tuple[bool, str, int, float]]:
+    """
+    Everything !sell needs in one transaction; coins_in=None sells the whole holding.
+    Returns (ok, msg, balance, holding), or None if the user is not activated.
+    """
+    with unit_of_work() as conn:
+        return _v2_sell_for_user_conn(conn, user_id, username, sym, coins_in)
 
-                new_rm = math.sqrt(k * target_price)
-                new_rc = math.sqrt(k / target_price)
+def _v2_sell_for_user_conn(conn: PooledConnection, user_id: int, username: str, sym: str, coins_in: Optional[float]) -> Optional[Tuple[bool, str, int, float]]:
+    sym = (sym or "").strip().upper()
+    if _touch_user_conn(conn, user_id, username) is None:
+        return None
+    if coins_in is None:
+        coins_in = _v2_get_holding_conn(conn, user_id, sym)
+        if coins_in <= 0:
+            return False, f"You have no **{sym}** to sell.", 0, 0.0
+    ok, msg = _v2_sell_conn(conn, user_id, sym, coins_in)
+    bal = int(_get_user_conn(conn, user_id)[2])
+    return ok, msg, bal, _v2_get_holding_conn(conn, user_id, sym)
+
+def apply_trade_batch(ops: List[Tuple[str, int, str, str, object]]) -> List[object]:
+    """
+    Runs ("buy", user_id, username, sym, money_in) / ("sell", user_id,
+    username, sym, coins_in) trades in ONE transaction, each inside its own
+    SAVEPOINT like apply_balance_batch. Later trades on a coin quote against
+    the reserves earlier ones left in conn.markets_changed, and each market
+    row is written once at commit.
+
+    Returns one result per op: what v2_buy_for_user / v2_sell_for_user
+    return, or the exception that op raised.
+    """
+    results: List[object] = []
+    with unit_of_work() as conn:
+        conn.execute("BEGIN")
+        for op, uid, username, sym, amount in ops:
+            markets = dict(conn.markets_changed)
+            prices = len(conn.prices_recorded)
+            conn.execute("SAVEPOINT trade_op")
+            try:
+                if op == "buy":
+                    res = _v2_buy_for_user_conn(conn, uid, username, sym, amount)
+                elif op == "sell":
+                    res = _v2_sell_for_user_conn(conn, uid, username, sym, amount)
+                else:
+                    raise ValueError(f"unknown trade op {op!r}")
+                conn.execute("RELEASE trade_op")
+                results.append(res)
+            except Exception as e:
+                conn.execute("ROLLBACK TO trade_op")
+                conn.execute("RELEASE trade_op")
+                conn.markets_changed.clear()
+                conn.markets_changed.update(markets)
+                del conn.prices_recorded[prices:]
+                results.append(e)
+    return results
+
+class TradeGroupCommitter(_GroupCommitter):
+    """
+    Group commit for !buy / !sell. A burst of trades (usually on one hot
+    coin) is applied by apply_trade_batch in one transaction: one commit and
+    one markets row write per batch instead of per trade. Trades on a coin
+    are applied in the order they were submitted.
 
-                if new_rm < 1000.0:
-                    new_rm = 1000.0
-                    new_rc = k / new_rm
-                if new_rc < 0.0001:
-                    new_rc = 0.0001
-                    new_rm = k / new_rc
+        res = await trade_writes.buy(user_id, username, sym, money_in)
+    """
 
-                price_after = _v2_price(new_rm, new_rc)
+    def _apply(self, ops: List[tuple]) -> List[object]:
+        return apply_trade_batch(ops)
+
+    async def buy(self, user_id: int, username: str, sym: str, money_in: int) -> Optional[Tuple[bool, str, int, float]]:
+        return await self._submit(("buy", int(user_id), str(username), sym, int(money_in)))
+
+    async def sell(self, user_id: int, username: str, sym: str, coins_in: Optional[float]) -> Optional[Tuple[bool, str, int, float]]:
+        return await self._submit(("sell", int(user_id), str(username), sym, coins_in))
+
+trade_writes = PartitionLocal(TradeGroupCommitter)
+
+# Per-tick price move: mean of 6 uniform draws scaled by the sigma, minus a
+# small bias, plus a rare MOON/CRASH shock, floored at -0.7% per tick
+V2_TICK_SIGMA = 0.0015
+V2_TICK_BIAS = 3.5e-7
+V2_TICK_DRIFT = -3.5e-8
+V2_TICK_MAX_DROP = -0.0070
+V2_MOON_CHANCE = 0.003
+V2_CRASH_CHANCE = 0.002
+V2_MIN_RESERVE_MONEY = 1000.0
+V2_MIN_RESERVE_COIN = 0.0001
+
+def _v2_tick_reserves_py(rm: List[float], rc: List[float]) -> Tuple[List[float], List[float], List[Optional[str]]]:
+    new_rm: List[float] = []
+    new_rc: List[float] = []
+    kinds: List[Optional[str]] = []
+    for reserve_money, reserve_coin in zip(rm, rc):
+        price_before = reserve_money / reserve_coin
+        k = reserve_money * reserve_coin
+        noise = (sum(random.uniform(-1, 1) for _ in range(6)) / 6.0) * V2_TICK_SIGMA - V2_TICK_BIAS
+
+        kind = None
+        shock = 0.0
+        r = random.random()
+        if r < V2_MOON_CHANCE:
+            kind = "MOON"
+            shock = random.uniform(0.01, 0.08)
+        elif r < V2_MOON_CHANCE + V2_CRASH_CHANCE:
+            kind = "CRASH"
+            shock = -random.uniform(0.01, 0.1)
+
+        total_move = max(noise + shock - V2_TICK_DRIFT, V2_TICK_MAX_DROP)
+        target_price = price_before * max(0.05, 1.0 + total_move)
+        m = math.sqrt(k * target_price)
+        c = math.sqrt(k / target_price)
+        if m < V2_MIN_RESERVE_MONEY:
+            m = V2_MIN_RESERVE_MONEY
+            c = k / m
+        if c < V2_MIN_RESERVE_COIN:
+            c = V2_MIN_RESERVE_COIN
+            m = k / c
+        new_rm.append(m)
+        new_rc.append(c)
+        kinds.append(kind)
+    return new_rm, new_rc, kinds
+
+def _v2_tick_reserves_np(rm: List[float], rc: List[float]) -> Tuple[List[float], List[float], List[Optional[str]]]:
+    rm_a = np.asarray(rm, dtype=np.float64)
+    rc_a = np.asarray(rc, dtype=np.float64)
+    n = len(rm_a)
+    rng = np.random.default_rng(random.getrandbits(64))
+    k = rm_a * rc_a
+    noise = rng.uniform(-1.0, 1.0, (n, 6)).mean(axis=1) * V2_TICK_SIGMA - V2_TICK_BIAS
+
+    r = rng.random(n)
+    moon = r < V2_MOON_CHANCE
+    crash = ~moon & (r < V2_MOON_CHANCE + V2_CRASH_CHANCE)
+    shock = np.where(moon, rng.uniform(0.01, 0.08, n), 0.0) - np.where(crash, rng.uniform(0.01, 0.1, n), 0.0)
+
+    total_move = np.maximum(noise + shock - V2_TICK_DRIFT, V2_TICK_MAX_DROP)
+    target_price = (rm_a / rc_a) * np.maximum(0.05, 1.0 + total_move)
+    new_rm = np.sqrt(k * target_price)
+    new_rc = np.sqrt(k / target_price)
+    low_money = new_rm < V2_MIN_RESERVE_MONEY
+    new_rm = np.where(low_money, V2_MIN_RESERVE_MONEY, new_rm)
+    new_rc = np.where(low_money, k / V2_MIN_RESERVE_MONEY, new_rc)
+    low_coin = new_rc < V2_MIN_RESERVE_COIN
+    new_rc = np.where(low_coin, V2_MIN_RESERVE_COIN, new_rc)
+    new_rm = np.where(low_coin, k / V2_MIN_RESERVE_COIN, new_rm)
+
+    kinds: List[Optional[str]] = [None] * n
+    for i in np.flatnonzero(moon):
+        kinds[i] = "MOON"
+    for i in np.flatnonzero(crash):
+        kinds[i] = "CRASH"
+    return new_rm.tolist(), new_rc.tolist(), kinds
+
+def v2_tick_reserves(rm: List[float], rc: List[float]) -> Tuple[List[float], List[float], List[Optional[str]]]:
+    """
+    One tick's random move for every market at once: new reserve_money and
+    reserve_coin (k = money * coin is kept, then the minimum reserves are
+    enforced) and the shock kind per market (None, "MOON" or "CRASH").
+    Reserves must be positive. Uses numpy when it is installed.
+    """
+    if np is not None and CRYPTO_V2_TICK_NUMPY:
+        return _v2_tick_reserves_np(rm, rc)
+    return _v2_tick_reserves_py(rm, rc)
 
-                conn.execute(
-                    """
-                    UPDATE crypto_v2_markets
-                    SET reserve_money = ?, reserve_coin = ?, last_price = ?, last_tick_ts = ?
-                    WHERE symbol = ?
-                    """,
-                    (float(new_rm), float(new_rc), float(price_after), int(now), sym),
+def v2_market_tick_once() -> None:
+    now = int(time.time())
+    with db_lock:
+        conn = db_connect()
+        try:
+            # Dead pools (a non-positive reserve) are left alone
+            states = [st for st in _v2_markets_conn(conn) if st.reserve_money > 0 and st.reserve_coin > 0]
+            if not states:
+                return
+            new_rm, new_rc, kinds = v2_tick_reserves([st.reserve_money for st in states], [st.reserve_coin for st in states])
+
+            price_rows = []
+            event_rows = []
+            today = now // 86400
+            for st, m, c, kind in zip(states, new_rm, new_rc, kinds):
+                sym = st.symbol
+                price_before = st.reserve_money / st.reserve_coin
+                price_after = m / c
+                day_open = st.day_open_price
+                # Day open resets on the first tick of a new (UTC epoch) day
+                if today != st.last_tick_ts // 86400:
+                    day_open = price_before
+                _v2_put_market_conn(
+                    conn,
+                    replace(st, reserve_money=m, reserve_coin=c, last_price=price_after, last_tick_ts=now, day_open_price=day_open),
                 )
-                _v2_record_price_conn(conn, sym, int(now), float(price_after))
-
+                price_rows.append((now, sym, price_after))
                 if kind is not None:
-                    pct = (price_after / price_before - 1.0) * 100.0 if price_before > 0 else 0.0
+                    pct = (price_after / price_before - 1.0) * 100.0
                     note = "Viral hype wave hit the market." if kind == "MOON" else "Liquidity panic cascaded through the pool."
-                    conn.execute(
-                        "INSERT INTO crypto_v2_events (ts, symbol, kind, pct, note) VALUES (?, ?, ?, ?, ?)",
-                        (int(now), sym, kind, float(pct), note),
-                    )
-
+                    event_rows.append((now, sym, kind, pct, note))
+
+            _v2_write_markets_conn(conn)
+            conn.executemany("INSERT INTO crypto_v2_prices (ts, symbol, price) VALUES (?, ?, ?)", price_rows)
+            _v2_candles_conn(conn, [(sym, ts, price, 0.0) for ts, sym, price in price_rows])
+            if event_rows:
+                conn.executemany(
+                    "INSERT INTO crypto_v2_events (ts, symbol, kind, pct, note) VALUES (?, ?, ?, ?, ?)",
+                    event_rows,
+                )
             conn.commit()
+            market_book.publish(conn.markets_changed.values())
+            price_rings.extend((sym, ts, price) for ts, sym, price in price_rows)
         finally:
             conn.close()
 
 def v2_recent_events(limit: int = 10) -> List[Tuple[int, str, str, float, str]]:
-    with db_lock:
-        conn = db_connect()
-        try:
-            cur = conn.execute(
-                "SELECT ts, symbol, kind, pct, note FROM crypto_v2_events ORDER BY ts DESC, id DESC LIMIT ?",
-                (int(limit),),
-            )
-            return [(int(r[0]), str(r[1]), str(r[2]), float(r[3]), str(r[4])) for r in cur.fetchall()]
-        finally:
-            conn.close()
+    conn = db_connect_read()
+    try:
+        cur = conn.execute(
+            "SELECT ts, symbol, kind, pct, note FROM crypto_v2_events ORDER BY ts DESC, id DESC LIMIT ?",
+            (int(limit),),
+        )
+        return [(int(r[0]), str(r[1]), str(r[2]), float(r[3]), str(r[4])) for r in cur.fetchall()]
+    finally:
+        conn.close()
 
 def v2_set_market(sym: str, start_price: float, liquidity_money: float) -> Tuple[bool, str]:
     sym = (sym or "").strip().upper()
@@ -1409,27 +4574,29 @@ def v2_set_market(sym: str, start_price: float, liquidity_money: float) -> Tuple
     with db_lock:
         conn = db_connect()
         try:
-            row = conn.execute("SELECT symbol FROM crypto_v2_markets WHERE symbol = ?", (sym,)).fetchone()
-            if not row:
+            m = _v2_market_conn(conn, sym)
+            if m is None:
                 return False, f"Unknown symbol `{sym}`."
 
             reserve_money = lm
             reserve_coin = lm / sp
             now = int(time.time())
 
-            conn.execute(
-                """
-                UPDATE crypto_v2_markets
-                SET reserve_money = ?, reserve_coin = ?, last_price = ?, day_open_price = ?, last_tick_ts = ?
-                WHERE symbol = ?
-                """,
-                (float(reserve_money), float(reserve_coin), float(sp), float(sp), now, sym),
+            _v2_put_market_conn(
+                conn,
+                replace(m, reserve_money=reserve_money, reserve_coin=reserve_coin, last_price=sp, day_open_price=sp, last_tick_ts=now),
             )
+            _v2_write_markets_conn(conn)
             conn.execute("DELETE FROM crypto_v2_prices WHERE symbol = ?", (sym,))
+            conn.execute("DELETE FROM crypto_v2_candles WHERE symbol = ?", (sym,))
+            conn.execute("DELETE FROM crypto_v2_price_archive WHERE symbol = ?", (sym,))
             conn.execute("DELETE FROM crypto_v2_events WHERE symbol = ?", (sym,))
             _v2_record_price_conn(conn, sym, now, float(sp))
 
             conn.commit()
+            market_book.publish(conn.markets_changed.values())
+            price_rings.reset(sym)
+            price_rings.extend(conn.prices_recorded)
         finally:
             conn.close()
 
@@ -1470,6 +4637,13 @@ def tax_rate_for_balance(balance: int) -> float:
         return 0.23
     return 0.25
 
+def get_last_tax_date() -> str:
+    conn = db_connect_read()
+    try:
+        return _get_state(conn, "last_tax_date", "")
+    finally:
+        conn.close()
+
 def run_tax_if_due() -> Optional[Tuple[str, int, int]]:
     tz = ZoneInfo(TAX_TIMEZONE)
     now_dt = datetime.now(tz)
@@ -1487,27 +4661,28 @@ def run_tax_if_due() -> Optional[Tuple[str, int, int]]:
             if last_tax_date == date_key:
                 return None
 
+            # Not a barrier: games keep adding deltas while this runs, so every
+            # balance below counts unflushed() and the tax is a conditional debit
+            balance_cache.flush_conn(conn)
+            _ledger_note(conn, "tax", date_key)
             rows = conn.execute("SELECT user_id, balance FROM users").fetchall()
             users_taxed = 0
             total_tax = 0
 
             for uid, bal in rows:
-                bal_i = int(bal)
-                rate = tax_rate_for_balance(bal_i)
-                if rate <= 0.0:
-                    continue
-                tax_amt = int(math.floor(bal_i * rate))
-                if tax_amt <= 0:
-                    continue
-
-                new_bal = bal_i - tax_amt
-                if new_bal < 0:
-                    tax_amt = bal_i
-                    new_bal = 0
-
-                conn.execute("UPDATE users SET balance = ? WHERE user_id = ?", (int(new_bal), int(uid)))
-                users_taxed += 1
-                total_tax += tax_amt
+                uid = int(uid)
+                bal_i = int(bal) + balance_cache.unflushed(uid)
+                for _attempt in range(2):
+                    tax_amt = min(int(math.floor(bal_i * tax_rate_for_balance(bal_i))), bal_i)
+                    if tax_amt <= 0:
+                        break
+                    if balance_cache.debit_conn(conn, uid, tax_amt) is not None:
+                        users_taxed += 1
+                        total_tax += tax_amt
+                        break
+                    # Lost money since it was read: tax what is left instead
+                    bal_i = int(conn.execute("SELECT balance FROM users WHERE user_id = ?", (uid,)).fetchone()[0])
+                    bal_i += balance_cache.unflushed(uid)
 
             # Record last run date + event record
             _set_state(conn, "last_tax_date", date_key)
@@ -1523,6 +4698,7 @@ def run_tax_if_due() -> Optional[Tuple[str, int, int]]:
                 _set_lottery_pool_conn(conn, int(pool))
 
             conn.commit()
+            balance_cache.refresh_conn(conn)
             return (date_key, users_taxed, total_tax)
 
         finally:
@@ -1556,29 +4732,314 @@ def _quickpick_ticket() -> Tuple[List[int], int]:
     pb = random.randint(LOTTERY_PB_MIN, LOTTERY_PB_MAX)
     return main_nums, pb
 
-def _count_main_matches(ticket_main: List[int], win_main: List[int]) -> int:
-    # Order matters: count position-by-position matches
-    return sum(1 for a, b in zip(ticket_main, win_main) if int(a) == int(b))
+def _count_main_matches(ticket_main: List[int], win_main: List[int]) -> int:
+    # Order matters: count position-by-position matches
+    return sum(1 for a, b in zip(ticket_main, win_main) if int(a) == int(b))
+
+
+def _prize_for_match(main_matches: int, pb_match: bool) -> Tuple[int, bool]:
+    mm = int(main_matches)
+    if mm >= 5 and pb_match:
+        return (0, True)
+    if mm >= 5:
+        return (100000, False)
+    if mm == 4:
+        return (25000, False)
+    if mm == 3:
+        return (5000, False)
+    if mm == 2:
+        return (500, False)
+    if mm == 1:
+        return (0, False)
+    return (0, False)
+
+def _fmt_ticket(main_nums: List[int], pb: int) -> str:
+    return f"{' '.join(str(int(x)) for x in main_nums)}  | PB {int(pb)}"
+
+def get_lottery_ticket_stats() -> Tuple[int, int, int]:
+    """
+    Returns (active_tickets, players_with_tickets, pool)
+    """
+    conn = db_connect_read()
+    try:
+        total = int(conn.execute("SELECT COUNT(*) FROM lottery_tickets").fetchone()[0])
+        pool = int(_get_lottery_pool_conn(conn))
+        users = int(conn.execute("SELECT COUNT(DISTINCT user_id) FROM lottery_tickets").fetchone()[0])
+    finally:
+        conn.close()
+    return total, users, pool
+
+def get_user_lottery_tickets(user_id: int) -> Tuple[List[Tuple], int]:
+    """
+    Returns (tickets, pool) where tickets are (id, n1..n5, pb, bought_ts) rows.
+    """
+    conn = db_connect_read()
+    try:
+        rows = conn.execute(
+            """
+            SELECT id, n1, n2, n3, n4, n5, pb, bought_ts
+            FROM lottery_tickets
+            WHERE user_id = ?
+            ORDER BY id ASC
+            """,
+            (int(user_id),),
+        ).fetchall()
+
+        pool = _get_lottery_pool_conn(conn)
+    finally:
+        conn.close()
+    return rows, pool
+
+def _powerball_purchase_conn(conn: sqlite3.Connection, user_id: int, main_nums: List[int], pb: int) -> Tuple[bool, int, int]:
+    """
+    Charges LOTTERY_TICKET_COST, adds it to the pool and stores the ticket.
+    Returns (bought, pool, balance); bought is False if the user can't afford it.
+    """
+    pool = _get_lottery_pool_conn(conn)
+    _ledger_note(conn, "lottery_ticket")
+    debit = _debit_conn(conn, user_id, LOTTERY_TICKET_COST)
+    if not debit.ok:
+        return False, pool, debit.balance
+
+    now = int(time.time())
+
+    pool += int(LOTTERY_TICKET_COST)
+    _set_lottery_pool_conn(conn, pool)
+
+    conn.execute(
+        """
+        INSERT INTO lottery_tickets (user_id, n1, n2, n3, n4, n5, pb, bought_ts)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            int(user_id),
+            int(main_nums[0]),
+            int(main_nums[1]),
+            int(main_nums[2]),
+            int(main_nums[3]),
+            int(main_nums[4]),
+            int(pb),
+            int(now),
+        ),
+    )
+    return True, pool, debit.balance
+
+def buy_lottery_ticket(user_id: int, main_nums: List[int], pb: int) -> Tuple[bool, int, int]:
+    with unit_of_work() as conn:
+        return _powerball_purchase_conn(conn, user_id, main_nums, pb)
+
+def buy_lottery_ticket_for_user(user_id: int, username: str, main_nums: List[int], pb: int) -> Optional[Tuple[bool, int, int]]:
+    """
+    !powerball in one transaction. Returns what _powerball_purchase_conn
+    returns, or None if the user is not activated.
+    """
+    with unit_of_work() as conn:
+        if _touch_user_conn(conn, user_id, username) is None:
+            return None
+        return _powerball_purchase_conn(conn, user_id, main_nums, pb)
+
+def get_lottery_draw_state() -> Tuple[int, List[Tuple]]:
+    """
+    Returns (pool, tickets) where tickets are (id, user_id, n1..n5, pb) rows.
+    """
+    conn = db_connect_read()
+    try:
+        pool = _get_lottery_pool_conn(conn)
+        tickets = conn.execute(
+            "SELECT id, user_id, n1, n2, n3, n4, n5, pb FROM lottery_tickets ORDER BY id ASC"
+        ).fetchall()
+    finally:
+        conn.close()
+    return pool, tickets
+
+def settle_lottery_draw(new_pool: int, small_paid: Dict[int, int], jackpot_paid_net: Dict[int, int]) -> None:
+    with db_lock:
+        conn = db_connect()
+        try:
+            _set_lottery_pool_conn(conn, int(new_pool))
+
+            _ledger_note(conn, "lottery_prize")
+            for uid, amt in small_paid.items():
+                conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (int(amt), int(uid)))
+
+            # Pay NET jackpot after tax
+            _ledger_note(conn, "lottery_jackpot")
+            for uid, amt in jackpot_paid_net.items():
+                conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (int(amt), int(uid)))
+
+
+            conn.execute("DELETE FROM lottery_tickets")
+            conn.commit()
+            balance_cache.refresh_conn(conn, list(small_paid) + list(jackpot_paid_net))
+        finally:
+            conn.close()
+
+@dataclass
+class LotteryPayouts:
+    pool_remaining: int
+    small_paid: Dict[int, int]
+    jackpot_users: List[int]
+    jackpot_paid_gross: Dict[int, int]
+    jackpot_paid_net: Dict[int, int]
+    jackpot_tax_paid: Dict[int, int]
+    jackpot_tax_total: int
+    jackpot_rebate_total: int
+
+def compute_lottery_payouts(pool: int, tickets: List[Tuple], win_main: List[int], win_pb: int) -> LotteryPayouts:
+    """
+    Works out who gets paid for a draw. tickets are get_lottery_draw_state() rows.
+    Small tiers are paid from the pool first (scaled down if it runs out), the
+    rest goes to jackpot winners after JACKPOT_TAX_RATE, and the rebate seeds the next pool.
+    """
+    tier_buckets = {5: [], 4: [], 3: [], 2: []}
+    jackpot_users: List[int] = []
+
+    for _tid, uid, n1, n2, n3, n4, n5, pb in tickets:
+        t_main = [n1, n2, n3, n4, n5]
+        mm = _count_main_matches(t_main, win_main)
+        pb_match = (int(pb) == int(win_pb))
+
+        prize, is_jackpot = _prize_for_match(mm, pb_match)
+        if prize <= 0 and not is_jackpot:
+            continue
+
+        if is_jackpot:
+            jackpot_users.append(int(uid))
+        else:
+            if mm in tier_buckets:
+                tier_buckets[int(mm)].append((int(uid), int(prize)))
+
+    pool_remaining = int(pool)
+    small_paid: Dict[int, int] = {}
+
+    for tier in [5, 4, 3, 2]:
+        if pool_remaining <= 0:
+            break
+        bucket = tier_buckets[tier]
+        if not bucket:
+            continue
+
+        tier_total = sum(p for _uid, p in bucket)
+        if tier_total <= pool_remaining:
+            for uid, p in bucket:
+                small_paid[uid] = small_paid.get(uid, 0) + int(p)
+            pool_remaining -= int(tier_total)
+        else:
+            if tier_total <= 0:
+                break
+            scaled_rows = []
+            for uid, p in bucket:
+                scaled = int(math.floor(pool_remaining * (p / tier_total)))
+                scaled_rows.append([uid, p, scaled])
+
+            base_sum = sum(r[2] for r in scaled_rows)
+            rem = pool_remaining - base_sum
+            scaled_rows.sort(key=lambda r: (r[0],))
+            for i in range(int(rem)):
+                scaled_rows[i % len(scaled_rows)][2] += 1
+
+            for uid, _p, scaled in scaled_rows:
+                if scaled > 0:
+                    small_paid[uid] = small_paid.get(uid, 0) + int(scaled)
+
+            pool_remaining = 0
+            break
+
+    # --- Jackpot payout (TAXED) ---
+    jackpot_paid_gross: Dict[int, int] = {}
+    jackpot_paid_net: Dict[int, int] = {}
+    jackpot_tax_paid: Dict[int, int] = {}
+
+    jackpot_tax_total = 0
+    jackpot_rebate_total = 0
+
+    jackpot_total = int(pool_remaining) if jackpot_users else 0
+
+    if jackpot_users and jackpot_total > 0:
+        uniq = sorted(set(jackpot_users))
+        share = jackpot_total // len(uniq)
+        rem = jackpot_total - (share * len(uniq))
+
+        for i, uid in enumerate(uniq):
+            gross = int(share + (1 if i < rem else 0))
+            if gross <= 0:
+                continue
+
+            tax = int(math.floor(gross * float(JACKPOT_TAX_RATE)))
+            if tax < 0:
+                tax = 0
+            if tax > gross:
+                tax = gross
+
+            rebate = int(math.floor(tax * float(JACKPOT_TAX_REBATE_RATE)))
+            if rebate < 0:
+                rebate = 0
+            if rebate > tax:
+                rebate = tax
+
+            net = gross - tax
+
+            jackpot_paid_gross[int(uid)] = gross
+            jackpot_tax_paid[int(uid)] = tax
+            if net > 0:
+                jackpot_paid_net[int(uid)] = net
+
+            jackpot_tax_total += int(tax)
+            jackpot_rebate_total += int(rebate)
+
+        # Pool is consumed by jackpot payout, but rebate creates a new pool seed
+        pool_remaining = int(jackpot_rebate_total)
+
+    return LotteryPayouts(
+        pool_remaining=int(pool_remaining),
+        small_paid=small_paid,
+        jackpot_users=jackpot_users,
+        jackpot_paid_gross=jackpot_paid_gross,
+        jackpot_paid_net=jackpot_paid_net,
+        jackpot_tax_paid=jackpot_tax_paid,
+        jackpot_tax_total=int(jackpot_tax_total),
+        jackpot_rebate_total=int(jackpot_rebate_total),
+    )
+
+def donate_balance_to_lottery(user_id: int, rate: float) -> Optional[Tuple[int, int]]:
+    """
+    Moves floor(balance * rate) from the user into the lottery pool.
+    Returns (donated, new_balance), or None if the user row is missing.
+    """
+    with db_lock:
+        conn = db_connect()
+        try:
+            # Re-read balance inside the lock; deltas can still arrive after the flush
+            balance_cache.flush_conn(conn, [user_id])
+            cur_bal_row = conn.execute(
+                "SELECT balance FROM users WHERE user_id = ?",
+                (int(user_id),),
+            ).fetchone()
+            if not cur_bal_row:
+                return None
+
+            cur_bal = int(cur_bal_row[0]) + balance_cache.unflushed(user_id)
+            donate = int(math.floor(cur_bal * rate))
+            if donate <= 0:
+                return 0, cur_bal
 
+            # Subtract from user
+            _ledger_note(conn, "lottery_donation")
+            debit = _debit_conn(conn, user_id, donate)
+            if not debit.ok:
+                return 0, debit.balance
 
-def _prize_for_match(main_matches: int, pb_match: bool) -> Tuple[int, bool]:
-    mm = int(main_matches)
-    if mm >= 5 and pb_match:
-        return (0, True)
-    if mm >= 5:
-        return (100000, False)
-    if mm == 4:
-        return (25000, False)
-    if mm == 3:
-        return (5000, False)
-    if mm == 2:
-        return (500, False)
-    if mm == 1:
-        return (0, False)
-    return (0, False)
+            # Add to lottery pool
+            pool = _get_lottery_pool_conn(conn)
+            pool += int(donate)
+            _set_lottery_pool_conn(conn, pool)
 
-def _fmt_ticket(main_nums: List[int], pb: int) -> str:
-    return f"{' '.join(str(int(x)) for x in main_nums)}  | PB {int(pb)}"
+            conn.commit()
+            balance_cache.refresh_conn(conn, [user_id])
+            new_bal = debit.balance
+        finally:
+            conn.close()
+    return donate, new_bal
 
 # ============================================================
 # Bot setup
@@ -1607,15 +5068,110 @@ def win_table_text() -> str:
         parts.append(f"{format_two_digits(k)} ({WIN_MULTIPLIERS[k]}x)")
     return ", ".join(parts)
 
+_held_lock_keys: contextvars.ContextVar[Tuple[Tuple[int, tuple], ...]] = contextvars.ContextVar("held_lock_keys", default=())
+
+class StripedLocks:
+    """
+    asyncio locks for command flows that check and then change the same user,
+    market or bet across awaits (balance check -> debit, jail check -> bail).
+    Commands for unrelated keys run in parallel.
+
+        async with locks.hold(("user", sender_id), ("user", recipient_id)):
+            res = await db.run(gift_balance, sender_id, recipient_id, amount)
+        await send_reply(ctx, ...)  # after the lock is released
+
+    Keys hash onto LOCK_STRIPES locks. A hold takes its stripes in ascending
+    order, so two-party operations (gift, steal) can't deadlock: take every
+    key a flow needs in ONE hold() call. A nested hold may re-enter stripes
+    the task already holds, but asking for a new stripe below one it holds
+    would break the ordering, so it raises RuntimeError instead of risking
+    a deadlock. Talking to Discord while holding a lock is logged (see
+    warn_if_locked).
+    """
+
+    def __init__(self, stripes: int = LOCK_STRIPES):
+        self._locks = [asyncio.Lock() for _ in range(max(1, int(stripes)))]
+
+    def _stripe(self, key: tuple) -> int:
+        return hash(key) % len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, *keys: tuple):
+        held = _held_lock_keys.get()
+        already = {stripe for stripe, _key in held}
+        wanted = sorted({self._stripe(k) for k in keys} - already)
+        if wanted and already and wanted[0] < max(already):
+            raise RuntimeError(
+                f"lock order violation: {list(keys)} requested while holding "
+                f"{[key for _stripe, key in held]}; take all keys in one locks.hold() call"
+            )
+        acquired: List[int] = []
+        try:
+            for stripe in wanted:
+                await self._locks[stripe].acquire()
+                acquired.append(stripe)
+            token = _held_lock_keys.set(held + tuple((self._stripe(k), k) for k in keys))
+            start = time.monotonic()
+            try:
+                yield
+            finally:
+                _held_lock_keys.reset(token)
+                held_ms = (time.monotonic() - start) * 1000.0
+                if held_ms > LOCK_HOLD_WARN_MS:
+                    print(f"[LOCKS] {list(keys)} held for {held_ms:.0f} ms")
+        finally:
+            for stripe in reversed(acquired):
+                self._locks[stripe].release()
+
+locks = StripedLocks()
+
+def warn_if_locked(what: str) -> None:
+    """
+    Call before a slow await (Discord API) to catch it running under a command lock.
+    """
+    held = _held_lock_keys.get()
+    if held:
+        print(f"[LOCKS] {what} awaited while holding {[key for _stripe, key in held]}")
+
 async def send_reply(ctx: commands.Context, content: str, **kwargs):
+    warn_if_locked("send_reply")
     return await ctx.reply(content, mention_author=False, **kwargs)
 
+async def reply_to_message(message: discord.Message, content: str, **kwargs):
+    warn_if_locked("message reply")
+    return await message.reply(content, mention_author=False, **kwargs)
+
+async def edit_message(msg: discord.Message, **kwargs):
+    warn_if_locked("message edit")
+    return await msg.edit(**kwargs)
+
+async def reply_not_activated(ctx: commands.Context):
+    return await send_reply(ctx, f"You are not activated yet. Run `{PREFIX}activate` to create your slot profile.")
+
+_CALLER_UNLOADED = object()
+
+async def caller_row(ctx: commands.Context) -> Optional[UserRow]:
+    """
+    The invoking user's row, read at most once per command (preload_caller
+    does it before the other checks) and shared by checks and handlers.
+    Reflects the state before the command wrote anything; after a write,
+    use what the write returned or forget_caller(ctx) and read again.
+    """
+    row = getattr(ctx, "caller", _CALLER_UNLOADED)
+    if row is _CALLER_UNLOADED:
+        row = ctx.caller = await db.read(get_user_row, ctx.author.id)
+    return row
+
+def forget_caller(ctx: commands.Context) -> None:
+    ctx.caller = _CALLER_UNLOADED
+
 async def require_activated(ctx: commands.Context) -> bool:
-    row = get_user(ctx.author.id)
+    row = await caller_row(ctx)
     if row is None:
-        await send_reply(ctx, f"You are not activated yet. Run `{PREFIX}activate` to create your slot profile.")
+        await reply_not_activated(ctx)
         return False
-    update_username(ctx.author.id, display_name(ctx.author))
+    # No write here: a changed name is queued and written back in a batch
+    usernames.note(ctx.author.id, display_name(ctx.author), stored=row.username)
     return True
 
 def is_owner(ctx: commands.Context) -> bool:
@@ -1629,44 +5185,364 @@ _tax_task_started = False
 
 async def market_daemon():
     while True:
-        try:
-            v2_market_tick_once()
-        except Exception as e:
-            print(f"[market_daemon] error: {e}")
+        for guild_id, res in await run_in_partitions(v2_market_tick_once):
+            if isinstance(res, Exception):
+                print(f"[market_daemon] error ({partition_label(guild_id)}): {res}")
         await asyncio.sleep(CRYPTO_V2_TICK_SECONDS)
 
+_archive_task_started = False
+
+async def price_archive_daemon():
+    while True:
+        # A backlog (first run, long downtime) is compacted a batch of hours at a time
+        busy = True
+        while busy:
+            busy = False
+            for guild_id, res in await run_in_partitions(v2_archive_prices_once):
+                if isinstance(res, Exception):
+                    print(f"[price_archive_daemon] error ({partition_label(guild_id)}): {res}")
+                elif res:
+                    busy = True
+                    print(f"[ARCHIVE] {partition_label(guild_id)}: compacted {res} symbol-hours of prices")
+        await asyncio.sleep(CRYPTO_V2_ARCHIVE_SECONDS)
+
 async def tax_daemon():
     while True:
-        try:
-            res = run_tax_if_due()
-            if res:
+        for guild_id, res in await run_in_partitions(run_tax_if_due):
+            if isinstance(res, Exception):
+                print(f"[tax_daemon] error ({partition_label(guild_id)}): {res}")
+            elif res:
                 date_key, users_taxed, total_tax = res
-                print(f"[TAX] {date_key}: taxed {users_taxed} users, collected {total_tax}")
-        except Exception as e:
-            print(f"[tax_daemon] error: {e}")
+                print(f"[TAX] {partition_label(guild_id)} {date_key}: taxed {users_taxed} users, collected {total_tax}")
         await asyncio.sleep(TAX_CHECK_SECONDS)
 
+_balance_task_started = False
+
+async def balance_cache_daemon():
+    """
+    fsyncs the balance journal in batches and periodically writes pending
+    deltas back to the users table.
+    """
+    last_flush = time.monotonic()
+    while True:
+        await asyncio.sleep(BALANCE_JOURNAL_FSYNC_MS / 1000.0)
+        flush_due = time.monotonic() - last_flush >= BALANCE_FLUSH_SECONDS
+        if flush_due:
+            last_flush = time.monotonic()
+        for guild_id in active_partitions():
+            with use_partition(guild_id):
+                try:
+                    await asyncio.to_thread(balance_cache.sync_journal)
+                    if flush_due:
+                        await db.run(balance_cache.flush)
+                        if balance_cache.journal_bytes() >= BALANCE_JOURNAL_COMPACT_BYTES:
+                            await asyncio.to_thread(balance_cache.compact_journal)
+                except Exception as e:
+                    print(f"[balance_cache_daemon] error ({partition_label(guild_id)}): {e}")
+
+_username_task_started = False
+
+async def username_daemon():
+    while True:
+        await asyncio.sleep(USERNAME_FLUSH_SECONDS)
+        for guild_id, res in await run_in_partitions(usernames.flush):
+            if isinstance(res, Exception):
+                print(f"[username_daemon] error ({partition_label(guild_id)}): {res}")
+
+async def start_balance_cache() -> None:
+    global _balance_task_started
+    if not BALANCE_CACHE_ENABLED or _balance_task_started:
+        return
+    _balance_task_started = True
+    await db.run(balance_cache.load)
+    asyncio.create_task(balance_cache_daemon())
+
+# -----------------------------
+# Guild partitions
+# -----------------------------
+_open_partitions: Set[int] = set()
+_partition_open_lock: Optional[asyncio.Lock] = None
+
+def partition_label(guild_id: Optional[int]) -> str:
+    return "main" if guild_id is None else f"guild {guild_id}"
+
+def _register_partition(guild_id: int) -> None:
+    """
+    Records the guild in the routing index (guild_partitions in DB_PATH).
+    The first guild is refused if DB_PATH already has users, unless
+    DB_PARTITION_ALLOW_EXISTING says their guilds may start fresh.
+    """
+    with db_lock:
+        conn = db_connect()
+        try:
+            first = conn.execute("SELECT 1 FROM guild_partitions LIMIT 1").fetchone() is None
+            if first and not DB_PARTITION_ALLOW_EXISTING:
+                users = int(conn.execute("SELECT COUNT(*) FROM users").fetchone()[0])
+                if users:
+                    raise RuntimeError(
+                        f"DB_PARTITION_BY_GUILD: {DB_PATH} already holds {users} users' balances and they "
+                        "are not copied into guild files; set DB_PARTITION_ALLOW_EXISTING = True to start "
+                        "guilds fresh anyway"
+                    )
+            conn.execute(
+                "INSERT OR IGNORE INTO guild_partitions (guild_id, file, created_ts) VALUES (?, ?, ?)",
+                (int(guild_id), os.path.basename(partition_db_path(guild_id)), int(time.time())),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+def list_partitions() -> List[int]:
+    conn = db_connect_read()
+    try:
+        return [int(r[0]) for r in conn.execute("SELECT guild_id FROM guild_partitions ORDER BY guild_id").fetchall()]
+    finally:
+        conn.close()
+
+def active_partitions() -> List[Optional[int]]:
+    """
+    None (DB_PATH) plus every guild partition opened since startup.
+    """
+    return [None] + sorted(_open_partitions)
+
+async def open_partition(guild_id: int) -> None:
+    """
+    Creates or migrates the guild's database file and loads its balance
+    cache. Only the first call per guild does any work.
+    """
+    global _partition_open_lock
+    guild_id = int(guild_id)
+    if guild_id in _open_partitions:
+        return
+    if _partition_open_lock is None:
+        _partition_open_lock = asyncio.Lock()
+    async with _partition_open_lock:
+        if guild_id in _open_partitions:
+            return
+        with use_partition(None):
+            await db.run(_register_partition, guild_id)
+        os.makedirs(os.path.dirname(partition_db_path(guild_id)), exist_ok=True)
+        with use_partition(guild_id):
+            await db.run(init_db)
+            if BALANCE_CACHE_ENABLED and _balance_task_started:
+                await db.run(balance_cache.load)
+        _open_partitions.add(guild_id)
+        print(f"[DB] opened {partition_label(guild_id)}: {partition_db_path(guild_id)}")
+
+async def enter_guild_partition(guild_id: int) -> None:
+    """
+    Routes the rest of the current task's database work to the guild's file.
+    """
+    await open_partition(guild_id)
+    _db_partition.set(int(guild_id))
+
+async def open_known_partitions() -> None:
+    for guild_id in await db.read(list_partitions):
+        await open_partition(guild_id)
+
+async def run_in_partitions(fn, *args) -> List[Tuple[Optional[int], object]]:
+    """
+    Runs fn on every open partition's writer at the same time. Returns
+    (guild_id, result) pairs; a failing partition's exception is returned
+    as its result so one bad file doesn't stop the others.
+    """
+    async def one(guild_id: Optional[int]):
+        with use_partition(guild_id):
+            return await db.run(fn, *args)
+
+    partitions = active_partitions()
+    results = await asyncio.gather(*(one(g) for g in partitions), return_exceptions=True)
+    return list(zip(partitions, results))
+
+# -----------------------------
+# Backups
+# -----------------------------
+_BACKUP_NAME_RE = re.compile(r"^(?P<stem>.+)-(?P<stamp>\d{8}-\d{6})(?:-(?P<label>[a-z0-9-]+))?\.db$")
+
+def _backup_dir() -> str:
+    return BACKUP_DIR or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "backups")
+
+def _backup_stem() -> str:
+    return os.path.splitext(os.path.basename(active_db_path()))[0]
+
+def list_backups() -> List[Tuple[str, str, int]]:
+    """
+    Returns (name, label, size_bytes) for this database's snapshots, newest first.
+    Scheduled snapshots have an empty label.
+    """
+    folder = _backup_dir()
+    if not os.path.isdir(folder):
+        return []
+    out = []
+    for name in os.listdir(folder):
+        m = _BACKUP_NAME_RE.match(name)
+        if not m or m.group("stem") != _backup_stem():
+            continue
+        out.append((m.group("stamp"), name, m.group("label") or "", os.path.getsize(os.path.join(folder, name))))
+    out.sort(reverse=True)
+    return [(name, label, size) for _stamp, name, label, size in out]
+
+def _prune_backups() -> int:
+    """
+    Keeps the newest BACKUP_KEEP snapshots of each kind. Returns how many were deleted.
+    """
+    seen: Dict[str, int] = {}
+    removed = 0
+    for name, label, _size in list_backups():
+        seen[label] = seen.get(label, 0) + 1
+        if seen[label] > BACKUP_KEEP:
+            try:
+                os.remove(os.path.join(_backup_dir(), name))
+                removed += 1
+            except OSError as e:
+                print(f"[BACKUP] could not delete {name}: {e}")
+    return removed
+
+def backup_db_once(label: str = "") -> Tuple[str, int, float]:
+    """
+    Online snapshot of the active database file into the backup folder. Returns (path, pages, seconds).
+
+    Runs on its own connection, never takes db_lock, and is meant for a worker
+    thread (asyncio.to_thread), not the DB writer. The source holds one read
+    transaction for the whole copy: under WAL that pins a consistent snapshot,
+    so the stepped copy never restarts when the bot writes, and writers are
+    never blocked by it. Each step copies BACKUP_PAGES_PER_STEP pages.
+    """
+    folder = _backup_dir()
+    os.makedirs(folder, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    name = f"{_backup_stem()}-{stamp}{'-' + label if label else ''}.db"
+    path = os.path.join(folder, name)
+    tmp = path + ".part"
+    start = time.monotonic()
+    total_pages = 0
+
+    def progress(_status: int, _remaining: int, total: int) -> None:
+        nonlocal total_pages
+        total_pages = total
+
+    src = sqlite3.connect(active_db_path(), isolation_level=None, check_same_thread=False)
+    dst = sqlite3.connect(tmp, check_same_thread=False)
+    try:
+        src.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)};")
+        src.execute("PRAGMA query_only = ON;")
+        src.execute("BEGIN")
+        src.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        src.backup(dst, pages=max(1, int(BACKUP_PAGES_PER_STEP)), progress=progress, sleep=BACKUP_STEP_SLEEP_MS / 1000.0)
+        src.execute("COMMIT")
+        # Self-contained file: no -wal/-shm needed to open it later
+        dst.execute("PRAGMA journal_mode = DELETE;")
+        check = dst.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        src.close()
+        dst.close()
+    if check != "ok":
+        os.remove(tmp)
+        raise RuntimeError(f"backup failed quick_check: {check}")
+    os.replace(tmp, path)
+    _prune_backups()
+    return path, total_pages, time.monotonic() - start
+
+def resolve_backup(name: str) -> Optional[str]:
+    """
+    Path of a snapshot by file name ("latest" = newest scheduled or manual one).
+    Only names from list_backups() are accepted.
+    """
+    backups = list_backups()
+    if name.lower() == "latest":
+        for n, label, _size in backups:
+            if label != "pre-restore":
+                return os.path.join(_backup_dir(), n)
+        return None
+    for n, _label, _size in backups:
+        if n == name:
+            return os.path.join(_backup_dir(), n)
+    return None
+
+def restore_backup(path: str) -> int:
+    """
+    Replaces the live database with a snapshot, then migrates it and rebuilds
+    the derived caches. Runs on the writer thread (await db.run(...)), so no
+    other write can interleave. Returns the number of users restored.
+
+    Balance deltas still pending in the cache belong to the timeline being
+    discarded and are dropped together with the journal.
+    """
+    snap = sqlite3.connect(path, check_same_thread=False)
+    try:
+        check = snap.execute("PRAGMA quick_check").fetchone()[0]
+        if check != "ok":
+            raise RuntimeError(f"snapshot failed quick_check: {check}")
+        version = int(snap.execute("PRAGMA user_version").fetchone()[0])
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f"snapshot schema v{version} is newer than this build (v{SCHEMA_VERSION})")
+
+        with db_lock:
+            conn = db_connect()
+            try:
+                reload_balances = balance_cache.discard()
+                usernames.forget()
+                member_index.forget()
+                price_rings.close()
+                market_book.forget()
+                snap.backup(conn)
+                migrate_db_conn(conn)
+                if reload_balances:
+                    balance_cache.load_conn(conn)
+                return int(conn.execute("SELECT COUNT(*) FROM users").fetchone()[0])
+            finally:
+                conn.close()
+    finally:
+        snap.close()
+
+_backup_task_started = False
+
+async def backup_daemon():
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL_SECONDS)
+        for guild_id in active_partitions():
+            with use_partition(guild_id):
+                try:
+                    if balance_cache.loaded:
+                        # Snapshot the cached balances too, not just what was last written back
+                        await db.run(balance_cache.flush)
+                    path, pages, secs = await asyncio.to_thread(backup_db_once)
+                    print(f"[BACKUP] {os.path.basename(path)}: {pages} pages in {secs:.1f}s")
+                except Exception as e:
+                    print(f"[backup_daemon] error ({partition_label(guild_id)}): {e}")
+
 _parole_task_started = False
 
 async def parole_daemon():
     while True:
-        try:
-            parole_tick_once()
-        except Exception as e:
-            print(f"[parole_daemon] error: {e}")
+        for guild_id, res in await run_in_partitions(parole_tick_once):
+            if isinstance(res, Exception):
+                print(f"[parole_daemon] error ({partition_label(guild_id)}): {res}")
         await asyncio.sleep(PAROLE_CHECK_SECONDS)
 
 
 @bot.event
 async def on_ready():
-    global _market_task_started, _tax_task_started
-    init_db()
+    global _market_task_started, _tax_task_started, _backup_task_started, _username_task_started, _archive_task_started
+    await db.run(init_db)
+    await start_balance_cache()
+    if DB_PARTITION_BY_GUILD:
+        await open_known_partitions()
     if not _market_task_started:
         _market_task_started = True
         asyncio.create_task(market_daemon())
     if not _tax_task_started:
         _tax_task_started = True
         asyncio.create_task(tax_daemon())
+    if BACKUP_ENABLED and not _backup_task_started:
+        _backup_task_started = True
+        asyncio.create_task(backup_daemon())
+    if not _username_task_started:
+        _username_task_started = True
+        asyncio.create_task(username_daemon())
+    if not _archive_task_started:
+        _archive_task_started = True
+        asyncio.create_task(price_archive_daemon())
     print(f"Logged in as {bot.user} (ID: {bot.user.id})")
 
 @bot.event
@@ -1674,6 +5550,11 @@ async def on_message(message):
     if message.author.bot:
         return
 
+    # Only commands touch the economy: chat messages never open a guild's file
+    ctx = await bot.get_context(message)
+    if DB_PARTITION_BY_GUILD and ctx.valid and message.guild is not None:
+        await enter_guild_partition(message.guild.id)
+
     if message.reference and message.reference.message_id:
         try:
             ref_msg = message.reference.resolved
@@ -1686,7 +5567,7 @@ async def on_message(message):
             # Global trigger odds
             if TRIGGER_REPLY_CHANCE_DENOM > 1:
                 if random.randint(1, int(TRIGGER_REPLY_CHANCE_DENOM)) != 1:
-                    await bot.process_commands(message)
+                    await bot.invoke(ctx)
                     return
 
             now = time.time()
@@ -1703,26 +5584,29 @@ async def on_message(message):
                         # but we still honor denom if you want "rare image-only"
                         denom = int(v.image_chance_denom or 1)
                         if random.randint(1, denom) == 1:
-                            await message.reply(v.image_url, mention_author=False)
+                            await reply_to_message(message, v.image_url)
                     else:
                         # Fallback if misconfigured
-                        await message.reply(" ", mention_author=False)
+                        await reply_to_message(message, " ")
 
                 elif v.mode == "text":
-                    await message.reply(v.text or " ", mention_author=False)
+                    await reply_to_message(message, v.text or " ")
 
                 else:  # "text_then_image"
-                    await message.reply(v.text or " ", mention_author=False)
+                    await reply_to_message(message, v.text or " ")
                     if v.image_url and int(v.image_chance_denom) > 0:
                         if random.randint(1, int(v.image_chance_denom)) == 1:
-                            await message.reply(v.image_url, mention_author=False)
+                            await reply_to_message(message, v.image_url)
 
-    await bot.process_commands(message)
+    await bot.invoke(ctx)
 
 @bot.event
 async def on_ready():
-    global _market_task_started, _tax_task_started, _parole_task_started
-    init_db()
+    global _market_task_started, _tax_task_started, _parole_task_started, _backup_task_started, _username_task_started, _archive_task_started
+    await db.run(init_db)
+    await start_balance_cache()
+    if DB_PARTITION_BY_GUILD:
+        await open_known_partitions()
     if not _market_task_started:
         _market_task_started = True
         asyncio.create_task(market_daemon())
@@ -1732,16 +5616,52 @@ async def on_ready():
     if not _parole_task_started:
         _parole_task_started = True
         asyncio.create_task(parole_daemon())
+    if BACKUP_ENABLED and not _backup_task_started:
+        _backup_task_started = True
+        asyncio.create_task(backup_daemon())
+    if not _username_task_started:
+        _username_task_started = True
+        asyncio.create_task(username_daemon())
+    if not _archive_task_started:
+        _archive_task_started = True
+        asyncio.create_task(price_archive_daemon())
 
     print(f"Logged in as {bot.user} (ID: {bot.user.id})")
 
+def _guild_db(guild_id: int):
+    """
+    use_partition() for the database file that holds this guild's users.
+    """
+    return use_partition(int(guild_id) if DB_PARTITION_BY_GUILD else None)
+
+@bot.event
+async def on_member_join(member: discord.Member):
+    if member.bot:
+        return
+    with _guild_db(member.guild.id):
+        member_index.add_member(member.guild.id, member.id)
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    with _guild_db(member.guild.id):
+        member_index.remove_member(member.guild.id, member.id)
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    with _guild_db(guild.id):
+        member_index.drop_guild(guild.id)
+
 
 
 # =======================
 # Blackjack
 # =======================
 
-BLACKJACK_GAMES: Dict[int, dict] = {}
+# Open hands by (guild partition, user id); the stake is already debited from that partition
+BLACKJACK_GAMES: Dict[Tuple[Optional[int], int], dict] = {}
+
+def bj_key(user_id: int) -> Tuple[Optional[int], int]:
+    return (_db_partition.get(), int(user_id))
 BJ_RANKS = ["A", "2", "3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K"]
 
 def bj_draw_card() -> str:
@@ -1854,73 +5774,113 @@ def roulette_is_win(spin_n: int, rule: dict) -> bool:
 # ============================================================
 
 def get_jail_status(user_id: int) -> Tuple[bool, int]:
-    with db_lock:
-        conn = db_connect()
-        try:
-            row = conn.execute(
-                "SELECT jailed, jail_ts FROM users WHERE user_id = ?",
-                (int(user_id),),
-            ).fetchone()
-            if not row:
-                return (False, 0)
-            return (int(row[0]) == 1, int(row[1]))
-        finally:
-            conn.close()
+    conn = db_connect_read()
+    try:
+        row = conn.execute(
+            "SELECT jailed, jail_ts FROM users WHERE user_id = ?",
+            (int(user_id),),
+        ).fetchone()
+        if not row:
+            return (False, 0)
+        return (int(row[0]) == 1, int(row[1]))
+    finally:
+        conn.close()
+
+def _set_jailed_conn(conn: sqlite3.Connection, user_id: int, jailed: bool) -> None:
+    if jailed:
+        now = int(time.time())
+        conn.execute(
+            "UPDATE users SET jailed = 1, jail_ts = ? WHERE user_id = ?",
+            (now, int(user_id)),
+        )
+    else:
+        conn.execute(
+            "UPDATE users SET jailed = 0, jail_ts = 0 WHERE user_id = ?",
+            (int(user_id),),
+        )
 
 def set_jailed(user_id: int, jailed: bool) -> None:
-    with db_lock:
-        conn = db_connect()
-        try:
-            if jailed:
-                now = int(time.time())
-                conn.execute(
-                    "UPDATE users SET jailed = 1, jail_ts = ? WHERE user_id = ?",
-                    (now, int(user_id)),
-                )
-            else:
-                conn.execute(
-                    "UPDATE users SET jailed = 0, jail_ts = 0 WHERE user_id = ?",
-                    (int(user_id),),
-                )
-            conn.commit()
-        finally:
-            conn.close()
+    with unit_of_work() as conn:
+        _set_jailed_conn(conn, user_id, jailed)
 
 def get_parole_status(user_id: int) -> Tuple[bool, int, int]:
     """
     Returns (paroled, parole_ts, parole_last_pay_ts)
     """
-    with db_lock:
-        conn = db_connect()
-        try:
-            row = conn.execute(
-                "SELECT paroled, parole_ts, parole_last_pay_ts FROM users WHERE user_id = ?",
-                (int(user_id),),
-            ).fetchone()
-            if not row:
-                return (False, 0, 0)
-            return (int(row[0]) == 1, int(row[1]), int(row[2]))
-        finally:
-            conn.close()
+    conn = db_connect_read()
+    try:
+        row = conn.execute(
+            "SELECT paroled, parole_ts, parole_last_pay_ts FROM users WHERE user_id = ?",
+            (int(user_id),),
+        ).fetchone()
+        if not row:
+            return (False, 0, 0)
+        return (int(row[0]) == 1, int(row[1]), int(row[2]))
+    finally:
+        conn.close()
+
+def _set_parole_conn(conn: sqlite3.Connection, user_id: int, paroled: bool) -> None:
+    if paroled:
+        now = int(time.time())
+        conn.execute(
+            "UPDATE users SET paroled = 1, parole_ts = ?, parole_last_pay_ts = ? WHERE user_id = ?",
+            (now, now, int(user_id)),
+        )
+    else:
+        conn.execute(
+            "UPDATE users SET paroled = 0, parole_ts = 0, parole_last_pay_ts = 0 WHERE user_id = ?",
+            (int(user_id),),
+        )
 
 def set_parole(user_id: int, paroled: bool) -> None:
-    with db_lock:
-        conn = db_connect()
-        try:
-            if paroled:
-                now = int(time.time())
-                conn.execute(
-                    "UPDATE users SET paroled = 1, parole_ts = ?, parole_last_pay_ts = ? WHERE user_id = ?",
-                    (now, now, int(user_id)),
-                )
+    with unit_of_work() as conn:
+        _set_parole_conn(conn, user_id, paroled)
+
+# Share of the balance !getoutofjail costs
+BAIL_RATE = 0.12
+
+def bail_out_of_jail(user_id: int) -> Optional[Tuple[int, int]]:
+    """
+    !getoutofjail in one transaction: pay BAIL_RATE of the balance, leave
+    jail, start parole. Returns (cost, new_balance), or None if not jailed.
+    """
+    with unit_of_work() as conn:
+        row = conn.execute("SELECT jailed FROM users WHERE user_id = ?", (int(user_id),)).fetchone()
+        if not row or int(row[0]) != 1:
+            return None
+        bal = _get_user_conn(conn, user_id)[2]
+        cost = max(0, int(math.floor(bal * BAIL_RATE)))
+        if cost > 0:
+            _ledger_note(conn, "bail")
+            debit = _debit_conn(conn, user_id, cost)
+            if debit.ok:
+                bal = debit.balance
             else:
-                conn.execute(
-                    "UPDATE users SET paroled = 0, parole_ts = 0, parole_last_pay_ts = 0 WHERE user_id = ?",
-                    (int(user_id),),
-                )
-            conn.commit()
-        finally:
-            conn.close()
+                cost = 0
+        _set_jailed_conn(conn, user_id, False)
+        _set_parole_conn(conn, user_id, True)
+        return cost, bal
+
+def parole_payment(balance: int, steps: int) -> int:
+    """
+    What `steps` missed parole intervals cost: each takes PAROLE_RATE of what
+    is left (floor, at least 1), so it's truly "5% of your money" each time.
+    """
+    current_balance = int(balance)
+    paid_total = 0
+    for _ in range(int(steps)):
+        if current_balance <= 0:
+            break
+        take = int(math.floor(current_balance * PAROLE_RATE))
+        if take <= 0 and current_balance > 0:
+            take = 1
+        take = min(take, current_balance)
+        if take <= 0:
+            break
+
+        current_balance -= take
+        paid_total += take
+    return paid_total
 
 def parole_tick_once() -> None:
     """
@@ -1941,6 +5901,7 @@ def parole_tick_once() -> None:
             if not rows:
                 return
 
+            balance_cache.flush_conn(conn, [int(r[0]) for r in rows])
             pool = _get_lottery_pool_conn(conn)
 
             for uid, bal, parole_ts, last_pay_ts in rows:
@@ -1965,35 +5926,27 @@ def parole_tick_once() -> None:
                 if steps <= 0:
                     continue
 
-                # Apply each step sequentially so it's truly "5% of your money" each time
-                current_balance = int(
-                    conn.execute("SELECT balance FROM users WHERE user_id = ?", (uid,)).fetchone()[0]
-                )
-
-                paid_total = 0
-                for _ in range(int(steps)):
-                    if current_balance <= 0:
+                # Games keep adding deltas while this runs (the flush above is not a
+                # barrier): count them, and take the payment as a conditional debit
+                _ledger_note(conn, "parole")
+                for _attempt in range(2):
+                    current_balance = int(
+                        conn.execute("SELECT balance FROM users WHERE user_id = ?", (uid,)).fetchone()[0]
+                    ) + balance_cache.unflushed(uid)
+                    paid_total = parole_payment(current_balance, int(steps))
+                    if paid_total <= 0:
                         break
-                    take = int(math.floor(current_balance * PAROLE_RATE))
-                    if take <= 0 and current_balance > 0:
-                        take = 1
-                    take = min(take, current_balance)
-                    if take <= 0:
+                    if balance_cache.debit_conn(conn, uid, paid_total) is not None:
+                        pool += int(paid_total)
                         break
 
-                    current_balance -= take
-                    paid_total += take
-
-                if paid_total > 0:
-                    conn.execute("UPDATE users SET balance = ? WHERE user_id = ?", (int(current_balance), uid))
-                    pool += int(paid_total)
-
                 # Advance last pay time by the number of processed steps
                 new_last = last_pay_ts + int(steps) * PAROLE_PAY_INTERVAL_SECONDS
                 conn.execute("UPDATE users SET parole_last_pay_ts = ? WHERE user_id = ?", (int(new_last), uid))
 
             _set_lottery_pool_conn(conn, int(pool))
             conn.commit()
+            balance_cache.refresh_conn(conn, [int(r[0]) for r in rows])
         finally:
             conn.close()
 
@@ -2080,14 +6033,7 @@ def plinko_render_multi(
 @bot.command(name="ticketcount", aliases=["ticketscount", "totaltickets", "pooltickets"])
 @commands.guild_only()
 async def ticketcount_cmd(ctx: commands.Context):
-    with db_lock:
-        conn = db_connect()
-        try:
-            total = int(conn.execute("SELECT COUNT(*) FROM lottery_tickets").fetchone()[0])
-            pool = int(_get_lottery_pool_conn(conn))
-            users = int(conn.execute("SELECT COUNT(DISTINCT user_id) FROM lottery_tickets").fetchone()[0])
-        finally:
-            conn.close()
+    total, users, pool = await db.read(get_lottery_ticket_stats)
 
     await send_reply(
         ctx,
@@ -2101,64 +6047,34 @@ async def ticketcount_cmd(ctx: commands.Context):
 @commands.guild_only()
 async def blow_cmd(ctx: commands.Context, *, _words: str = ""):
     """
-    !blowjob (anything...)
-    Takes 7% of your current cash balance and adds it to the lottery pool.
-    Extra words are ignored so users can type: !blow yes please
-    """
-    if not await require_activated(ctx):
-        return
-
-    row = get_user(ctx.author.id)
-    if row is None:
-        await send_reply(ctx, f"You are not activated yet. Run `{PREFIX}activate` first.")
-        return
-
-    bal = int(row[2])
-    donate = int(math.floor(bal * 0.07))
-
-    if donate <= 0:
-        await send_reply(ctx, "Not right now.")
-        return
-
-    with db_lock:
-        conn = db_connect()
-        try:
-            # Re-read balance inside the lock for accuracy
-            cur_bal_row = conn.execute(
-                "SELECT balance FROM users WHERE user_id = ?",
-                (int(ctx.author.id),),
-            ).fetchone()
-            if not cur_bal_row:
-                await send_reply(ctx, "Database error: missing your user row.")
-                return
-
-            cur_bal = int(cur_bal_row[0])
-            donate = int(math.floor(cur_bal * 0.10))
-            if donate <= 0:
-                await send_reply(ctx, "Not right now.")
-                return
+    !blowjob (anything...)
+    Takes 7% of your current cash balance and adds it to the lottery pool.
+    Extra words are ignored so users can type: !blow yes please
+    """
+    if not await require_activated(ctx):
+        return
 
-            # Subtract from user
-            conn.execute(
-                "UPDATE users SET balance = balance - ? WHERE user_id = ?",
-                (int(donate), int(ctx.author.id)),
-            )
+    async with locks.hold(("user", ctx.author.id)):
+        row = await caller_row(ctx)
+        donate = int(math.floor(row.balance * 0.07)) if row is not None else 0
+        if donate > 0:
+            res = await db.run(donate_balance_to_lottery, ctx.author.id, 0.10)
 
-            # Add to lottery pool
-            pool = _get_lottery_pool_conn(conn)
-            pool += int(donate)
-            _set_lottery_pool_conn(conn, pool)
+    if row is None:
+        await send_reply(ctx, f"You are not activated yet. Run `{PREFIX}activate` first.")
+        return
 
-            conn.commit()
+    if donate <= 0:
+        await send_reply(ctx, "Not right now.")
+        return
 
-            new_bal = int(
-                conn.execute(
-                    "SELECT balance FROM users WHERE user_id = ?",
-                    (int(ctx.author.id),),
-                ).fetchone()[0]
-            )
-        finally:
-            conn.close()
+    if res is None:
+        await send_reply(ctx, "Database error: missing your user row.")
+        return
+    donate, _new_bal = res
+    if donate <= 0:
+        await send_reply(ctx, "Not right now.")
+        return
 
     await send_reply(
         ctx,
@@ -2169,7 +6085,7 @@ async def blow_cmd(ctx: commands.Context, *, _words: str = ""):
 
 @bot.command(name="crypto")
 async def crypto_cmd(ctx: commands.Context):
-    coins = v2_list_markets()
+    coins = await db.read(v2_list_markets)
     if not coins:
         await send_reply(ctx, "No cryptos available.")
         return
@@ -2184,7 +6100,7 @@ async def crypto_cmd(ctx: commands.Context):
 
 @bot.command(name="price")
 async def price_cmd(ctx: commands.Context, symbol: str):
-    c = v2_get_market(symbol)
+    c = await db.read(v2_get_market, symbol)
     if c is None:
         await send_reply(ctx, f"Unknown crypto symbol `{symbol}`. Use `{PREFIX}crypto`.")
         return
@@ -2201,66 +6117,66 @@ async def price_cmd(ctx: commands.Context, symbol: str):
 
 @bot.command(name="buy")
 async def buy_cmd(ctx: commands.Context, symbol: str, money: str):
-    if not await require_activated(ctx):
-        return
     try:
         money_i = parse_amount_int(money, min_value=1)
     except ValueError:
-        await send_reply(ctx, f"Usage: `{PREFIX}buy <symbol> <money>` (supports 2K/3M/1B/...)")
+        if await require_activated(ctx):
+            await send_reply(ctx, f"Usage: `{PREFIX}buy <symbol> <money>` (supports 2K/3M/1B/...)")
         return
 
-    ok, msg = v2_buy(ctx.author.id, symbol, money_i)
+    # No ("market", sym) hold: trade_writes applies a coin's trades in order, and
+    # holding it here would turn a burst into one trade per commit
+    async with locks.hold(("user", ctx.author.id)):
+        res = await trade_writes.buy(ctx.author.id, display_name(ctx.author), symbol, money_i)
+    if res is None:
+        await reply_not_activated(ctx)
+        return
+    ok, msg, bal, owned = res
     if not ok:
         await send_reply(ctx, msg)
         return
 
-    row = get_user(ctx.author.id)
-    bal = int(row[2]) if row else 0
     sym = symbol.strip().upper()
-    owned = v2_get_holding(ctx.author.id, sym)
     await send_reply(ctx, f"{msg}\nBalance: **{fmt_money(bal)}** | Holding: **{fmt_coin(owned, 3)} {sym}**")
 
 @bot.command(name="sell")
 async def sell_cmd(ctx: commands.Context, symbol: str, coins: str):
-    if not await require_activated(ctx):
-        return
-
     sym = symbol.strip().upper()
     c_raw = (coins or "").strip().lower()
 
     if c_raw in ("all", "max"):
-        owned = v2_get_holding(ctx.author.id, sym)
-        if owned <= 0:
-            await send_reply(ctx, f"You have no **{sym}** to sell.")
-            return
-        coins_f = float(owned)
+        coins_f = None
     else:
         try:
             coins_f = float(coins)
         except Exception:
-            await send_reply(ctx, f"Usage: `{PREFIX}sell <symbol> <coins|all>`")
+            if await require_activated(ctx):
+                await send_reply(ctx, f"Usage: `{PREFIX}sell <symbol> <coins|all>`")
             return
 
-    ok, msg = v2_sell(ctx.author.id, sym, coins_f)
+    async with locks.hold(("user", ctx.author.id)):
+        res = await trade_writes.sell(ctx.author.id, display_name(ctx.author), sym, coins_f)
+    if res is None:
+        await reply_not_activated(ctx)
+        return
+    ok, msg, bal, owned_after = res
     if not ok:
         await send_reply(ctx, msg)
         return
 
-    row = get_user(ctx.author.id)
-    bal = int(row[2]) if row else 0
-    owned_after = v2_get_holding(ctx.author.id, sym)
     await send_reply(ctx, f"{msg}\nBalance: **{fmt_money(bal)}** | Holding: **{fmt_coin(owned_after, 3)} {sym}**")
 
 @bot.command(name="portfolio")
 async def portfolio_cmd(ctx: commands.Context):
     if not await require_activated(ctx):
         return
-    holdings = v2_get_portfolio(ctx.author.id)
+    holdings = await db.read(v2_get_portfolio, ctx.author.id)
     if not holdings:
         await send_reply(ctx, "You have no crypto holdings yet.")
         return
 
-    coin_map = {sym: (price, name) for sym, name, price, _day_open, _rm, _fee in v2_list_markets()}
+    markets = await db.read(v2_list_markets)
+    coin_map = {sym: (price, name) for sym, name, price, _day_open, _rm, _fee in markets}
 
     total_value = 0.0
     lines = ["**Your Portfolio (V2)**"]
@@ -2272,8 +6188,8 @@ async def portfolio_cmd(ctx: commands.Context):
         total_value += value
         lines.append(f"**{sym}**: {fmt_coin(amt, 3)}  (≈ **{fmt_crypto_money(value, 3)}**  ̷M̷)")
 
-    row = get_user(ctx.author.id)
-    cash = float(int(row[2])) if row else 0.0
+    row = await caller_row(ctx)
+    cash = float(row.balance) if row else 0.0
 
     lines.append("")
     lines.append(f"Cash: **{fmt_money(int(cash))}**  ̷M̷")
@@ -2283,7 +6199,7 @@ async def portfolio_cmd(ctx: commands.Context):
 
 @bot.command(name="crypto_news")
 async def crypto_news_cmd(ctx: commands.Context):
-    events = v2_recent_events(limit=8)
+    events = await db.read(v2_recent_events, limit=8)
     if not events:
         await send_reply(ctx, "No crypto events recorded yet.")
         return
@@ -2293,6 +6209,13 @@ async def crypto_news_cmd(ctx: commands.Context):
         lines.append(f"{when} — **{sym} {kind}** ({pct:+.2f}%) — {note}")
     await send_reply(ctx, "\n".join(lines))
 
+def fmt_candle_interval(seconds: int) -> str:
+    if seconds % 86400 == 0:
+        return f"{seconds // 86400}d"
+    if seconds % 3600 == 0:
+        return f"{seconds // 3600}h"
+    return f"{seconds // 60}m"
+
 def render_ascii_price_chart(points: List[Tuple[int, float]], width: int = 60, height: int = 15) -> str:
     if not points:
         return "(no data)"
@@ -2356,7 +6279,7 @@ def render_ascii_price_chart(points: List[Tuple[int, float]], width: int = 60, h
 
 @bot.command(name="crypto_graph", aliases=["graph", "chart"])
 async def crypto_graph_cmd(ctx: commands.Context, symbol: str, window: str = "24h"):
-    c = v2_get_market(symbol)
+    c = await db.read(v2_get_market, symbol)
     if c is None:
         await send_reply(ctx, f"Unknown crypto symbol `{symbol}`. Use `{PREFIX}crypto`.")
         return
@@ -2366,14 +6289,29 @@ async def crypto_graph_cmd(ctx: commands.Context, symbol: str, window: str = "24
     now = int(time.time())
     since_ts = now - seconds
 
-    pts = v2_get_price_series_since(sym, since_ts, limit=5000)
+    if not price_rings.loaded:
+        await db.read(price_rings.load)
+    pts = price_rings.window(sym, since_ts)
+    if pts is not None and len(pts) >= 5:
+        # Whole window is in memory: no SQL at all
+        chart = render_ascii_price_chart(pts, width=60, height=15)
+        await send_reply(ctx, f"**{sym}** price chart (V2) — window: **{window}** ({len(pts)} points)\n```{chart}```")
+        return
+
+    interval, candles = await db.read(v2_get_candles, sym, since_ts)
+    pts = [(cd.ts, cd.close) for cd in candles]
     if len(pts) < 5:
         _sym, _name, rm, rc, _last_price, _ts, _day_open, _fee = c
         price_now = _v2_price(float(rm), float(rc))
         pts = [(now, float(price_now))]
 
     chart = render_ascii_price_chart(pts, width=60, height=15)
-    await send_reply(ctx, f"**{sym}** price chart (V2) — window: **{window}** (points: {len(pts)})\n```{chart}```")
+    label = fmt_candle_interval(interval)
+    volume = sum(cd.volume for cd in candles)
+    await send_reply(
+        ctx,
+        f"**{sym}** price chart (V2) — window: **{window}** ({len(pts)} × {label} candles, volume {fmt_money(int(volume))} MM)\n```{chart}```",
+    )
 
 @bot.command(name="crypto_set")
 @commands.guild_only()
@@ -2388,7 +6326,7 @@ async def crypto_set_cmd(ctx: commands.Context, symbol: str, start_price: str, l
         await send_reply(ctx, f"Usage: `{PREFIX}crypto_set <symbol> <start_price> <liquidity_money>`")
         return
 
-    ok, msg = v2_set_market(symbol, sp, lm)
+    ok, msg = await db.run(v2_set_market, symbol, sp, lm)
     await send_reply(ctx, msg if ok else f"Error: {msg}")
 
 @bot.command(name="helpme")
@@ -2401,7 +6339,9 @@ async def help_cmd(ctx: commands.Context):
         f"`{PREFIX}balance` — Show balance (auto-applies daily bonus if due).\n"
         f"`{PREFIX}daily` — Claim daily bonus (**+{fmt_money(DAILY_CREDITS)}** every 24 hours).\n"
         f"`{PREFIX}slot <bet>` — Spin 2-digit number and bet credits. Wins: {win_table_text()}.\n"
-        f"`{PREFIX}leaders` — Show the top **{TOP_N}** balances.\n"
+        f"`{PREFIX}leaders [page]` — Show the top balances, **{TOP_N}** per page.\n"
+        f"`{PREFIX}networth [page]` — Leaderboard by cash + crypto value.\n"
+        f"`{PREFIX}rank [@User]` — Show your (or someone's) leaderboard position.\n"
         f"`{PREFIX}gift @User <amount>` — Gift credits to someone (taken from you).\n"
         f"`{PREFIX}giftall <amount> @User1 @User2 ...` — Gift multiple users (taken from YOUR balance).\n"
         f"`{PREFIX}gifteveryone <amount> [ping|noping]` — Gift to every activated user in this server.\n"
@@ -2409,6 +6349,10 @@ async def help_cmd(ctx: commands.Context):
         f"`{PREFIX}take @User <amount>` — Owner-only: take credits.\n"
         f"`{PREFIX}tax_status` — Show whether tax is due / last tax date.\n"
         f"`{PREFIX}tax_now` — Owner-only (only runs Wed/Fri/Sun).\n"
+        f"`{PREFIX}dbstats [reset]` — Owner-only: query timings, db lock waits, slow queries.\n"
+        f"`{PREFIX}backup_now` / `{PREFIX}backups` — Owner-only: take / list database snapshots.\n"
+        f"`{PREFIX}restore <name|latest>` — Owner-only: restore a snapshot (current state is backed up first).\n"
+        f"`{PREFIX}ledger @User [n]` / `{PREFIX}ledger_check [full]` — Owner-only: balance history / audit balances.\n"
         "\n"
         "**Crypto (AMM Market)**\n"
         f"`{PREFIX}crypto` — List markets.\n"
@@ -2478,21 +6422,58 @@ def steal_success_prob(target_balance: int) -> float:
     p = base * ratio
     return max(floor, min(base, p))
 
+# Minimum balance required to use !steal
+MIN_STEAL_BALANCE = 500
+
+def attempt_steal(thief_id: int, thief_name: str, target_id: int) -> Tuple[str, float, int, int, int]:
+    """
+    Rolls a whole !steal in one transaction.
+    Returns (outcome, success_chance, amount, thief_balance, target_balance) where outcome is
+    "not_activated", "target_not_activated", "too_poor", "success", "jailed" or "catastrophe".
+    """
+    with unit_of_work() as conn:
+        thief = _touch_user_conn(conn, thief_id, thief_name)
+        if thief is None:
+            return "not_activated", 0.0, 0, 0, 0
+        target = _get_user_conn(conn, target_id)
+        if target is None:
+            return "target_not_activated", 0.0, 0, int(thief[2]), 0
+
+        thief_bal = int(thief[2])
+        target_bal = int(target[2])
+        if thief_bal < MIN_STEAL_BALANCE:
+            return "too_poor", 0.0, 0, thief_bal, target_bal
+
+        p_success = steal_success_prob(target_bal)
+        if random.random() < p_success:
+            stolen, thief_bal, target_bal = _steal_conn(conn, thief_id, target_id, 0.05)
+            return "success", p_success, stolen, thief_bal, target_bal
+
+        if random.random() < 0.95:
+            _set_jailed_conn(conn, thief_id, True)
+            return "jailed", p_success, 0, thief_bal, target_bal
+
+        loss = int(math.floor(thief_bal * 0.75))
+        if loss <= 0 and thief_bal > 0:
+            loss = 1
+        if loss > 0:
+            _ledger_note(conn, "steal_fail", target_id)
+            debit = _debit_conn(conn, thief_id, loss)
+            if debit.ok:
+                thief_bal = debit.balance
+            else:
+                loss = 0
+        return "catastrophe", p_success, loss, thief_bal, target_bal
+
 @bot.command(name="steal")
 @commands.guild_only()
 async def steal_cmd(ctx: commands.Context, target: discord.Member, ping: str = "noping"):
-    if not await require_activated(ctx):
-        return
-
     if target.bot:
         await send_reply(ctx, "You can't steal from bots.")
         return
     if target.id == ctx.author.id:
         await send_reply(ctx, "You can't steal from yourself.")
         return
-    if get_user(target.id) is None:
-        await send_reply(ctx, f"That user is not activated yet. They must run `{PREFIX}activate` first.")
-        return
 
     p = (ping or "noping").strip().lower()
     do_ping = p in ("ping", "pings", "yes", "y", "true", "t", "1")
@@ -2503,18 +6484,20 @@ async def steal_cmd(ctx: commands.Context, target: discord.Member, ping: str = "
     allowed = discord.AllowedMentions(users=[target]) if do_ping else discord.AllowedMentions.none()
     target_ref = target.mention if do_ping else target.display_name
 
-    thief_row = get_user(ctx.author.id)
-    target_row = get_user(target.id)
-    if thief_row is None or target_row is None:
-        await send_reply(ctx, "Market error: missing user row(s).")
-        return
+    async with locks.hold(("user", ctx.author.id), ("user", target.id)):
+        outcome, p_success, amount, thief_bal, target_bal = await db.run(
+            attempt_steal, ctx.author.id, display_name(ctx.author), target.id
+        )
 
-    thief_bal = int(thief_row[2])
-    target_bal = int(target_row[2])
+    if outcome == "not_activated":
+        await reply_not_activated(ctx)
+        return
+    if outcome == "target_not_activated":
+        await send_reply(ctx, f"That user is not activated yet. They must run `{PREFIX}activate` first.")
+        return
 
     # --- Minimum balance requirement ---
-    MIN_STEAL_BALANCE = 500
-    if thief_bal < MIN_STEAL_BALANCE:
+    if outcome == "too_poor":
         await send_reply(
             ctx,
             f"You need at least **{fmt_money(MIN_STEAL_BALANCE)}** Marcus Money to use `{PREFIX}steal`.\n"
@@ -2523,50 +6506,21 @@ async def steal_cmd(ctx: commands.Context, target: discord.Member, ping: str = "
         )
         return
 
-    p_success = steal_success_prob(target_bal)
-
-    if random.random() < p_success:
-        with db_lock:
-            conn = db_connect()
-            try:
-                trow = conn.execute("SELECT balance FROM users WHERE user_id = ?", (int(target.id),)).fetchone()
-                arow = conn.execute("SELECT balance FROM users WHERE user_id = ?", (int(ctx.author.id),)).fetchone()
-                if not trow or not arow:
-                    await send_reply(ctx, "Market error: missing balances.")
-                    return
-
-                tbal = int(trow[0])
-
-                steal_amt = int(math.floor(tbal * 0.05))
-                if tbal > 0:
-                    steal_amt = max(1, steal_amt)
-                steal_amt = min(steal_amt, tbal)
-
-                if steal_amt <= 0:
-                    await send_reply(ctx, f"Steal attempt succeeded, but **{target.display_name}** has no money to take.")
-                    return
-
-                conn.execute("UPDATE users SET balance = balance - ? WHERE user_id = ?", (int(steal_amt), int(target.id)))
-                conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (int(steal_amt), int(ctx.author.id)))
-                conn.commit()
-
-                new_thief_bal = int(conn.execute("SELECT balance FROM users WHERE user_id = ?", (int(ctx.author.id),)).fetchone()[0])
-                new_target_bal = int(conn.execute("SELECT balance FROM users WHERE user_id = ?", (int(target.id),)).fetchone()[0])
-            finally:
-                conn.close()
+    if outcome == "success":
+        if amount <= 0:
+            await send_reply(ctx, f"Steal attempt succeeded, but **{target.display_name}** has no money to take.")
+            return
 
         await send_reply(
             ctx,
             f"Steal attempt: **SUCCESS** (chance was {p_success*100:.1f}%).\n"
-            f"You stole **{fmt_money(steal_amt)}** Marcus Money from **{target_ref}**.\n"
-            f"Your balance: **{fmt_money(new_thief_bal)}** | {target_ref}'s balance: **{fmt_money(new_target_bal)}**",
+            f"You stole **{fmt_money(amount)}** Marcus Money from **{target_ref}**.\n"
+            f"Your balance: **{fmt_money(thief_bal)}** | {target_ref}'s balance: **{fmt_money(target_bal)}**",
             allowed_mentions=allowed,
         )
         return
 
-    roll = random.random()
-    if roll < 0.95:
-        set_jailed(ctx.author.id, True)
+    if outcome == "jailed":
         await send_reply(
             ctx,
             "Steal attempt: **FAILED**.\n"
@@ -2576,21 +6530,11 @@ async def steal_cmd(ctx: commands.Context, target: discord.Member, ping: str = "
         )
         return
 
-    loss = int(math.floor(thief_bal * 0.75))
-    if loss <= 0 and thief_bal > 0:
-        loss = 1
-
-    if loss > 0:
-        add_balance(ctx.author.id, -loss)
-
-    row2 = get_user(ctx.author.id)
-    new_bal = int(row2[2]) if row2 else 0
-
     await send_reply(
         ctx,
         "Steal attempt: **FAILED**.\n"
-        f"Catastrophic outcome: you lost **{fmt_money(loss)}** Marcus Money (**75%**).\n"
-        f"New balance: **{fmt_money(new_bal)}**",
+        f"Catastrophic outcome: you lost **{fmt_money(amount)}** Marcus Money (**75%**).\n"
+        f"New balance: **{fmt_money(thief_bal)}**",
         allowed_mentions=discord.AllowedMentions.none(),
     )
 
@@ -2599,26 +6543,13 @@ async def getoutofjail_cmd(ctx: commands.Context):
     if not await require_activated(ctx):
         return
 
-    jailed, _ts = get_jail_status(ctx.author.id)
-    if not jailed:
+    async with locks.hold(("user", ctx.author.id)):
+        res = await db.run(bail_out_of_jail, ctx.author.id)
+
+    if res is None:
         await send_reply(ctx, "You are not in jail.")
         return
-
-    row = get_user(ctx.author.id)
-    bal = int(row[2]) if row else 0
-
-    cost = int(math.floor(bal * 0.12))
-    if cost < 0:
-        cost = 0
-
-    if cost > 0:
-        add_balance(ctx.author.id, -cost)
-
-    set_jailed(ctx.author.id, False)
-    set_parole(ctx.author.id, True)
-
-    row2 = get_user(ctx.author.id)
-    new_bal = int(row2[2]) if row2 else 0
+    cost, new_bal = res
 
     await send_reply(
         ctx,
@@ -2628,6 +6559,22 @@ async def getoutofjail_cmd(ctx: commands.Context):
     )
 
 
+@bot.check
+async def preload_caller(ctx: commands.Context) -> bool:
+    """
+    Runs first for every command: starts its round-trip count and reads the
+    caller's row once for the checks and the handler (see caller_row).
+    """
+    _db_trips.set([0])
+    await caller_row(ctx)
+    return True
+
+@bot.after_invoke
+async def record_command_trips(ctx: commands.Context) -> None:
+    trips = _db_trips.get()
+    if DB_STATS_ENABLED and trips is not None and ctx.command is not None:
+        query_stats.record_command(ctx.command.qualified_name, trips[0])
+
 @bot.check
 async def block_commands_when_jailed(ctx: commands.Context) -> bool:
     if ctx.command is None:
@@ -2636,8 +6583,8 @@ async def block_commands_when_jailed(ctx: commands.Context) -> bool:
     if ctx.command.name in allowed:
         return True
 
-    jailed, _jail_ts = get_jail_status(ctx.author.id)
-    if jailed:
+    row = await caller_row(ctx)
+    if row is not None and row.jailed:
         raise commands.CheckFailure(
             f"You are in **jail**. You cannot use commands right now.\n"
             f"Use `{PREFIX}getoutofjail` to pay **20%** of your money and get released."
@@ -2658,9 +6605,6 @@ async def on_command_error(ctx: commands.Context, error: Exception):
 @bot.command(name="ticket", aliases=["lottery", "pb"])
 @commands.guild_only()
 async def powerball_cmd(ctx: commands.Context):
-    if not await require_activated(ctx):
-        return
-
     main_nums, pb = _quickpick_ticket()
 
     ok, why = _validate_lottery_numbers(main_nums, pb)
@@ -2668,49 +6612,15 @@ async def powerball_cmd(ctx: commands.Context):
         await send_reply(ctx, why)
         return
 
-    row = get_user(ctx.author.id)
-    bal = int(row[2]) if row else 0
-    if LOTTERY_TICKET_COST > bal:
-        await send_reply(ctx, f"Ticket costs **{fmt_money(LOTTERY_TICKET_COST)}** MM. You only have **{fmt_money(bal)}**.")
+    async with locks.hold(("user", ctx.author.id)):
+        res = await db.run(buy_lottery_ticket_for_user, ctx.author.id, display_name(ctx.author), main_nums, pb)
+    if res is None:
+        await reply_not_activated(ctx)
+        return
+    bought, pool, new_bal = res
+    if not bought:
+        await send_reply(ctx, f"Ticket costs **{fmt_money(LOTTERY_TICKET_COST)}** MM. You only have **{fmt_money(new_bal)}**.")
         return
-
-    now = int(time.time())
-
-    with db_lock:
-        conn = db_connect()
-        try:
-            conn.execute(
-                "UPDATE users SET balance = balance - ? WHERE user_id = ?",
-                (int(LOTTERY_TICKET_COST), int(ctx.author.id)),
-            )
-
-            pool = _get_lottery_pool_conn(conn)
-            pool += int(LOTTERY_TICKET_COST)
-            _set_lottery_pool_conn(conn, pool)
-
-            conn.execute(
-                """
-                INSERT INTO lottery_tickets (user_id, n1, n2, n3, n4, n5, pb, bought_ts)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    int(ctx.author.id),
-                    int(main_nums[0]),
-                    int(main_nums[1]),
-                    int(main_nums[2]),
-                    int(main_nums[3]),
-                    int(main_nums[4]),
-                    int(pb),
-                    int(now),
-                ),
-            )
-
-            conn.commit()
-            new_bal = int(
-                conn.execute("SELECT balance FROM users WHERE user_id = ?", (int(ctx.author.id),)).fetchone()[0]
-            )
-        finally:
-            conn.close()
 
     await send_reply(
         ctx,
@@ -2727,15 +6637,7 @@ async def powerball_draw_cmd(ctx: commands.Context):
         await send_reply(ctx, "You are not allowed to use this command.")
         return
 
-    with db_lock:
-        conn = db_connect()
-        try:
-            pool = _get_lottery_pool_conn(conn)
-            tickets = conn.execute(
-                "SELECT id, user_id, n1, n2, n3, n4, n5, pb FROM lottery_tickets ORDER BY id ASC"
-            ).fetchall()
-        finally:
-            conn.close()
+    pool, tickets = await db.read(get_lottery_draw_state)
 
     if not tickets:
         await send_reply(ctx, "No lottery tickets have been purchased yet.")
@@ -2744,169 +6646,63 @@ async def powerball_draw_cmd(ctx: commands.Context):
     win_main = [random.randint(LOTTERY_MAIN_MIN, LOTTERY_MAIN_MAX) for _ in range(5)]
     win_pb = random.randint(LOTTERY_PB_MIN, LOTTERY_PB_MAX)
 
-    def render_draw(revealed: int, locked_main: List[Optional[int]], locked_pb: Optional[int]) -> str:
-        main_disp = []
-        for i in range(5):
-            v = locked_main[i]
-            main_disp.append(str(v) if v is not None else "?")
-        pb_disp = str(locked_pb) if locked_pb is not None else "?"
-        return (
-            "**POWERBALL DRAW**\n"
-            f"Pool: **{fmt_money(pool)}** MM\n\n"
-            f"Main: **{' '.join(main_disp)}**\n"
-            f"Powerball: **{pb_disp}**"
-        )
-
-    locked_main: List[Optional[int]] = [None, None, None, None, None]
-    locked_pb: Optional[int] = None
-
-    msg = await send_reply(ctx, render_draw(0, locked_main, locked_pb))
-
-    for i in range(5):
-        for _ in range(LOTTERY_ANIM_TICKS_PER_BALL):
-            locked_main[i] = random.randint(LOTTERY_MAIN_MIN, LOTTERY_MAIN_MAX)
-            try:
-                await msg.edit(content=render_draw(i, locked_main, locked_pb))
-            except discord.HTTPException:
-                break
-            await asyncio.sleep(LOTTERY_ANIM_DELAY)
-        locked_main[i] = win_main[i]
-        try:
-            await msg.edit(content=render_draw(i + 1, locked_main, locked_pb))
-        except discord.HTTPException:
-            pass
-        await asyncio.sleep(LOTTERY_ANIM_DELAY)
-
-    for _ in range(LOTTERY_ANIM_TICKS_PER_BALL):
-        locked_pb = random.randint(LOTTERY_PB_MIN, LOTTERY_PB_MAX)
-        try:
-            await msg.edit(content=render_draw(5, locked_main, locked_pb))
-        except discord.HTTPException:
-            break
-        await asyncio.sleep(LOTTERY_ANIM_DELAY)
-    locked_pb = win_pb
-    try:
-        await msg.edit(content=render_draw(6, locked_main, locked_pb))
-    except discord.HTTPException:
-        pass
-
-    tier_buckets = {5: [], 4: [], 3: [], 2: []}
-    jackpot_users: List[int] = []
-
-    for _tid, uid, n1, n2, n3, n4, n5, pb in tickets:
-        t_main = [n1, n2, n3, n4, n5]
-        mm = _count_main_matches(t_main, win_main)
-        pb_match = (int(pb) == int(win_pb))
-
-        prize, is_jackpot = _prize_for_match(mm, pb_match)
-        if prize <= 0 and not is_jackpot:
-            continue
-
-        if is_jackpot:
-            jackpot_users.append(int(uid))
-        else:
-            if mm in tier_buckets:
-                tier_buckets[int(mm)].append((int(uid), int(prize)))
-
-    pool_remaining = int(pool)
-    small_paid: Dict[int, int] = {}
-
-    for tier in [5, 4, 3, 2]:
-        if pool_remaining <= 0:
-            break
-        bucket = tier_buckets[tier]
-        if not bucket:
-            continue
-
-        tier_total = sum(p for _uid, p in bucket)
-        if tier_total <= pool_remaining:
-            for uid, p in bucket:
-                small_paid[uid] = small_paid.get(uid, 0) + int(p)
-            pool_remaining -= int(tier_total)
-        else:
-            if tier_total <= 0:
-                break
-            scaled_rows = []
-            for uid, p in bucket:
-                scaled = int(math.floor(pool_remaining * (p / tier_total)))
-                scaled_rows.append([uid, p, scaled])
-
-            base_sum = sum(r[2] for r in scaled_rows)
-            rem = pool_remaining - base_sum
-            scaled_rows.sort(key=lambda r: (r[0],))
-            for i in range(int(rem)):
-                scaled_rows[i % len(scaled_rows)][2] += 1
-
-            for uid, _p, scaled in scaled_rows:
-                if scaled > 0:
-                    small_paid[uid] = small_paid.get(uid, 0) + int(scaled)
-
-            pool_remaining = 0
-            break
-
-        # --- Jackpot payout (TAXED) ---
-    jackpot_paid_gross: Dict[int, int] = {}
-    jackpot_paid_net: Dict[int, int] = {}
-    jackpot_tax_paid: Dict[int, int] = {}
-
-    jackpot_tax_total = 0
-    jackpot_rebate_total = 0
-
-    jackpot_total = int(pool_remaining) if jackpot_users else 0
-
-    if jackpot_users and jackpot_total > 0:
-        uniq = sorted(set(jackpot_users))
-        share = jackpot_total // len(uniq)
-        rem = jackpot_total - (share * len(uniq))
-
-        for i, uid in enumerate(uniq):
-            gross = int(share + (1 if i < rem else 0))
-            if gross <= 0:
-                continue
-
-            tax = int(math.floor(gross * float(JACKPOT_TAX_RATE)))
-            if tax < 0:
-                tax = 0
-            if tax > gross:
-                tax = gross
-
-            rebate = int(math.floor(tax * float(JACKPOT_TAX_REBATE_RATE)))
-            if rebate < 0:
-                rebate = 0
-            if rebate > tax:
-                rebate = tax
-
-            net = gross - tax
-
-            jackpot_paid_gross[int(uid)] = gross
-            jackpot_tax_paid[int(uid)] = tax
-            if net > 0:
-                jackpot_paid_net[int(uid)] = net
-
-            jackpot_tax_total += int(tax)
-            jackpot_rebate_total += int(rebate)
+    def render_draw(revealed: int, locked_main: List[Optional[int]], locked_pb: Optional[int]) -> str:
+        main_disp = []
+        for i in range(5):
+            v = locked_main[i]
+            main_disp.append(str(v) if v is not None else "?")
+        pb_disp = str(locked_pb) if locked_pb is not None else "?"
+        return (
+            "**POWERBALL DRAW**\n"
+            f"Pool: **{fmt_money(pool)}** MM\n\n"
+            f"Main: **{' '.join(main_disp)}**\n"
+            f"Powerball: **{pb_disp}**"
+        )
 
-        # Pool is consumed by jackpot payout, but rebate creates a new pool seed
-        pool_remaining = int(jackpot_rebate_total)
+    locked_main: List[Optional[int]] = [None, None, None, None, None]
+    locked_pb: Optional[int] = None
 
+    msg = await send_reply(ctx, render_draw(0, locked_main, locked_pb))
 
-    with db_lock:
-        conn = db_connect()
+    for i in range(5):
+        for _ in range(LOTTERY_ANIM_TICKS_PER_BALL):
+            locked_main[i] = random.randint(LOTTERY_MAIN_MIN, LOTTERY_MAIN_MAX)
+            try:
+                await edit_message(msg, content=render_draw(i, locked_main, locked_pb))
+            except discord.HTTPException:
+                break
+            await asyncio.sleep(LOTTERY_ANIM_DELAY)
+        locked_main[i] = win_main[i]
         try:
-            _set_lottery_pool_conn(conn, int(pool_remaining))
-
-            for uid, amt in small_paid.items():
-                conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (int(amt), int(uid)))
+            await edit_message(msg, content=render_draw(i + 1, locked_main, locked_pb))
+        except discord.HTTPException:
+            pass
+        await asyncio.sleep(LOTTERY_ANIM_DELAY)
 
-            # Pay NET jackpot after tax
-            for uid, amt in jackpot_paid_net.items():
-                conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (int(amt), int(uid)))
+    for _ in range(LOTTERY_ANIM_TICKS_PER_BALL):
+        locked_pb = random.randint(LOTTERY_PB_MIN, LOTTERY_PB_MAX)
+        try:
+            await edit_message(msg, content=render_draw(5, locked_main, locked_pb))
+        except discord.HTTPException:
+            break
+        await asyncio.sleep(LOTTERY_ANIM_DELAY)
+    locked_pb = win_pb
+    try:
+        await edit_message(msg, content=render_draw(6, locked_main, locked_pb))
+    except discord.HTTPException:
+        pass
 
+    payout = compute_lottery_payouts(pool, tickets, win_main, win_pb)
+    pool_remaining = payout.pool_remaining
+    small_paid = payout.small_paid
+    jackpot_users = payout.jackpot_users
+    jackpot_paid_gross = payout.jackpot_paid_gross
+    jackpot_paid_net = payout.jackpot_paid_net
+    jackpot_tax_paid = payout.jackpot_tax_paid
+    jackpot_tax_total = payout.jackpot_tax_total
+    jackpot_rebate_total = payout.jackpot_rebate_total
 
-            conn.execute("DELETE FROM lottery_tickets")
-            conn.commit()
-        finally:
-            conn.close()
+    await db.run(settle_lottery_draw, pool_remaining, small_paid, jackpot_paid_net)
 
     final_lines = [
         "**POWERBALL RESULTS**",
@@ -2976,22 +6772,7 @@ async def mytickets_cmd(ctx: commands.Context):
     if not await require_activated(ctx):
         return
 
-    with db_lock:
-        conn = db_connect()
-        try:
-            rows = conn.execute(
-                """
-                SELECT id, n1, n2, n3, n4, n5, pb, bought_ts
-                FROM lottery_tickets
-                WHERE user_id = ?
-                ORDER BY id ASC
-                """,
-                (int(ctx.author.id),),
-            ).fetchall()
-
-            pool = _get_lottery_pool_conn(conn)
-        finally:
-            conn.close()
+    rows, pool = await db.read(get_user_lottery_tickets, ctx.author.id)
 
     if not rows:
         await send_reply(ctx, "You have no active Powerball tickets right now.")
@@ -3020,12 +6801,14 @@ async def mytickets_cmd(ctx: commands.Context):
 
 @bot.command(name="activate")
 async def activate_cmd(ctx: commands.Context):
-    existing = get_user(ctx.author.id)
+    existing = await caller_row(ctx)
     if existing is not None:
-        update_username(ctx.author.id, display_name(ctx.author))
+        usernames.note(ctx.author.id, display_name(ctx.author), stored=existing.username)
         await send_reply(ctx, "You are already activated. Your stored name has been refreshed.")
         return
-    insert_user(ctx.author.id, display_name(ctx.author))
+    await db.run(insert_user, ctx.author.id, display_name(ctx.author))
+    for guild in ctx.author.mutual_guilds:
+        member_index.add_member(guild.id, ctx.author.id)
     await send_reply(
         ctx,
         f"Activated. Starting balance: **{fmt_money(START_BALANCE)}** Marcus Money.\n"
@@ -3036,36 +6819,22 @@ async def activate_cmd(ctx: commands.Context):
 async def balance_cmd(ctx: commands.Context):
     if not await require_activated(ctx):
         return
-    added = apply_daily_if_due(ctx.author.id)
-    row = get_user(ctx.author.id)
-    bal = int(row[2])
-    msg = f"Balance: **{fmt_money(bal)}** Marcus Money."
-    if added:
-        msg += f" Daily bonus applied: **+{fmt_money(added)}**."
+    # Read only: a due daily bonus is shown here and credited by the next bet or !daily
+    row = await caller_row(ctx)
+    due = daily_due(row.last_daily)
+    msg = f"Balance: **{fmt_money(row.balance + due)}** Marcus Money."
+    if due:
+        msg += f" Includes your daily bonus of **+{fmt_money(due)}**, credited with your next bet."
     await send_reply(ctx, msg)
 
 @bot.command(name="daily")
 async def daily_cmd(ctx: commands.Context):
     if not await require_activated(ctx):
         return
-    row = get_user(ctx.author.id)
-    user_id, _, balance, last_daily = row
-    now = int(time.time())
-    if now - int(last_daily) >= DAILY_SECONDS:
-        new_balance = int(balance) + DAILY_CREDITS
-        with db_lock:
-            conn = db_connect()
-            try:
-                conn.execute(
-                    "UPDATE users SET balance = ?, last_daily = ? WHERE user_id = ?",
-                    (int(new_balance), now, int(user_id)),
-                )
-                conn.commit()
-            finally:
-                conn.close()
+    claimed, new_balance, remaining = await db.run(claim_daily, ctx.author.id)
+    if claimed:
         await send_reply(ctx, f"Daily claimed: **+{fmt_money(DAILY_CREDITS)}**. New balance: **{fmt_money(new_balance)}** Marcus Money.")
     else:
-        remaining = DAILY_SECONDS - (now - int(last_daily))
         hrs = remaining // 3600
         mins = (remaining % 3600) // 60
         secs = remaining % 60
@@ -3082,47 +6851,90 @@ async def slot_cmd(ctx: commands.Context, bet: str):
     if not await require_activated(ctx):
         return
 
-    added = apply_daily_if_due(ctx.author.id)
-    row = get_user(ctx.author.id)
-    bal = int(row[2])
-    if bet_i > bal:
-        await send_reply(ctx, f"You only have **{fmt_money(bal)}** Marcus Money. Your bet (**{fmt_money(bet_i)}**) is too large.")
+    async with locks.hold(("user", ctx.author.id)):
+        debit = await game_debit(ctx.author.id, bet_i, (await caller_row(ctx)).last_daily)
+        if debit.ok:
+            n = spin()
+            mult = WIN_MULTIPLIERS.get(n)
+            new_bal = debit.balance
+            if mult is not None:
+                # Stake back plus the winnings
+                new_bal = await game_add_balance(ctx.author.id, bet_i + bet_i * mult)
+
+    if debit.status == "not_activated":
+        await reply_not_activated(ctx)
+        return
+    if debit.status == "insufficient":
+        await send_reply(ctx, f"You only have **{fmt_money(debit.balance)}** Marcus Money. Your bet (**{fmt_money(bet_i)}**) is too large.")
         return
 
-    n = spin()
-    mult = WIN_MULTIPLIERS.get(n)
     if mult is not None:
         win_amount = bet_i * mult
-        new_bal = bal + win_amount
-        set_balance(ctx.author.id, new_bal)
         msg = (
             f"🎰 **{format_two_digits(n)}**\n"
             f"WIN! Payout: **+{fmt_money(win_amount)}** (x{mult})\n"
-            f"New balance: **{fmt_money(new_bal)}** Marcus Money."
+            f"New balance: **{fmt_money(int(new_bal or 0))}** Marcus Money."
         )
     else:
-        new_bal = bal - bet_i
-        set_balance(ctx.author.id, new_bal)
         msg = (
             f"🎰 **{format_two_digits(n)}**\n"
             f"Loss: **-{fmt_money(bet_i)}** Marcus Money.\n"
-            f"New balance: **{fmt_money(new_bal)}** Marcus Money."
+            f"New balance: **{fmt_money(int(new_bal or 0))}** Marcus Money."
         )
-    if added:
-        msg += f"\nDaily bonus applied: **+{fmt_money(added)}**."
+    if debit.daily:
+        msg += f"\nDaily bonus applied: **+{fmt_money(debit.daily)}**."
     await send_reply(ctx, msg)
 
 @bot.command(name="leaders")
-async def leaderboard_cmd(ctx: commands.Context):
-    rows = get_top_users(TOP_N)
+async def leaderboard_cmd(ctx: commands.Context, page: int = 1):
+    page = max(1, int(page))
+    offset = (page - 1) * TOP_N
+    rows = await db.read(get_top_users, TOP_N, offset)
     if not rows:
-        await send_reply(ctx, f"No activated players yet. Run `{PREFIX}activate` to join.")
+        if page > 1:
+            await send_reply(ctx, f"There is no page **{page}** of the leaderboard.")
+        else:
+            await send_reply(ctx, f"No activated players yet. Run `{PREFIX}activate` to join.")
         return
     lines = []
-    for i, (username, balance) in enumerate(rows, start=1):
+    for i, (username, balance) in enumerate(rows, start=offset + 1):
         lines.append(f"**{i}.** {username} — **{fmt_money(int(balance))}**  ̷M̷")
     await send_reply(ctx, "\n".join(lines))
 
+@bot.command(name="networth")
+async def networth_cmd(ctx: commands.Context, page: int = 1):
+    page = max(1, int(page))
+    offset = (page - 1) * TOP_N
+    rows = await db.read(get_net_worth_top, TOP_N, offset)
+    if not rows:
+        if page > 1:
+            await send_reply(ctx, f"There is no page **{page}** of the net worth leaderboard.")
+        else:
+            await send_reply(ctx, f"No activated players yet. Run `{PREFIX}activate` to join.")
+        return
+    lines = ["**Net worth** (cash + crypto at market price)"]
+    for i, (username, worth) in enumerate(rows, start=offset + 1):
+        lines.append(f"**{i}.** {username} — **{fmt_money(int(worth))}**  ̷M̷")
+    await send_reply(ctx, "\n".join(lines))
+
+@bot.command(name="rank")
+async def rank_cmd(ctx: commands.Context, member: Optional[discord.Member] = None):
+    target = member or ctx.author
+    res = await db.read(get_user_rank, target.id)
+    if res is None:
+        if target.id == ctx.author.id:
+            await send_reply(ctx, f"You are not activated yet. Run `{PREFIX}activate` first.")
+        else:
+            await send_reply(ctx, f"That user is not activated yet. They must run `{PREFIX}activate` first.")
+        return
+    rank, balance, total = res
+    msg = f"**{display_name(target)}** is ranked **#{rank:,}** of **{total:,}** with **{fmt_money(balance)}**  ̷M̷"
+    worth_res = await db.read(get_net_worth_rank, target.id)
+    if worth_res is not None:
+        worth_rank, worth, _total = worth_res
+        msg += f"\nNet worth: **#{worth_rank:,}** with **{fmt_money(worth)}**  ̷M̷"
+    await send_reply(ctx, msg)
+
 # -----------------------------
 # Tax Commands
 # -----------------------------
@@ -3132,12 +6944,7 @@ async def tax_status_cmd(ctx: commands.Context):
     now_dt = datetime.now(tz)
     date_key = now_dt.strftime("%Y-%m-%d")
     wd = now_dt.weekday()
-    with db_lock:
-        conn = db_connect()
-        try:
-            last_tax_date = _get_state(conn, "last_tax_date", "")
-        finally:
-            conn.close()
+    last_tax_date = await db.read(get_last_tax_date)
 
     eligible = (wd in TAX_WEEKDAYS)
     await send_reply(
@@ -3153,13 +6960,135 @@ async def tax_now_cmd(ctx: commands.Context):
     if not is_owner(ctx):
         await send_reply(ctx, "You are not allowed to use this command.")
         return
-    res = run_tax_if_due()
+    res = await db.run(run_tax_if_due)
     if not res:
         await send_reply(ctx, "Tax not run (either not an eligible day, or it already ran today).")
         return
     date_key, users_taxed, total_tax = res
     await send_reply(ctx, f"Tax run for **{date_key}**: taxed **{users_taxed}** users, collected **{fmt_money(total_tax)}** MM.")
 
+@bot.command(name="dbstats")
+@commands.guild_only()
+async def dbstats_cmd(ctx: commands.Context, action: str = ""):
+    if not is_owner(ctx):
+        await send_reply(ctx, "You are not allowed to use this command.")
+        return
+    if action.lower() == "reset":
+        query_stats.reset()
+        await send_reply(ctx, "DB stats reset.")
+        return
+    if not DB_STATS_ENABLED:
+        await send_reply(ctx, "Query instrumentation is disabled (DB_STATS_ENABLED).")
+        return
+    for chunk in _chunk_lines(query_stats.report_lines()):
+        await send_reply(ctx, chunk)
+
+# -----------------------------
+# Backup commands
+# -----------------------------
+@bot.command(name="backup_now")
+@commands.guild_only()
+async def backup_now_cmd(ctx: commands.Context):
+    if not is_owner(ctx):
+        await send_reply(ctx, "You are not allowed to use this command.")
+        return
+    if balance_cache.loaded:
+        await db.run(balance_cache.flush)
+    try:
+        path, pages, secs = await asyncio.to_thread(backup_db_once, "manual")
+    except Exception as e:
+        await send_reply(ctx, f"Backup failed: {e}")
+        return
+    await send_reply(ctx, f"Backup written: `{os.path.basename(path)}` ({pages} pages in {secs:.1f}s).")
+
+@bot.command(name="backups")
+@commands.guild_only()
+async def backups_cmd(ctx: commands.Context):
+    if not is_owner(ctx):
+        await send_reply(ctx, "You are not allowed to use this command.")
+        return
+    backups = await asyncio.to_thread(list_backups)
+    if not backups:
+        await send_reply(ctx, "No backups yet.")
+        return
+    lines = [f"**Backups** ({_backup_dir()})"]
+    for name, _label, size in backups:
+        lines.append(f"`{name}` — {size / (1024 * 1024):.1f} MB")
+    for chunk in _chunk_lines(lines):
+        await send_reply(ctx, chunk)
+
+@bot.command(name="restore")
+@commands.guild_only()
+async def restore_cmd(ctx: commands.Context, name: str = ""):
+    if not is_owner(ctx):
+        await send_reply(ctx, "You are not allowed to use this command.")
+        return
+    if not name:
+        await send_reply(ctx, f"Usage: `{PREFIX}restore <backup name|latest>` (see `{PREFIX}backups`)")
+        return
+    path = await asyncio.to_thread(resolve_backup, name)
+    if path is None:
+        await send_reply(ctx, f"No backup named `{name}`. See `{PREFIX}backups`.")
+        return
+    try:
+        if balance_cache.loaded:
+            await db.run(balance_cache.flush)
+        safety, _pages, _secs = await asyncio.to_thread(backup_db_once, "pre-restore")
+        users = await db.run(restore_backup, path)
+    except Exception as e:
+        await send_reply(ctx, f"Restore failed: {e}")
+        return
+    # Open hands here were dealt against balances from the discarded timeline
+    partition = _db_partition.get()
+    for key in [k for k in BLACKJACK_GAMES if k[0] == partition]:
+        BLACKJACK_GAMES.pop(key, None)
+    print(f"[BACKUP] restored {os.path.basename(path)} ({users} users), previous state saved as {os.path.basename(safety)}")
+    await send_reply(
+        ctx,
+        f"Restored `{os.path.basename(path)}` ({users} users).\n"
+        f"The previous state was saved as `{os.path.basename(safety)}`."
+    )
+
+# -----------------------------
+# Ledger commands
+# -----------------------------
+@bot.command(name="ledger_check")
+@commands.guild_only()
+async def ledger_check_cmd(ctx: commands.Context, mode: str = ""):
+    if not is_owner(ctx):
+        await send_reply(ctx, "You are not allowed to use this command.")
+        return
+    check = await db.run(verify_ledger, mode.lower() == "full")
+    if check.entries:
+        lines = [f"Checked ledger entries **{check.from_id + 1:,}–{check.to_id:,}** (**{check.entries:,}** new) against **{check.users:,}** users."]
+    else:
+        lines = [f"No new ledger entries since the last check; compared **{check.users:,}** users."]
+    if not check.mismatches:
+        lines.append("All balances match the ledger.")
+    else:
+        lines.append(f"**{len(check.mismatches)}** balances don't match the ledger:")
+        for uid, bal, ledger_bal in check.mismatches[:20]:
+            lines.append(f"<@{uid}>: balance **{fmt_money(bal)}**, ledger **{fmt_money(ledger_bal)}** ({bal - ledger_bal:+,})")
+    for chunk in _chunk_lines(lines):
+        await send_reply(ctx, chunk, allowed_mentions=discord.AllowedMentions.none())
+
+@bot.command(name="ledger")
+@commands.guild_only()
+async def ledger_cmd(ctx: commands.Context, member: discord.Member, limit: int = 10):
+    if not is_owner(ctx):
+        await send_reply(ctx, "You are not allowed to use this command.")
+        return
+    rows = await db.read(get_ledger_entries, member.id, max(1, min(int(limit), 50)))
+    if not rows:
+        await send_reply(ctx, f"No ledger entries for **{member.display_name}**.")
+        return
+    lines = [f"**Ledger — {member.display_name}** (newest first)"]
+    for _id, delta, reason, ref_id, ts in rows:
+        ref = f" ({ref_id})" if ref_id else ""
+        lines.append(f"`{format_ts(ts)}` **{delta:+,}** {reason}{ref}")
+    for chunk in _chunk_lines(lines):
+        await send_reply(ctx, chunk)
+
 # -----------------------------
 # Gift commands
 # -----------------------------
@@ -3172,49 +7101,29 @@ async def gift_cmd(ctx: commands.Context, member: discord.Member, amount: str):
         await send_reply(ctx, f"Usage: `{PREFIX}gift @User 500` (supports 2K/3M/1B/...)")
         return
 
-    if not await require_activated(ctx):
-        return
     if member.bot:
         await send_reply(ctx, "You can't gift money to bots.")
         return
     if member.id == ctx.author.id:
         await send_reply(ctx, "You can't gift money to yourself.")
         return
-    if get_user(member.id) is None:
-        await send_reply(ctx, f"That user is not activated yet. They must run `{PREFIX}activate` first.")
-        return
-
-    update_username(ctx.author.id, display_name(ctx.author))
-    update_username(member.id, member.display_name)
 
     sender_id = int(ctx.author.id)
     recipient_id = int(member.id)
 
-    with db_lock:
-        conn = db_connect()
-        try:
-            srow = conn.execute("SELECT balance FROM users WHERE user_id = ?", (sender_id,)).fetchone()
-            rrow = conn.execute("SELECT balance FROM users WHERE user_id = ?", (recipient_id,)).fetchone()
-            if not srow:
-                await send_reply(ctx, f"You are not activated yet. Run `{PREFIX}activate` first.")
-                return
-            if not rrow:
-                await send_reply(ctx, f"That user is not activated yet. They must run `{PREFIX}activate` first.")
-                return
-
-            sender_bal = int(srow[0])
-            if amount_i > sender_bal:
-                await send_reply(ctx, f"You only have **{fmt_money(sender_bal)}** Marcus Money. You can’t gift **{fmt_money(amount_i)}**.")
-                return
-
-            conn.execute("UPDATE users SET balance = balance - ? WHERE user_id = ?", (int(amount_i), sender_id))
-            conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (int(amount_i), recipient_id))
-            conn.commit()
-
-            sender_new_bal = int(conn.execute("SELECT balance FROM users WHERE user_id = ?", (sender_id,)).fetchone()[0])
-            recip_new_bal = int(conn.execute("SELECT balance FROM users WHERE user_id = ?", (recipient_id,)).fetchone()[0])
-        finally:
-            conn.close()
+    async with locks.hold(("user", sender_id), ("user", recipient_id)):
+        status, sender_new_bal, recip_new_bal = await db.run(
+            gift_balance, sender_id, recipient_id, amount_i, display_name(ctx.author), member.display_name
+        )
+    if status == "no_sender":
+        await reply_not_activated(ctx)
+        return
+    if status == "no_recipient":
+        await send_reply(ctx, f"That user is not activated yet. They must run `{PREFIX}activate` first.")
+        return
+    if status == "insufficient":
+        await send_reply(ctx, f"You only have **{fmt_money(sender_new_bal)}** Marcus Money. You can’t gift **{fmt_money(amount_i)}**.")
+        return
 
     await send_reply(
         ctx,
@@ -3256,41 +7165,30 @@ async def giftall_cmd(ctx: commands.Context, amount: str, members: commands.Gree
         await send_reply(ctx, "No valid recipients. (You can’t gift bots or yourself.)")
         return
 
-    not_activated = [m.display_name for m in recipients if get_user(m.id) is None]
+    stored = await db.read(get_usernames, list(seen))
+    not_activated = []
+    for m in recipients:
+        if m.id not in stored:
+            not_activated.append(m.display_name)
+        else:
+            usernames.note(m.id, m.display_name, stored=stored[m.id])
     if not_activated:
         await send_reply(ctx, f"These users are not activated yet (they must run `{PREFIX}activate`): " + ", ".join(not_activated))
         return
 
     total_cost = int(amount_i) * len(recipients)
 
-    update_username(ctx.author.id, display_name(ctx.author))
-    for m in recipients:
-        update_username(m.id, m.display_name)
-
     sender_id = int(ctx.author.id)
     recipient_ids = [int(m.id) for m in recipients]
 
-    with db_lock:
-        conn = db_connect()
-        try:
-            srow = conn.execute("SELECT balance FROM users WHERE user_id = ?", (sender_id,)).fetchone()
-            if not srow:
-                await send_reply(ctx, f"You are not activated yet. Run `{PREFIX}activate` first.")
-                return
-
-            sender_bal = int(srow[0])
-            if total_cost > sender_bal:
-                await send_reply(ctx, f"You only have **{fmt_money(sender_bal)}** Marcus Money. `giftall` would cost **{fmt_money(total_cost)}**.")
-                return
-
-            conn.execute("UPDATE users SET balance = balance - ? WHERE user_id = ?", (int(total_cost), sender_id))
-            for rid in recipient_ids:
-                conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (int(amount_i), rid))
-            conn.commit()
-
-            sender_new_bal = int(conn.execute("SELECT balance FROM users WHERE user_id = ?", (sender_id,)).fetchone()[0])
-        finally:
-            conn.close()
+    async with locks.hold(("user", sender_id)):
+        status, sender_new_bal = await db.run(gift_balance_many, sender_id, recipient_ids, amount_i)
+    if status == "no_sender":
+        await send_reply(ctx, f"You are not activated yet. Run `{PREFIX}activate` first.")
+        return
+    if status == "insufficient":
+        await send_reply(ctx, f"You only have **{fmt_money(sender_new_bal)}** Marcus Money. `giftall` would cost **{fmt_money(total_cost)}**.")
+        return
 
     names = ", ".join(m.display_name for m in recipients)
     await send_reply(
@@ -3319,57 +7217,28 @@ async def gifteveryone_cmd(ctx: commands.Context, amount: str, ping: str = "nopi
         return
 
     guild = ctx.guild
-    try:
-        members = [m async for m in guild.fetch_members(limit=None)]
-    except Exception:
-        members = list(getattr(guild, "members", []))
-
-    if not members:
+    if not bot.intents.members:
         await send_reply(ctx, "I couldn't read the server member list. Enable Server Members Intent in Developer Portal and keep intents.members=True.")
         return
 
-    activated_ids = get_all_activated_user_ids()
-    recipients: List[discord.Member] = []
-    for m in members:
-        if m.bot or m.id == ctx.author.id:
-            continue
-        if int(m.id) in activated_ids:
-            recipients.append(m)
-
-    if not recipients:
+    sender_id = int(ctx.author.id)
+    activated_ids = await guild_activated_ids(guild)
+    activated_ids.discard(sender_id)
+    if not activated_ids:
         await send_reply(ctx, "No activated users found in this server (besides you).")
         return
 
-    sender_id = int(ctx.author.id)
-    recipient_ids = [int(m.id) for m in recipients]
+    recipient_ids = sorted(activated_ids)
     total_cost = int(amount_i) * len(recipient_ids)
 
-    update_pairs = [(display_name(ctx.author), sender_id)] + [(m.display_name, int(m.id)) for m in recipients]
-
-    with db_lock:
-        conn = db_connect()
-        try:
-            srow = conn.execute("SELECT balance FROM users WHERE user_id = ?", (sender_id,)).fetchone()
-            if not srow:
-                await send_reply(ctx, f"You are not activated yet. Run `{PREFIX}activate` first.")
-                return
-
-            sender_bal = int(srow[0])
-            if total_cost > sender_bal:
-                await send_reply(ctx, f"You only have **{fmt_money(sender_bal)}** Marcus Money. `gifteveryone` would cost **{fmt_money(total_cost)}**.")
-                return
-
-            conn.execute("UPDATE users SET balance = balance - ? WHERE user_id = ?", (int(total_cost), sender_id))
-            conn.executemany(
-                "UPDATE users SET balance = balance + ? WHERE user_id = ?",
-                [(int(amount_i), rid) for rid in recipient_ids],
-            )
-            conn.executemany("UPDATE users SET username = ? WHERE user_id = ?", update_pairs)
-            conn.commit()
-
-            sender_new_bal = int(conn.execute("SELECT balance FROM users WHERE user_id = ?", (sender_id,)).fetchone()[0])
-        finally:
-            conn.close()
+    async with locks.hold(("user", sender_id)):
+        status, sender_new_bal = await db.run(gift_balance_many, sender_id, recipient_ids, amount_i)
+    if status == "no_sender":
+        await send_reply(ctx, f"You are not activated yet. Run `{PREFIX}activate` first.")
+        return
+    if status == "insufficient":
+        await send_reply(ctx, f"You only have **{fmt_money(sender_new_bal)}** Marcus Money. `gifteveryone` would cost **{fmt_money(total_cost)}**.")
+        return
 
     await send_reply(
         ctx,
@@ -3397,70 +7266,85 @@ async def blackjack_cmd(ctx: commands.Context, bet: str):
     if not await require_activated(ctx):
         return
 
-    if ctx.author.id in BLACKJACK_GAMES:
+    async with locks.hold(("user", ctx.author.id)):
+        if bj_key(ctx.author.id) in BLACKJACK_GAMES:
+            outcome = "busy"
+        else:
+            debit = await game_debit(ctx.author.id, bet_i, (await caller_row(ctx)).last_daily)
+            if debit.status == "not_activated":
+                outcome = "not_activated"
+            elif debit.status == "insufficient":
+                outcome = "broke"
+            else:
+                bal_after_bet = debit.balance
+
+                player = [bj_draw_card(), bj_draw_card()]
+                dealer = [bj_draw_card(), bj_draw_card()]
+                game = {"bet": bet_i, "player": player, "dealer": dealer, "ts": int(time.time())}
+                BLACKJACK_GAMES[bj_key(ctx.author.id)] = game
+                outcome = "dealt"
+
+                if bj_is_blackjack(player):
+                    if bj_is_blackjack(dealer):
+                        outcome = "push"
+                        new_bal = await game_add_balance(ctx.author.id, bet_i)
+                    else:
+                        outcome = "blackjack"
+                        profit = int(bet_i * 6)
+                        new_bal = await game_add_balance(ctx.author.id, bet_i + profit)
+                    del BLACKJACK_GAMES[bj_key(ctx.author.id)]
+
+    if outcome == "busy":
         await send_reply(ctx, f"You already have an active blackjack hand. Use `{PREFIX}hit`, or `{PREFIX}stand`")
         return
-
-    row = get_user(ctx.author.id)
-    bal = int(row[2])
-    if bet_i > bal:
-        await send_reply(ctx, f"You only have **{fmt_money(bal)}** Marcus Money. Your bet (**{fmt_money(bet_i)}**) is too large.")
+    if outcome == "not_activated":
+        await reply_not_activated(ctx)
+        return
+    if outcome == "broke":
+        await send_reply(ctx, f"You only have **{fmt_money(debit.balance)}** Marcus Money. Your bet (**{fmt_money(bet_i)}**) is too large.")
         return
-
-    add_balance(ctx.author.id, -bet_i)
-
-    player = [bj_draw_card(), bj_draw_card()]
-    dealer = [bj_draw_card(), bj_draw_card()]
-    game = {"bet": bet_i, "player": player, "dealer": dealer, "ts": int(time.time())}
-    BLACKJACK_GAMES[ctx.author.id] = game
 
     pval = bj_hand_value(player)
     d_up = dealer[0]
 
-    if bj_is_blackjack(player):
+    if outcome == "push":
         dval = bj_hand_value(dealer)
-        if bj_is_blackjack(dealer):
-            add_balance(ctx.author.id, bet_i)
-            del BLACKJACK_GAMES[ctx.author.id]
-            row2 = get_user(ctx.author.id)
-            await send_reply(ctx, f"**Blackjack**\nYour hand: {bj_fmt(player)} (**21**)\nDealer hand: {bj_fmt(dealer)} (**{dval}**)\nResult: **PUSH**. Bet refunded.\nBalance: **{fmt_money(int(row2[2]))}**")
-            return
-        else:
-            profit = int(bet_i * 6)
-            add_balance(ctx.author.id, bet_i + profit)
-            del BLACKJACK_GAMES[ctx.author.id]
-            row2 = get_user(ctx.author.id)
-            await send_reply(ctx, f"**Blackjack**\nYour hand: {bj_fmt(player)} (**21**)\nDealer shows: {d_up} [?]\nResult: **BLACKJACK WIN**. Profit: **+{fmt_money(profit)}**\nBalance: **{fmt_money(int(row2[2]))}**")
-            return
+        await send_reply(ctx, f"**Blackjack**\nYour hand: {bj_fmt(player)} (**21**)\nDealer hand: {bj_fmt(dealer)} (**{dval}**)\nResult: **PUSH**. Bet refunded.\nBalance: **{fmt_money(int(new_bal or 0))}**")
+        return
+    if outcome == "blackjack":
+        await send_reply(ctx, f"**Blackjack**\nYour hand: {bj_fmt(player)} (**21**)\nDealer shows: {d_up} [?]\nResult: **BLACKJACK WIN**. Profit: **+{fmt_money(profit)}**\nBalance: **{fmt_money(int(new_bal or 0))}**")
+        return
 
-    row2 = get_user(ctx.author.id)
     await send_reply(
         ctx,
         f"**Blackjack** (Bet: **{fmt_money(bet_i)}**)\n"
         f"Your hand: {bj_fmt(player)} (**{pval}**)\n"
         f"Dealer shows: {d_up} [?]\n"
         f"Use `{PREFIX}hit` or `{PREFIX}stand`.\n"
-        f"Balance: **{fmt_money(int(row2[2]))}**"
+        f"Balance: **{fmt_money(int(bal_after_bet or 0))}**"
     )
 
 @bot.command(name="hit")
 async def hit_cmd(ctx: commands.Context):
     if not await require_activated(ctx):
         return
-    game = BLACKJACK_GAMES.get(ctx.author.id)
+    async with locks.hold(("user", ctx.author.id)):
+        game = BLACKJACK_GAMES.get(bj_key(ctx.author.id))
+        if game:
+            game["player"].append(bj_draw_card())
+            pval = bj_hand_value(game["player"])
+            if pval > 21:
+                del BLACKJACK_GAMES[bj_key(ctx.author.id)]
     if not game:
         await send_reply(ctx, f"You have no active blackjack hand. Start one with `{PREFIX}blackjack <bet>`.")
         return
 
-    game["player"].append(bj_draw_card())
-    pval = bj_hand_value(game["player"])
     d_up = game["dealer"][0]
 
     if pval > 21:
         bet_i = int(game["bet"])
-        del BLACKJACK_GAMES[ctx.author.id]
-        row2 = get_user(ctx.author.id)
-        await send_reply(ctx, f"**Blackjack**\nYour hand: {bj_fmt(game['player'])} (**{pval}**)\nDealer shows: {d_up} [?]\nResult: **BUST**. You lose **{fmt_money(bet_i)}**.\nBalance: **{fmt_money(int(row2[2]))}**")
+        bal = await game_balance(ctx.author.id)
+        await send_reply(ctx, f"**Blackjack**\nYour hand: {bj_fmt(game['player'])} (**{pval}**)\nDealer shows: {d_up} [?]\nResult: **BUST**. You lose **{fmt_money(bet_i)}**.\nBalance: **{fmt_money(int(bal or 0))}**")
         return
 
     await send_reply(ctx, f"**Blackjack**\nYour hand: {bj_fmt(game['player'])} (**{pval}**)\nDealer shows: {d_up} [?]\nUse `{PREFIX}hit` or `{PREFIX}stand`.")
@@ -3469,36 +7353,39 @@ async def hit_cmd(ctx: commands.Context):
 async def stand_cmd(ctx: commands.Context):
     if not await require_activated(ctx):
         return
-    game = BLACKJACK_GAMES.get(ctx.author.id)
-    if not game:
-        await send_reply(ctx, f"You have no active blackjack hand. Start one with `{PREFIX}blackjack <bet>`.")
-        return
-
-    player = game["player"]
-    dealer = game["dealer"]
-    bet_i = int(game["bet"])
-    pval = bj_hand_value(player)
+    async with locks.hold(("user", ctx.author.id)):
+        game = BLACKJACK_GAMES.get(bj_key(ctx.author.id))
+        if game:
+            player = game["player"]
+            dealer = game["dealer"]
+            bet_i = int(game["bet"])
+            pval = bj_hand_value(player)
+
+            while bj_hand_value(dealer) < 17:
+                dealer.append(bj_draw_card())
+            dval = bj_hand_value(dealer)
+
+            payout = 0
+            if dval > 21 or pval > dval:
+                payout = int(round(bet_i * 2.6))
+                result = "YOU WIN"
+            elif pval < dval:
+                payout = 0
+                result = "YOU LOSE"
+            else:
+                payout = bet_i
+                result = "PUSH"
 
-    while bj_hand_value(dealer) < 17:
-        dealer.append(bj_draw_card())
-    dval = bj_hand_value(dealer)
-
-    payout = 0
-    if dval > 21 or pval > dval:
-        payout = int(round(bet_i * 2.6))
-        result = "YOU WIN"
-    elif pval < dval:
-        payout = 0
-        result = "YOU LOSE"
-    else:
-        payout = bet_i
-        result = "PUSH"
+            if payout:
+                new_bal = await game_add_balance(ctx.author.id, payout)
+            else:
+                new_bal = await game_balance(ctx.author.id)
 
-    if payout:
-        add_balance(ctx.author.id, payout)
+            del BLACKJACK_GAMES[bj_key(ctx.author.id)]
 
-    del BLACKJACK_GAMES[ctx.author.id]
-    row2 = get_user(ctx.author.id)
+    if not game:
+        await send_reply(ctx, f"You have no active blackjack hand. Start one with `{PREFIX}blackjack <bet>`.")
+        return
 
     if payout and payout != bet_i:
         profit = payout - bet_i
@@ -3511,7 +7398,7 @@ async def stand_cmd(ctx: commands.Context):
     await send_reply(
         ctx,
         f"**Blackjack**\nYour hand: {bj_fmt(player)} (**{pval}**)\nDealer hand: {bj_fmt(dealer)} (**{dval}**)\n"
-        f"Result: **{result}**\n{payout_line}\nBalance: **{fmt_money(int(row2[2]))}**"
+        f"Result: **{result}**\n{payout_line}\nBalance: **{fmt_money(int(new_bal or 0))}**"
     )
 
 # -----------------------------
@@ -3533,27 +7420,30 @@ async def roulette_cmd(ctx: commands.Context, bet: str, *, choice: str):
         await send_reply(ctx, f"Invalid roulette choice. Examples: `{PREFIX}roulette 50 red`, `{PREFIX}roulette 50 17`, `{PREFIX}roulette 50 even`, `{PREFIX}roulette 50 dozen2`, `{PREFIX}roulette 50 col3`")
         return
 
-    row = get_user(ctx.author.id)
-    bal = int(row[2])
-    if bet_i > bal:
-        await send_reply(ctx, f"You only have **{fmt_money(bal)}** Marcus Money. Your bet (**{fmt_money(bet_i)}**) is too large.")
+    async with locks.hold(("user", ctx.author.id)):
+        debit = await game_debit(ctx.author.id, bet_i, (await caller_row(ctx)).last_daily)
+        if debit.ok:
+            new_bal = debit.balance
+
+            spin_n = random.randint(0, 36)
+            color = roulette_color(spin_n)
+            won = roulette_is_win(spin_n, rule)
+            payout_mult = int(rule["payout"])
+            if won:
+                profit = bet_i * payout_mult
+                new_bal = await game_add_balance(ctx.author.id, bet_i + profit)
+
+    if debit.status == "not_activated":
+        await reply_not_activated(ctx)
+        return
+    if debit.status == "insufficient":
+        await send_reply(ctx, f"You only have **{fmt_money(debit.balance)}** Marcus Money. Your bet (**{fmt_money(bet_i)}**) is too large.")
         return
-
-    add_balance(ctx.author.id, -bet_i)
-
-    spin_n = random.randint(0, 36)
-    color = roulette_color(spin_n)
-    won = roulette_is_win(spin_n, rule)
-    payout_mult = int(rule["payout"])
 
     if won:
-        profit = bet_i * payout_mult
-        add_balance(ctx.author.id, bet_i + profit)
-        row2 = get_user(ctx.author.id)
-        await send_reply(ctx, f"**Roulette** (Bet: **{fmt_money(bet_i)}** on **{label}**)\nSpin: **{spin_n}** ({color})\nResult: **WIN** — Profit: **+{fmt_money(profit)}**\nBalance: **{fmt_money(int(row2[2]))}**")
+        await send_reply(ctx, f"**Roulette** (Bet: **{fmt_money(bet_i)}** on **{label}**)\nSpin: **{spin_n}** ({color})\nResult: **WIN** — Profit: **+{fmt_money(profit)}**\nBalance: **{fmt_money(int(new_bal or 0))}**")
     else:
-        row2 = get_user(ctx.author.id)
-        await send_reply(ctx, f"**Roulette** (Bet: **{fmt_money(bet_i)}** on **{label}**)\nSpin: **{spin_n}** ({color})\nResult: **LOSS** — Lost: **-{fmt_money(bet_i)}**\nBalance: **{fmt_money(int(row2[2]))}**")
+        await send_reply(ctx, f"**Roulette** (Bet: **{fmt_money(bet_i)}** on **{label}**)\nSpin: **{spin_n}** ({color})\nResult: **LOSS** — Lost: **-{fmt_money(bet_i)}**\nBalance: **{fmt_money(int(new_bal or 0))}**")
 
 # -----------------------------
 # Plinko Commands
@@ -3577,18 +7467,23 @@ async def plinko_cmd(ctx: commands.Context, bet_per_ball: str, balls: int):
 
     total_cost = int(bet_per_ball_i) * int(balls)
 
-    row = get_user(ctx.author.id)
-    bal = int(row[2])
-    if total_cost > bal:
+    # The user lock keeps this debit from interleaving with a SQL-side debit of
+    # the same user (!buy, !bet, !gift, steal); the payout is a plain credit
+    async with locks.hold(("user", ctx.author.id)):
+        debit = await game_debit(ctx.author.id, total_cost, (await caller_row(ctx)).last_daily)
+    new_bal = debit.balance
+
+    if debit.status == "not_activated":
+        await reply_not_activated(ctx)
+        return
+    if debit.status == "insufficient":
         await send_reply(
             ctx,
-            f"You only have **{fmt_money(bal)}** Marcus Money.\n"
+            f"You only have **{fmt_money(debit.balance)}** Marcus Money.\n"
             f"Total cost is **{fmt_money(total_cost)}** ({fmt_money(bet_per_ball_i)} x {balls})."
         )
         return
 
-    add_balance(ctx.author.id, -total_cost)
-
     SLOTS = 13
     ROWS = 6
     multipliers = [10, 5, 2.1, 1.5, 0.8, 0.6, 0.4, 0.6, 0.8, 1.5, 2.1, 5, 10]
@@ -3615,7 +7510,7 @@ async def plinko_cmd(ctx: commands.Context, bet_per_ball: str, balls: int):
     for step in range(1, ROWS + 1):
         await asyncio.sleep(delay)
         try:
-            await msg.edit(content=plinko_render_multi(paths, step, multipliers, bet_per_ball_i, balls))
+            await edit_message(msg, content=plinko_render_multi(paths, step, multipliers, bet_per_ball_i, balls))
         except discord.HTTPException:
             break
 
@@ -3629,7 +7524,7 @@ async def plinko_cmd(ctx: commands.Context, bet_per_ball: str, balls: int):
             total_return += ball_return
 
     if total_return > 0:
-        add_balance(ctx.author.id, total_return)
+        new_bal = await game_add_balance(ctx.author.id, total_return)
 
     profit = total_return - total_cost
     parts = []
@@ -3638,8 +7533,7 @@ async def plinko_cmd(ctx: commands.Context, bet_per_ball: str, balls: int):
         m = float(multipliers[slot_idx])
         parts.append(f"Slot {slot_idx + 1} (x{m:g}): {count}")
 
-    row2 = get_user(ctx.author.id)
-    new_bal = int(row2[2]) if row2 else 0
+    new_bal = int(new_bal or 0)
 
     await send_reply(
         ctx,
@@ -3667,7 +7561,8 @@ async def bet_create_cmd(ctx: commands.Context, *, spec: str):
     title = parts[0]
     options = parts[1:]
 
-    bet_id = create_bet(
+    bet_id = await db.run(
+        create_bet,
         guild_id=ctx.guild.id if ctx.guild else None,
         channel_id=ctx.channel.id if ctx.guild else None,
         creator_id=ctx.author.id,
@@ -3686,7 +7581,7 @@ async def bet_create_cmd(ctx: commands.Context, *, spec: str):
 @bot.command(name="bet_list")
 @commands.guild_only()
 async def bet_list_cmd(ctx: commands.Context):
-    bets = list_open_bets(limit=10)
+    bets = await db.read(list_open_bets, limit=10)
     if not bets:
         await send_reply(ctx, "No open bets right now.")
         return
@@ -3699,14 +7594,14 @@ async def bet_list_cmd(ctx: commands.Context):
 @bot.command(name="bet_info")
 @commands.guild_only()
 async def bet_info_cmd(ctx: commands.Context, bet_id: int):
-    bet = get_bet(bet_id)
+    bet = await db.read(get_bet, bet_id)
     if bet is None:
         await send_reply(ctx, "That bet_id does not exist.")
         return
 
     _id, title, status, _creator_id, _created_ts, _closed_ts, _resolved_ts, winning_option, bonus_pool, note = bet
-    options = get_bet_options(bet_id)
-    total_pool, totals = get_bet_totals(bet_id)
+    options = await db.read(get_bet_options, bet_id)
+    total_pool, totals = await db.read(get_bet_totals, bet_id)
     effective_total = int(total_pool) + int(bonus_pool)
 
     header = [
@@ -3744,15 +7639,15 @@ async def bet_my_cmd(ctx: commands.Context, bet_id: int):
     if not await require_activated(ctx):
         return
 
-    bet = get_bet(bet_id)
+    bet = await db.read(get_bet, bet_id)
     if bet is None:
         await send_reply(ctx, "That bet_id does not exist.")
         return
 
     _id, title, status, _creator_id, _created_ts, _closed_ts, _resolved_ts, _winning_option, bonus_pool, _note = bet
-    options = dict(get_bet_options(bet_id))
+    options = dict(await db.read(get_bet_options, bet_id))
 
-    uw = get_user_wager_for_bet(bet_id, ctx.author.id)
+    uw = await db.read(get_user_wager_for_bet, bet_id, ctx.author.id)
     if uw is None:
         await send_reply(ctx, f"You have no wager on bet **#{bet_id}** yet. Use `{PREFIX}bet {bet_id} <option#> <amount>`.")
         return
@@ -3760,7 +7655,7 @@ async def bet_my_cmd(ctx: commands.Context, bet_id: int):
     opt_num, amt = uw
     label = options.get(opt_num, "Unknown option")
 
-    total_pool, totals = get_bet_totals(bet_id)
+    total_pool, totals = await db.read(get_bet_totals, bet_id)
     opt_pool = int(totals.get(opt_num, 0))
     effective_total = int(total_pool) + int(bonus_pool)
     odds = american_odds_str(effective_total, opt_pool)
@@ -3777,29 +7672,26 @@ async def bet_my_cmd(ctx: commands.Context, bet_id: int):
 @bot.command(name="bet")
 @commands.guild_only()
 async def bet_cmd(ctx: commands.Context, bet_id: int, option_num: int, amount: str):
-    if not await require_activated(ctx):
-        return
     try:
         amount_i = parse_amount_int(amount, min_value=1)
     except ValueError:
-        await send_reply(ctx, f"Usage: `{PREFIX}bet {bet_id} <option#> <amount>` (supports 2K/3M/1B/...)")
+        if await require_activated(ctx):
+            await send_reply(ctx, f"Usage: `{PREFIX}bet {bet_id} <option#> <amount>` (supports 2K/3M/1B/...)")
         return
 
-    ok, msg = place_wager(bet_id, ctx.author.id, option_num, amount_i)
+    async with locks.hold(("user", ctx.author.id), ("bet", int(bet_id))):
+        res = await db.run(place_wager_for_user, ctx.author.id, display_name(ctx.author), bet_id, option_num, amount_i)
+    if res is None:
+        await reply_not_activated(ctx)
+        return
+    ok, msg, bonus_pool, total_pool, opt_pool, bal = res
     if not ok:
         await send_reply(ctx, msg)
         return
 
-    bet = get_bet(bet_id)
-    bonus_pool = int(bet[8]) if bet else 0
-    total_pool, totals = get_bet_totals(bet_id)
-    opt_pool = int(totals.get(option_num, 0))
     effective_total = int(total_pool) + int(bonus_pool)
     odds = american_odds_str(effective_total, opt_pool)
 
-    row = get_user(ctx.author.id)
-    bal = int(row[2]) if row else 0
-
     await send_reply(
         ctx,
         f"{msg}\n"
@@ -3819,14 +7711,15 @@ async def bet_bonus_cmd(ctx: commands.Context, bet_id: int, amount: str):
         await send_reply(ctx, f"Usage: `{PREFIX}bet_bonus {bet_id} <amount>` (supports 2K/3M/1B/...)")
         return
 
-    ok, msg = add_bet_bonus_pool(bet_id, amount_i)
+    async with locks.hold(("bet", int(bet_id))):
+        ok, msg = await db.run(add_bet_bonus_pool, bet_id, amount_i)
     if not ok:
         await send_reply(ctx, msg)
         return
 
-    bet = get_bet(bet_id)
+    bet = await db.read(get_bet, bet_id)
     bonus_pool = int(bet[8]) if bet else 0
-    total_pool, _totals = get_bet_totals(bet_id)
+    total_pool, _totals = await db.read(get_bet_totals, bet_id)
     effective_total = int(total_pool) + int(bonus_pool)
 
     await send_reply(ctx, f"{msg}\nCurrent bonus pool: **{fmt_money(bonus_pool)}** | Effective pool: **{fmt_money(effective_total)}**")
@@ -3837,7 +7730,8 @@ async def bet_close_cmd(ctx: commands.Context, bet_id: int):
     if not is_owner(ctx):
         await send_reply(ctx, "You are not allowed to use this command.")
         return
-    _ok, msg = close_bet(bet_id)
+    async with locks.hold(("bet", int(bet_id))):
+        _ok, msg = await db.run(close_bet, bet_id)
     await send_reply(ctx, msg)
 
 @bot.command(name="bet_cancel")
@@ -3846,7 +7740,8 @@ async def bet_cancel_cmd(ctx: commands.Context, bet_id: int):
     if not is_owner(ctx):
         await send_reply(ctx, "You are not allowed to use this command.")
         return
-    _ok, msg = cancel_bet_and_refund(bet_id)
+    async with locks.hold(("bet", int(bet_id))):
+        _ok, msg = await db.run(cancel_bet_and_refund, bet_id)
     await send_reply(ctx, msg)
 
 @bot.command(name="bet_resolve")
@@ -3855,7 +7750,8 @@ async def bet_resolve_cmd(ctx: commands.Context, bet_id: int, winning_option: in
     if not is_owner(ctx):
         await send_reply(ctx, "You are not allowed to use this command.")
         return
-    _ok, msg = resolve_bet_and_payout(bet_id, winning_option)
+    async with locks.hold(("bet", int(bet_id))):
+        _ok, msg = await db.run(resolve_bet_and_payout, bet_id, winning_option)
     await send_reply(ctx, msg)
 
 # -----------------------------
@@ -3873,14 +7769,14 @@ async def give_cmd(ctx: commands.Context, member: discord.Member, amount: str):
         await send_reply(ctx, f"Usage: `{PREFIX}give @User 500` (supports 2K/3M/1B/...)")
         return
 
-    target = get_user(member.id)
+    target = await db.read(get_user, member.id)
     if target is None:
         await send_reply(ctx, f"That user is not activated yet. They must run `{PREFIX}activate` first.")
         return
 
-    update_username(member.id, member.display_name)
-    add_balance(member.id, amount_i)
-    updated = get_user(member.id)
+    usernames.note(member.id, member.display_name, stored=target[1])
+    await db.run(add_balance, member.id, amount_i)
+    updated = await db.read(get_user, member.id)
     new_bal = int(updated[2])
     await send_reply(ctx, f"Gave **+{fmt_money(amount_i)}** Marcus Money to **{member.display_name}**. New balance: **{fmt_money(new_bal)}**.")
 
@@ -3896,22 +7792,17 @@ async def take_cmd(ctx: commands.Context, member: discord.Member, amount: str):
         await send_reply(ctx, f"Usage: `{PREFIX}take @User 500` (supports 2K/3M/1B/...)")
         return
 
-    target = get_user(member.id)
-    if target is None:
+    async with locks.hold(("user", member.id)):
+        res = await db.run(take_balance, member.id, member.display_name, amount_i)
+
+    if res is None:
         await send_reply(ctx, f"That user is not activated yet. They must run `{PREFIX}activate` first.")
         return
-
-    update_username(member.id, member.display_name)
-
-    current_bal = int(target[2])
-    take_amt = min(int(amount_i), current_bal)
+    take_amt, new_bal = res
     if take_amt <= 0:
         await send_reply(ctx, f"**{member.display_name}** has **0** Marcus Money to take.")
         return
 
-    add_balance(member.id, -take_amt)
-    updated = get_user(member.id)
-    new_bal = int(updated[2]) if updated else 0
     await send_reply(
         ctx,
         f"Took **-{fmt_money(take_amt)}** Marcus Money from **{member.display_name}**.\n"
@@ -3924,4 +7815,16 @@ async def take_cmd(ctx: commands.Context, member: discord.Member, amount: str):
 if __name__ == "__main__":
     if not TOKEN:
         raise RuntimeError("DISCORD_TOKEN is not set. Set it in your environment before running.")
-    bot.run(TOKEN)
+    # Migrate (or refuse an unknown schema version) before logging in
+    init_db()
+    try:
+        bot.run(TOKEN)
+    finally:
+        db.shutdown()
+        for guild_id in active_partitions():
+            with use_partition(guild_id):
+                usernames.flush()
+                price_rings.close()
+                if balance_cache.loaded:
+                    balance_cache.flush()
+                    balance_cache.close()
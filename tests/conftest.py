@@ -0,0 +1,36 @@
+"""
+Shared fixtures. Tests import bot.py directly, so discord.py must be
+installed; without it the whole directory is skipped.
+"""
+import builtins
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("discord")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# bot.py ships with `OWNER_ID = discord_id_here` for the owner to fill in
+if not hasattr(builtins, "discord_id_here"):
+    builtins.discord_id_here = 0
+
+import bot as bot_module  # noqa: E402
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    """
+    bot.py pointed at a fresh, migrated database in tmp_path, with its own
+    balance cache. Pools, executors and the journal are closed afterwards.
+    """
+    monkeypatch.setattr(bot_module, "DB_PATH", str(tmp_path / "test.db"))
+    monkeypatch.setattr(bot_module, "balance_cache", bot_module.BalanceCache())
+    bot_module.init_db()
+    yield bot_module
+    bot_module.db.shutdown()
+    bot_module.balance_cache.close()
+    bot_module.price_rings.close()
+    bot_module.get_db_pool().close_all()
+    bot_module.get_db_read_pool().close_all()
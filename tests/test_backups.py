@@ -0,0 +1,87 @@
+import os
+import sqlite3
+import threading
+
+
+def _raw_balance(bot, user_id):
+    conn = bot.db_connect_read()
+    try:
+        return conn.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_backup_is_consistent_while_writes_continue(bot, monkeypatch):
+    monkeypatch.setattr(bot, "BACKUP_PAGES_PER_STEP", 1)
+    monkeypatch.setattr(bot, "BACKUP_STEP_SLEEP_MS", 0)
+    for uid in range(1, 201):
+        bot.insert_user(uid, f"user-{uid}" * 20)
+    stop = threading.Event()
+
+    def writer():
+        while not stop.is_set():
+            bot.add_balance(1, 1)
+
+    t = threading.Thread(target=writer)
+    t.start()
+    try:
+        path, pages, _secs = bot.backup_db_once()
+    finally:
+        stop.set()
+        t.join()
+
+    assert pages > 1
+    assert not os.path.exists(path + ".part")
+    snap = sqlite3.connect(path)
+    try:
+        assert snap.execute("PRAGMA quick_check").fetchone()[0] == "ok"
+        assert snap.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+        assert snap.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 200
+    finally:
+        snap.close()
+
+
+def test_rotation_keeps_newest_per_kind(bot, monkeypatch):
+    monkeypatch.setattr(bot, "BACKUP_KEEP", 2)
+    folder = bot._backup_dir()
+    os.makedirs(folder)
+    stem = bot._backup_stem()
+    for i in range(4):
+        open(os.path.join(folder, f"{stem}-2026010{i}-000000.db"), "w").close()
+        open(os.path.join(folder, f"{stem}-2026010{i}-000000-manual.db"), "w").close()
+    open(os.path.join(folder, "unrelated-20260101-000000.db"), "w").close()
+
+    assert bot._prune_backups() == 4
+    names = [name for name, _label, _size in bot.list_backups()]
+    assert names == [
+        f"{stem}-20260103-000000.db",
+        f"{stem}-20260103-000000-manual.db",
+        f"{stem}-20260102-000000.db",
+        f"{stem}-20260102-000000-manual.db",
+    ]
+    assert os.path.exists(os.path.join(folder, "unrelated-20260101-000000.db"))
+
+
+def test_restore_replaces_data_and_reloads_balance_cache(bot):
+    bot.insert_user(1, "u1")
+    bot.balance_cache.load()
+    bot.balance_cache.add(1, 100)
+    bot.balance_cache.flush()
+    path, _pages, _secs = bot.backup_db_once()
+
+    bot.insert_user(2, "u2")
+    bot.balance_cache.add(1, 999)  # pending only, belongs to the discarded timeline
+    assert bot.resolve_backup("latest") == path
+
+    assert bot.restore_backup(path) == 1
+    assert bot.get_user(2) is None
+    assert bot.balance_cache.loaded
+    assert bot.balance_cache.get(1) == bot.START_BALANCE + 100
+    assert _raw_balance(bot, 1) == bot.START_BALANCE + 100
+    assert bot.balance_cache.journal_bytes() == 0
+
+
+def test_resolve_rejects_unknown_names(bot):
+    bot.backup_db_once()
+    assert bot.resolve_backup("../" + os.path.basename(bot.DB_PATH)) is None
+    assert bot.resolve_backup("nope.db") is None
@@ -0,0 +1,126 @@
+import os
+
+import pytest
+
+
+def _balances(bot, user_ids):
+    return {uid: bot.get_user(uid)[2] for uid in user_ids}
+
+
+def _crash_and_reload(bot, monkeypatch):
+    """
+    Drops the in-memory cache as a crash would (journal synced, nothing
+    flushed) and starts a fresh one from the database + journal.
+    """
+    bot.balance_cache.sync_journal()
+    bot.balance_cache._journal.close()
+    bot.balance_cache._journal = None
+    fresh = bot.BalanceCache()
+    monkeypatch.setattr(bot, "balance_cache", fresh)
+    fresh.load()
+    return fresh
+
+
+def _raw_balance(bot, user_id):
+    conn = bot.db_connect_read()
+    try:
+        return conn.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_replay_applies_unflushed_deltas_exactly_once(bot, monkeypatch):
+    for uid in (1, 2):
+        bot.insert_user(uid, f"u{uid}")
+    bot.balance_cache.load()
+    bot.balance_cache.add(1, 250)
+    bot.balance_cache.add(2, -100)
+    bot.balance_cache.add(1, 5)
+    expected = _balances(bot, (1, 2))
+    assert _raw_balance(bot, 1) == bot.START_BALANCE
+
+    _crash_and_reload(bot, monkeypatch)
+    assert _balances(bot, (1, 2)) == expected
+    assert _raw_balance(bot, 1) == expected[1]
+
+    _crash_and_reload(bot, monkeypatch)
+    assert _balances(bot, (1, 2)) == expected
+
+
+def test_flushed_deltas_are_not_replayed(bot, monkeypatch):
+    bot.insert_user(1, "u1")
+    bot.balance_cache.load()
+    bot.balance_cache.add(1, 40)
+    bot.balance_cache.flush()
+    bot.balance_cache.add(1, 2)
+
+    _crash_and_reload(bot, monkeypatch)
+    assert _raw_balance(bot, 1) == bot.START_BALANCE + 42
+
+
+def test_partial_flush_is_not_replayed(bot, monkeypatch):
+    for uid in (1, 2):
+        bot.insert_user(uid, f"u{uid}")
+    bot.balance_cache.load()
+    bot.balance_cache.add(1, 10)
+    bot.balance_cache.add(2, 20)
+    with bot.db_lock:
+        conn = bot.db_connect()
+        try:
+            assert bot.balance_cache.flush_conn(conn, [1]) == 1
+        finally:
+            conn.close()
+    assert _raw_balance(bot, 1) == bot.START_BALANCE + 10
+    assert _raw_balance(bot, 2) == bot.START_BALANCE
+    bot.balance_cache.add(1, 1)
+
+    _crash_and_reload(bot, monkeypatch)
+    assert _balances(bot, (1, 2)) == {1: bot.START_BALANCE + 11, 2: bot.START_BALANCE + 20}
+
+
+def test_compaction_keeps_pending_deltas(bot, monkeypatch):
+    bot.insert_user(1, "u1")
+    bot.balance_cache.load()
+    for _ in range(100):
+        bot.balance_cache.add(1, 1)
+    size_before = bot.balance_cache.journal_bytes()
+    assert bot.balance_cache.compact_journal()
+    assert bot.balance_cache.journal_bytes() < size_before
+    bot.balance_cache.add(1, 1)
+
+    _crash_and_reload(bot, monkeypatch)
+    assert _raw_balance(bot, 1) == bot.START_BALANCE + 101
+
+
+def test_torn_journal_tail_is_ignored(bot, monkeypatch):
+    bot.insert_user(1, "u1")
+    bot.balance_cache.load()
+    bot.balance_cache.add(1, 7)
+    bot.balance_cache.sync_journal()
+    with open(bot.DB_PATH + bot.BALANCE_JOURNAL_SUFFIX, "a", encoding="utf-8") as f:
+        f.write("999\t1")  # crash mid-write
+
+    _crash_and_reload(bot, monkeypatch)
+    assert _raw_balance(bot, 1) == bot.START_BALANCE + 7
+    assert os.path.exists(bot.DB_PATH + bot.BALANCE_JOURNAL_SUFFIX)
+
+
+def test_flush_conn_refuses_to_commit_an_open_transaction(bot):
+    bot.insert_user(1, "u1")
+    bot.balance_cache.load()
+    bot.balance_cache.add(1, 5)
+    with bot.unit_of_work() as conn:
+        conn.execute("UPDATE users SET username = 'x' WHERE user_id = 1")
+        with pytest.raises(RuntimeError, match="before starting a transaction"):
+            bot.balance_cache.flush_conn(conn, [1])
+    assert bot.balance_cache.get(1) == bot.START_BALANCE + 5
+
+
+def test_set_counts_deltas_still_pending(bot):
+    bot.insert_user(1, "u1")
+    bot.balance_cache.load()
+    bot.balance_cache.add(1, -300)
+    assert bot.apply_balance_batch([("set", 1, 50)]) == [50]
+    assert bot.balance_cache.get(1) == 50
+    bot.balance_cache.flush()
+    assert bot.get_user(1)[2] == 50
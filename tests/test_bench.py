@@ -0,0 +1,31 @@
+import bench
+
+
+def test_time_samples_reports_best_run_and_tail(bot):
+    calls = []
+    ops, p50, p99 = bench._time_samples(lambda arg: calls.append(arg), 10, setup=lambda i: i, repeat=3)
+    # 10 warm-up calls, then 3 runs of 10, each given its own setup value
+    assert calls == list(range(40))
+    assert ops > 0 and 0 <= p50 <= p99
+
+
+def test_economy_suite_covers_every_core_function(bot):
+    seed = bench.seed_economy(users=30, tickets=20, wagers=5, price_points=50)
+    seed["markets"] = 0
+    names = [name for name, _ops, _p50, _p99 in bench.bench_economy(5, seed, repeat=1)]
+    for wanted in (
+        "get_user", "place_wager", "resolve_bet_and_payout", "v2_buy", "v2_sell", "v2_market_tick_once",
+        "run_tax_if_due", "parole_tick_once", "render_ascii_price_chart", "powerball settlement",
+    ):
+        assert any(name.startswith(wanted) for name in names), wanted
+
+
+def test_compare_flags_only_p50_regressions(bot, tmp_path):
+    path = str(tmp_path / "baseline.json")
+    params = {"iterations": 1}
+    results = [("a", 1000.0, 10.0, 50.0), ("b", 1000.0, 10.0, 50.0)]
+    bench.save_baseline(path, results, params)
+    assert bench.compare_baseline(path, results, params, 0.25)
+    # p99 alone getting worse is not gated; p50 beyond the tolerance is
+    assert bench.compare_baseline(path, [("a", 1000.0, 12.0, 500.0), ("b", 1000.0, 10.0, 50.0)], params, 0.25)
+    assert not bench.compare_baseline(path, [("a", 500.0, 20.0, 50.0), ("b", 1000.0, 10.0, 50.0)], params, 0.25)
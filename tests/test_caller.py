@@ -0,0 +1,39 @@
+import asyncio
+from types import SimpleNamespace
+
+
+def test_user_row_has_jail_parole_and_cached_balance(bot):
+    bot.insert_user(1, "u1")
+    bot.balance_cache.load()
+    bot.balance_cache.add(1, 25)
+    bot.set_jailed(1, True)
+    row = bot.get_user_row(1)
+    assert row.jailed and row.jail_ts > 0 and not row.paroled
+    assert row.balance == bot.START_BALANCE + 25
+    assert row.as_user() == bot.get_user(1)
+    assert bot.get_user_row(2) is None
+
+
+def test_caller_row_is_read_once_per_invocation(bot):
+    bot.insert_user(1, "u1")
+    ctx = SimpleNamespace(author=SimpleNamespace(id=1))
+
+    async def run():
+        bot._db_trips.set([0])
+        first = await bot.caller_row(ctx)
+        again = await bot.caller_row(ctx)
+        assert first is again
+        after_read = bot._db_trips.get()[0]
+        bot.forget_caller(ctx)
+        await bot.caller_row(ctx)
+        return after_read, bot._db_trips.get()[0]
+
+    assert asyncio.run(run()) == (1, 2)
+
+
+def test_round_trips_show_up_in_stats(bot):
+    stats = bot.QueryStats()
+    stats.record_command("slot", 3)
+    stats.record_command("slot", 1)
+    assert stats.commands["slot"] == [2, 4, 3]
+    assert any("slot" in line and "avg=2.00" in line for line in stats.report_lines())
@@ -0,0 +1,76 @@
+import asyncio
+
+
+def _age_daily(bot, user_id, seconds):
+    conn = bot.db_connect()
+    try:
+        conn.execute("UPDATE users SET last_daily = last_daily - ? WHERE user_id = ?", (seconds, user_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _daily_entries(bot, user_id):
+    conn = bot.db_connect_read()
+    try:
+        return conn.execute(
+            "SELECT delta FROM balance_ledger WHERE user_id = ? AND reason = 'daily'", (user_id,)
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def test_daily_due_is_derived_from_last_daily(bot):
+    assert bot.daily_due(1000, 1000 + bot.DAILY_SECONDS) == bot.DAILY_CREDITS
+    assert bot.daily_due(1000, 1000 + bot.DAILY_SECONDS - 1) == 0
+
+
+def test_claim_reports_remaining_time_and_pays_once(bot):
+    bot.insert_user(1, "u1")
+    claimed, bal, remaining = bot.claim_daily(1)
+    assert not claimed and bal == bot.START_BALANCE and 0 < remaining <= bot.DAILY_SECONDS
+    _age_daily(bot, 1, bot.DAILY_SECONDS)
+    assert bot.claim_daily(1) == (True, bot.START_BALANCE + bot.DAILY_CREDITS, bot.DAILY_SECONDS)
+    assert not bot.claim_daily(1)[0]
+    assert bot.claim_daily(2) is None
+
+
+def test_debit_credits_a_due_bonus_first(bot):
+    bot.insert_user(1, "u1")
+    _age_daily(bot, 1, bot.DAILY_SECONDS)
+    stake = bot.START_BALANCE + 1  # only affordable with the bonus
+    with bot.unit_of_work() as conn:
+        res = bot._debit_conn(conn, 1, stake)
+    assert res == bot.DebitResult("ok", bot.START_BALANCE + bot.DAILY_CREDITS - stake, bot.DAILY_CREDITS)
+    assert _daily_entries(bot, 1) == [(bot.DAILY_CREDITS,)]
+    assert bot.daily_due(bot.get_user_row(1).last_daily) == 0
+
+
+def test_cached_game_debit_takes_the_database_path_when_due(bot):
+    bot.insert_user(1, "u1")
+    bot.balance_cache.load()
+    _age_daily(bot, 1, bot.DAILY_SECONDS)
+    last_daily = bot.get_user_row(1).last_daily
+
+    res = asyncio.run(bot.game_debit(1, 10, last_daily))
+    assert res.ok and res.daily == bot.DAILY_CREDITS
+    assert bot.balance_cache.get(1) == bot.START_BALANCE + bot.DAILY_CREDITS - 10
+    # Not due any more: stays in the cache
+    res = asyncio.run(bot.game_debit(1, 10, bot.get_user_row(1).last_daily))
+    assert res.ok and res.daily == 0
+    assert len(_daily_entries(bot, 1)) == 1
+
+
+def test_stealing_leaves_the_targets_due_bonus_alone(bot):
+    bot.insert_user(1, "thief")
+    bot.insert_user(2, "target")
+    _age_daily(bot, 2, bot.DAILY_SECONDS)
+    last_daily = bot.get_user_row(2).last_daily
+
+    stolen, _thief_bal, target_bal = bot.steal_balance(1, 2, 0.5)
+    assert stolen == bot.START_BALANCE // 2
+    assert target_bal == bot.START_BALANCE - stolen
+    assert bot.get_user_row(2).last_daily == last_daily
+    assert _daily_entries(bot, 2) == []
+    # Still theirs to claim
+    assert bot.claim_daily(2)[0]
@@ -0,0 +1,134 @@
+import asyncio
+
+
+def _debit(bot, user_id, amount):
+    with bot.unit_of_work() as conn:
+        return bot._debit_conn(conn, user_id, amount)
+
+
+def _raw_balance(bot, user_id):
+    conn = bot.db_connect_read()
+    try:
+        return conn.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_debit_conn_outcomes(bot):
+    bot.insert_user(1, "u1")
+    assert _debit(bot, 1, 100) == bot.DebitResult("ok", bot.START_BALANCE - 100)
+    assert _debit(bot, 1, bot.START_BALANCE) == bot.DebitResult("insufficient", bot.START_BALANCE - 100)
+    assert _debit(bot, 2, 1) == bot.DebitResult("not_activated")
+    assert _raw_balance(bot, 1) == bot.START_BALANCE - 100
+
+
+def test_debit_conn_counts_pending_cache_deltas(bot):
+    bot.insert_user(1, "u1")
+    bot.balance_cache.load()
+    bot.balance_cache.add(1, 50)
+    res = _debit(bot, 1, bot.START_BALANCE + 50)
+    assert res.ok and res.balance == 0
+    assert bot.balance_cache.get(1) == 0
+    assert not _debit(bot, 1, 1).ok
+
+
+def test_cache_try_debit(bot):
+    bot.insert_user(1, "u1")
+    bot.balance_cache.load()
+    assert bot.balance_cache.try_debit(2, 1) is None
+    assert bot.balance_cache.try_debit(1, bot.START_BALANCE + 1).status == "insufficient"
+    res = bot.balance_cache.try_debit(1, 10)
+    assert res.ok and res.balance == bot.START_BALANCE - 10
+    bot.balance_cache.flush()
+    assert _raw_balance(bot, 1) == bot.START_BALANCE - 10
+
+
+def test_batched_debit_op(bot):
+    bot.insert_user(1, "u1")
+    results = bot.apply_balance_batch([
+        ("debit", 1, 30),
+        ("debit", 1, bot.START_BALANCE),
+        ("debit", 9, 1),
+        ("add", 1, 5),
+    ])
+    assert results[0] == bot.DebitResult("ok", bot.START_BALANCE - 30)
+    assert results[1].status == "insufficient"
+    assert results[2].status == "not_activated"
+    assert results[3] == bot.START_BALANCE - 25
+
+
+def test_concurrent_game_debits_never_overdraw(bot, monkeypatch):
+    monkeypatch.setattr(bot, "BALANCE_CACHE_ENABLED", False)
+    bot.insert_user(1, "u1")
+    stake = bot.START_BALANCE // 4 + 1
+
+    async def run():
+        return await asyncio.gather(*(bot.game_debit(1, stake) for _ in range(8)))
+
+    results = asyncio.run(run())
+    assert sum(r.ok for r in results) == 3
+    assert _raw_balance(bot, 1) == bot.START_BALANCE - 3 * stake
+
+
+def test_sql_debit_is_visible_to_the_cache_before_commit(bot):
+    bot.insert_user(1, "u1")
+    bot.balance_cache.load()
+    with bot.unit_of_work() as conn:
+        assert bot._debit_conn(conn, 1, bot.START_BALANCE).ok
+        # A game stake on the event loop can't spend the same funds meanwhile
+        assert bot.balance_cache.try_debit(1, 1).status == "insufficient"
+    assert bot.balance_cache.get(1) == 0 == _raw_balance(bot, 1)
+
+
+def test_rolled_back_sql_debit_restores_the_cache(bot):
+    bot.insert_user(1, "u1")
+    bot.balance_cache.load()
+    try:
+        with bot.unit_of_work() as conn:
+            assert bot._debit_conn(conn, 1, 400).ok
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert bot.balance_cache.get(1) == bot.START_BALANCE
+
+
+def test_take_never_goes_below_zero(bot):
+    bot.insert_user(1, "u1")
+    bot.balance_cache.load()
+    bot.balance_cache.add(1, -600)
+    assert bot.take_balance(1, "u1", 100) == (100, bot.START_BALANCE - 700)
+    assert bot.take_balance(1, "u1", 10_000) == (bot.START_BALANCE - 700, 0)
+    assert bot.take_balance(1, "u1", 5) == (0, 0)
+    assert bot.take_balance(2, "u2", 5) is None
+
+
+def _deltas_arrive_after_flush(bot, monkeypatch):
+    # What a game stake landing between the flush and the write looks like
+    monkeypatch.setattr(bot.balance_cache, "flush_conn", lambda conn, user_ids=None: 0)
+
+
+def test_tax_counts_deltas_that_arrive_after_its_flush(bot, monkeypatch):
+    monkeypatch.setattr(bot, "TAX_WEEKDAYS", set(range(7)))
+    bot.insert_user(1, "u1")
+    bot.balance_cache.load()
+    _deltas_arrive_after_flush(bot, monkeypatch)
+    bot.balance_cache.add(1, -(bot.START_BALANCE - 100))
+    _date, taxed, total = bot.run_tax_if_due()
+    assert (taxed, total) == (1, 3)  # 3% of the 100 actually left
+    assert bot.balance_cache.get(1) == 97
+    assert _raw_balance(bot, 1) + bot.balance_cache.unflushed(1) == 97
+
+
+def test_parole_counts_deltas_that_arrive_after_its_flush(bot, monkeypatch):
+    bot.insert_user(1, "u1")
+    bot.balance_cache.load()
+    with bot.unit_of_work() as conn:
+        conn.execute(
+            "UPDATE users SET paroled = 1, parole_ts = ?, parole_last_pay_ts = ? WHERE user_id = 1",
+            (int(bot.time.time()) - 60, int(bot.time.time()) - 2 * bot.PAROLE_PAY_INTERVAL_SECONDS),
+        )
+    _deltas_arrive_after_flush(bot, monkeypatch)
+    bot.balance_cache.add(1, -(bot.START_BALANCE - 100))
+    bot.parole_tick_once()
+    assert bot.balance_cache.get(1) == 100 - bot.parole_payment(100, 2)
+    assert bot.balance_cache.get(1) >= 0
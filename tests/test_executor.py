@@ -0,0 +1,54 @@
+import asyncio
+import contextvars
+import threading
+
+_marker: contextvars.ContextVar[str] = contextvars.ContextVar("marker", default="unset")
+
+
+def test_writes_run_on_one_writer_thread(bot):
+    async def run():
+        names = await asyncio.gather(*(bot.db.run(lambda: threading.current_thread().name) for _ in range(8)))
+        return names, threading.current_thread().name
+
+    names, loop_thread = asyncio.run(run())
+    assert len(set(names)) == 1
+    assert names[0].startswith("db-writer") and names[0] != loop_thread
+
+
+def test_reads_run_concurrently_on_reader_threads(bot, monkeypatch):
+    monkeypatch.setattr(bot, "DB_READER_THREADS", 4)
+    barrier = threading.Barrier(3, timeout=5)
+
+    def wait_for_peers():
+        # Only returns if all three reads are running at the same time
+        barrier.wait()
+        return threading.current_thread().name
+
+    async def run():
+        return await asyncio.gather(*(bot.db.read(wait_for_peers) for _ in range(3)))
+
+    names = asyncio.run(run())
+    assert len(set(names)) == 3
+    assert all(name.startswith("db-reader") for name in names)
+
+
+def test_context_is_carried_into_worker_threads(bot):
+    async def run():
+        _marker.set("from the command")
+        return await bot.db.run(_marker.get), await bot.db.read(_marker.get)
+
+    assert asyncio.run(run()) == ("from the command", "from the command")
+
+
+def test_worker_exceptions_reach_the_caller(bot):
+    def boom():
+        raise KeyError("nope")
+
+    async def run():
+        try:
+            await bot.db.run(boom)
+        except KeyError:
+            return True
+        return False
+
+    assert asyncio.run(run())
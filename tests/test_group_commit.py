@@ -0,0 +1,66 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def unlucky(bot):
+    """Any write that would leave a balance of exactly 13 fails."""
+    for uid in (1, 2, 3):
+        bot.insert_user(uid, f"u{uid}")
+    conn = bot.db_connect()
+    try:
+        conn.execute(
+            """
+            CREATE TRIGGER unlucky BEFORE UPDATE OF balance ON users
+            WHEN NEW.balance = 13
+            BEGIN SELECT RAISE(ABORT, 'unlucky balance'); END
+            """
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    return bot
+
+
+def test_failing_op_is_rolled_back_on_its_own(unlucky):
+    bot = unlucky
+    results = bot.apply_balance_batch([
+        ("add", 1, 5),
+        ("set", 2, 13),
+        ("add", 3, 7),
+        ("bogus", 3, 1),
+    ])
+    assert results[0] == bot.START_BALANCE + 5
+    assert isinstance(results[1], sqlite3.IntegrityError)
+    assert results[2] == bot.START_BALANCE + 7
+    assert isinstance(results[3], ValueError)
+    assert [bot.get_user(uid)[2] for uid in (1, 2, 3)] == [
+        bot.START_BALANCE + 5, bot.START_BALANCE, bot.START_BALANCE + 7,
+    ]
+
+
+def test_committer_batches_and_fails_only_the_bad_caller(unlucky, monkeypatch):
+    bot = unlucky
+    monkeypatch.setattr(bot, "GROUP_COMMIT_WINDOW_MS", 5.0)
+    batches = []
+    apply = bot.apply_balance_batch
+
+    def spy(ops):
+        batches.append(len(ops))
+        return apply(ops)
+
+    monkeypatch.setattr(bot, "apply_balance_batch", spy)
+
+    async def run():
+        return await asyncio.gather(
+            *(bot.balance_writes.add(uid, 1) for uid in (1, 3) for _ in range(10)),
+            bot.balance_writes.set(2, 13),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+    assert isinstance(results[-1], sqlite3.IntegrityError)
+    assert results[9] == results[19] == bot.START_BALANCE + 10
+    assert sum(batches) == 21 and len(batches) < 21
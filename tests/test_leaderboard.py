@@ -0,0 +1,102 @@
+import random
+
+
+def _sql_order(bot):
+    conn = bot.db_connect_read()
+    try:
+        return conn.execute(
+            "SELECT username, balance FROM users ORDER BY balance DESC, user_id ASC"
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def test_rank_index_matches_sorted_order(bot, monkeypatch):
+    monkeypatch.setattr(bot, "RANK_BUCKET_SIZE", 4)
+    rng = random.Random(7)
+    idx = bot.RankIndex()
+    balances = {uid: rng.randrange(0, 50) for uid in range(40)}
+    idx.build(balances)
+    for _ in range(2000):
+        uid = rng.randrange(60)
+        # Small nudges mostly stay inside one bucket, big jumps move buckets
+        new = balances.get(uid, 25) + rng.randrange(-2, 3) if rng.random() < 0.5 else rng.randrange(0, 50)
+        idx.move(uid, balances.get(uid), new)
+        balances[uid] = new
+    expected = sorted(balances.items(), key=lambda kv: (-kv[1], kv[0]))
+    assert len(idx) == len(expected)
+    assert idx.page(0, len(expected)) == expected
+    assert idx.page(13, 5) == expected[13:18]
+    assert idx.page(len(expected), 5) == []
+    for pos, (uid, bal) in enumerate(expected):
+        assert idx.rank(uid, bal) == pos
+
+
+def test_leaders_follow_cached_and_sql_writes(bot):
+    for uid in range(1, 6):
+        bot.insert_user(uid, f"u{uid}")
+    bot.balance_cache.load()
+    bot.balance_cache.add(3, 500)
+    bot.balance_cache.add(5, -200)
+    bot.set_balance(1, 5000)
+    bot.gift_balance(2, 4, 100)
+
+    top = bot.get_top_users(10)
+    assert [name for name, _bal in top] == ["u1", "u3", "u4", "u2", "u5"]
+    bot.balance_cache.flush()
+    assert top == _sql_order(bot)
+    assert bot.get_top_users(2, 2) == top[2:4]
+    assert bot.get_user_rank(4) == (3, bot.START_BALANCE + 100, 5)
+    assert bot.get_user_rank(99) is None
+
+
+def test_sql_fallback_without_cache(bot, monkeypatch):
+    monkeypatch.setattr(bot, "BALANCE_CACHE_ENABLED", False)
+    for uid in range(1, 4):
+        bot.insert_user(uid, f"u{uid}")
+    bot.add_balance(2, 10)
+    assert bot.get_top_users(2) == [("u2", bot.START_BALANCE + 10), ("u1", bot.START_BALANCE)]
+    assert bot.get_user_rank(3) == (3, bot.START_BALANCE, 3)
+
+
+def _sql_net_worth(bot, monkeypatch, limit=50):
+    monkeypatch.setattr(bot, "BALANCE_CACHE_ENABLED", False)
+    try:
+        return bot.get_net_worth_top(limit)
+    finally:
+        monkeypatch.setattr(bot, "BALANCE_CACHE_ENABLED", True)
+
+
+def test_net_worth_board_follows_trades_and_ticks(bot, monkeypatch):
+    for uid in range(1, 7):
+        bot.insert_user(uid, f"u{uid}")
+    bot.balance_cache.load()
+    sym = bot.v2_list_markets()[0][0]
+    assert bot.v2_buy(2, sym, 600)[0]
+    assert bot.v2_buy(3, sym, 300)[0]
+    bot.balance_cache.add(4, 50)
+    bot.balance_cache.flush()
+    assert bot.get_net_worth_top(10) == _sql_net_worth(bot, monkeypatch)
+
+    for _ in range(5):
+        bot.v2_market_tick_once()
+    assert bot.v2_sell(3, sym, bot.v2_get_holding(3, sym) / 2)[0]
+    assert bot.v2_set_market(sym, 5000.0, 1_000_000.0)[0]
+    top = bot.get_net_worth_top(10)
+    assert top == _sql_net_worth(bot, monkeypatch)
+    assert top[0][0] == "u2"
+
+    rank, worth, total = bot.get_net_worth_rank(2)
+    assert (rank, total) == (1, 6) and worth == top[0][1]
+    assert bot.get_net_worth_rank(99) is None
+
+
+def test_net_worth_reprices_only_holders(bot):
+    board = bot.NetWorthBoard()
+    board.load({1: 100, 2: 200, 3: 50}, [(3, "AAA", 2.0)], {"AAA": 10.0})
+    assert board.top(0, 3, {"AAA": 10.0}) == [(2, 200), (1, 100), (3, 70)]
+    board.set_cash(1, 10)
+    assert board.top(0, 3, {"AAA": 100.0}) == [(3, 250), (2, 200), (1, 10)]
+    assert board.rank(1, {"AAA": 100.0}) == (2, 10, 3)
+    board.set_holdings(3, {})
+    assert board.rank(3, {"AAA": 100.0}) == (1, 50, 3)
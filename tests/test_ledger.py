@@ -0,0 +1,88 @@
+import sqlite3
+
+
+def _ledger(bot, user_id):
+    conn = bot.db_connect_read()
+    try:
+        return conn.execute(
+            "SELECT delta, reason, ref_id FROM balance_ledger WHERE user_id = ? ORDER BY id", (user_id,)
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def test_mutations_are_ledgered_with_reasons(bot):
+    bot.insert_user(1, "u1")
+    bot.insert_user(2, "u2")
+    status, _s, _r = bot.gift_balance(1, 2, 300)
+    assert status == "ok"
+    bot.add_balance(2, -50)
+
+    assert _ledger(bot, 1) == [(bot.START_BALANCE, "activate", None), (-300, "gift", "2")]
+    assert _ledger(bot, 2) == [(bot.START_BALANCE, "activate", None), (300, "gift", "1"), (-50, "admin", None)]
+
+
+def test_balance_cache_flush_is_one_batch_labelled_games(bot):
+    bot.insert_user(1, "u1")
+    bot.balance_cache.load()
+    for _ in range(10):
+        bot.balance_cache.add(1, 3)
+    seq = bot.balance_cache._seq
+    bot.balance_cache.flush()
+    # The net delta, pointing at the last journal line it covers
+    assert _ledger(bot, 1)[-1] == (30, "games", f"journal:{seq}")
+
+
+def test_flush_inside_a_command_keeps_the_command_label(bot):
+    bot.insert_user(1, "u1")
+    bot.balance_cache.load()
+    bot.balance_cache.add(1, 5)
+    seq = bot.balance_cache._seq
+    bot.set_balance(1, 100)  # flushes user 1 first
+    assert _ledger(bot, 1)[-2:] == [(5, "games", f"journal:{seq}"), (100 - bot.START_BALANCE - 5, "admin", None)]
+
+
+def test_verify_is_incremental_from_the_checkpoint(bot):
+    for uid in (1, 2, 3):
+        bot.insert_user(uid, f"u{uid}")
+    first = bot.verify_ledger()
+    assert first.from_id == 0 and first.entries == 3 and not first.mismatches
+
+    bot.add_balance(2, 40)
+    second = bot.verify_ledger()
+    assert second.from_id == first.to_id
+    assert second.entries == 1
+    assert second.users == 3 and not second.mismatches
+
+    assert bot.verify_ledger().entries == 0
+
+
+def test_unledgered_write_is_reported(bot):
+    bot.insert_user(1, "u1")
+    bot.verify_ledger()
+    raw = sqlite3.connect(bot.DB_PATH)
+    try:
+        raw.execute("UPDATE users SET balance = balance + 999 WHERE user_id = 1")
+        raw.commit()
+    finally:
+        raw.close()
+
+    check = bot.verify_ledger()
+    assert check.mismatches == [(1, bot.START_BALANCE + 999, bot.START_BALANCE)]
+    assert bot.verify_ledger(full=True).mismatches == check.mismatches
+
+
+def test_migration_opens_existing_balances(bot):
+    with bot.db_lock:
+        conn = bot.db_connect()
+        try:
+            conn.execute("DELETE FROM balance_ledger")
+            conn.execute("INSERT INTO users (user_id, username, balance, last_daily) VALUES (7, 'old', 1234, 0)")
+            conn.execute("DELETE FROM balance_ledger")
+            conn.commit()
+            bot._migration_003_balance_ledger(conn)
+            conn.commit()
+        finally:
+            conn.close()
+    assert _ledger(bot, 7) == [(1234, "opening", None)]
+    assert not bot.verify_ledger(full=True).mismatches
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+
+def _keys_by_stripe(locks, n=64):
+    keys = [("user", i) for i in range(n)]
+    return sorted(keys, key=locks._stripe)
+
+
+def test_nested_hold_of_lower_stripe_is_rejected(bot):
+    locks = bot.StripedLocks(256)
+    keys = _keys_by_stripe(locks)
+    low, high = keys[0], keys[-1]
+    assert locks._stripe(low) < locks._stripe(high)
+
+    async def run():
+        async with locks.hold(high):
+            with pytest.raises(RuntimeError, match="lock order"):
+                async with locks.hold(low):
+                    pass
+        # Nothing leaked: both stripes are free again
+        assert not any(lock.locked() for lock in locks._locks)
+
+    asyncio.run(run())
+
+
+def test_nested_hold_ascending_and_reentrant_is_allowed(bot):
+    locks = bot.StripedLocks(256)
+    keys = _keys_by_stripe(locks)
+    low, high = keys[0], keys[-1]
+
+    async def run():
+        async with locks.hold(low):
+            async with locks.hold(high):
+                async with locks.hold(low, high):
+                    return True
+
+    assert asyncio.run(run())
+
+
+def test_opposite_order_two_key_holds_do_not_deadlock(bot):
+    locks = bot.StripedLocks(256)
+    a, b = ("user", 1), ("user", 2)
+    order = []
+
+    async def worker(first, second, tag):
+        for _ in range(50):
+            async with locks.hold(first, second):
+                order.append(tag)
+                await asyncio.sleep(0)
+
+    async def run():
+        await asyncio.wait_for(asyncio.gather(worker(a, b, "ab"), worker(b, a, "ba")), timeout=5)
+
+    asyncio.run(run())
+    assert len(order) == 100
+
+
+def test_same_key_is_mutually_exclusive(bot):
+    locks = bot.StripedLocks(256)
+    inside = 0
+    peak = 0
+
+    async def worker():
+        nonlocal inside, peak
+        async with locks.hold(("user", 7)):
+            inside += 1
+            peak = max(peak, inside)
+            await asyncio.sleep(0)
+            inside -= 1
+
+    async def run():
+        await asyncio.gather(*(worker() for _ in range(20)))
+
+    asyncio.run(run())
+    assert peak == 1
@@ -0,0 +1,112 @@
+import asyncio
+import dataclasses
+
+import pytest
+
+
+def _sql_markets(bot):
+    conn = bot.db_connect_read()
+    try:
+        rows = conn.execute(f"SELECT {bot._MARKET_COLUMNS} FROM crypto_v2_markets ORDER BY symbol").fetchall()
+        return {r[0]: bot._market_state(r) for r in rows}
+    finally:
+        conn.close()
+
+
+def _book_markets(bot):
+    return {st.symbol: st for st in bot._v2_book().states()}
+
+
+def test_book_follows_trades_ticks_and_resets(bot):
+    bot.insert_user(1, "u1")
+    sym = bot.v2_list_markets()[0][0]
+    before = bot.market_book.get(sym)
+    assert bot.v2_buy(1, sym, 500)[0]
+    bot.v2_market_tick_once()
+    assert bot.v2_sell(1, sym, bot.v2_get_holding(1, sym) / 2)[0]
+    assert _book_markets(bot) == _sql_markets(bot)
+
+    assert bot.v2_set_market(sym, 5000.0, 1_000_000.0)[0]
+    assert bot.v2_get_market(sym) == _sql_markets(bot)[sym].row()
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        before.reserve_money = 0.0
+
+
+def test_rolled_back_trade_is_not_published(bot):
+    bot.insert_user(1, "u1")
+    sym = bot.v2_list_markets()[0][0]
+    before = bot._v2_book().get(sym)
+    with pytest.raises(RuntimeError):
+        with bot.unit_of_work() as conn:
+            assert bot._v2_buy_conn(conn, 1, sym, 500)[0]
+            raise RuntimeError("fail after the trade")
+    assert bot._v2_book().get(sym) is before
+    assert _sql_markets(bot)[sym] == before
+
+
+def test_trade_batch_chains_reserves_and_isolates_failures(bot):
+    for uid in (1, 2):
+        bot.insert_user(uid, f"u{uid}")
+    sym = bot.v2_list_markets()[0][0]
+    results = bot.apply_trade_batch([
+        ("buy", 1, "u1", sym, 300),
+        ("nope", 1, "u1", sym, 1),
+        ("buy", 2, "u2", sym, 300),
+        ("sell", 9, "u9", sym, 1.0),
+    ])
+    assert results[0][0] and results[2][0]
+    assert isinstance(results[1], ValueError)
+    assert results[3] is None
+    # The second buy paid the price the first one left behind: fewer coins for the same money
+    assert results[2][3] < results[0][3]
+    assert _book_markets(bot) == _sql_markets(bot)
+
+
+def test_burst_of_trades_is_group_committed(bot, monkeypatch):
+    for uid in range(1, 21):
+        bot.insert_user(uid, f"u{uid}")
+    sym = bot.v2_list_markets()[0][0]
+    batches = []
+    apply = bot.apply_trade_batch
+
+    def spy(ops):
+        batches.append(len(ops))
+        return apply(ops)
+
+    monkeypatch.setattr(bot, "apply_trade_batch", spy)
+
+    async def run():
+        return await asyncio.gather(*(bot.trade_writes.buy(uid, f"u{uid}", sym, 100) for uid in range(1, 21)))
+
+    results = asyncio.run(run())
+    assert all(res[0] for res in results)
+    assert sum(batches) == 20 and len(batches) < 20
+    # Applied in submission order, so every buy got fewer coins than the one before
+    owned = [res[3] for res in results]
+    assert owned == sorted(owned, reverse=True)
+    assert _book_markets(bot) == _sql_markets(bot)
+
+
+def test_sql_only_mode(bot, monkeypatch):
+    monkeypatch.setattr(bot, "CRYPTO_V2_MARKET_BOOK", False)
+    bot.insert_user(1, "u1")
+    sym = bot.v2_list_markets()[0][0]
+    assert bot.v2_buy(1, sym, 500)[0]
+    bot.v2_market_tick_once()
+    assert bot.v2_get_market(sym) == _sql_markets(bot)[sym].row()
+    assert not bot.market_book.loaded
+
+
+def test_one_broken_trade_does_not_sink_the_batch(bot):
+    for uid in (1, 2):
+        bot.insert_user(uid, f"u{uid}")
+    sym = bot.v2_list_markets()[0][0]
+    results = bot.apply_trade_batch([
+        ("buy", 1, "u1", sym, 300),
+        ("buy", 2, "u2", sym, object()),
+        ("buy", 2, "u2", sym, 300),
+    ])
+    assert isinstance(results[1], TypeError)
+    assert results[0][0] and results[2][0]
+    assert bot.get_user_row(2).balance == bot.START_BALANCE - 300
+    assert _book_markets(bot) == _sql_markets(bot)
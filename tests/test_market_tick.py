@@ -0,0 +1,80 @@
+import pytest
+
+
+def _add_markets(bot, n, reserve_money=1_000_000.0, reserve_coin=1_000.0):
+    conn = bot.db_connect()
+    try:
+        conn.executemany(
+            """
+            INSERT INTO crypto_v2_markets
+            (symbol, name, reserve_money, reserve_coin, fee, created_ts, last_price, last_tick_ts, day_open_price)
+            VALUES (?, ?, ?, ?, ?, 0, ?, 0, ?)
+            """,
+            [
+                (f"T{i}", f"Test {i}", reserve_money, reserve_coin, bot.CRYPTO_V2_FEE, reserve_money / reserve_coin, 1.0)
+                for i in range(n)
+            ],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@pytest.fixture(params=["python", "numpy"])
+def engine(request, bot, monkeypatch):
+    if request.param == "numpy" and bot.np is None:
+        pytest.skip("numpy not installed")
+    monkeypatch.setattr(bot, "CRYPTO_V2_TICK_NUMPY", request.param == "numpy")
+    return request.param
+
+
+def test_tick_keeps_k_and_enforces_minimum_reserves(bot, engine, monkeypatch):
+    # No MOON/CRASH shocks, so the size of the move below is bounded
+    monkeypatch.setattr(bot, "V2_MOON_CHANCE", 0.0)
+    monkeypatch.setattr(bot, "V2_CRASH_CHANCE", 0.0)
+    rm = [1_000_000.0, 1000.5, 50.0]
+    rc = [1_000.0, 10.0, 1e-5]
+    new_rm, new_rc, kinds = bot.v2_tick_reserves(rm, rc)
+    assert len(new_rm) == len(new_rc) == len(kinds) == 3
+    for m, c, m0, c0 in zip(new_rm, new_rc, rm, rc):
+        assert m * c == pytest.approx(m0 * c0)
+        assert m >= bot.V2_MIN_RESERVE_MONEY * (1 - 1e-12) or c == bot.V2_MIN_RESERVE_COIN
+        assert c >= bot.V2_MIN_RESERVE_COIN
+    # Plain ticks move the price by at most about half a percent
+    assert 0.99 < (new_rm[0] / new_rc[0]) / 1000.0 < 1.01
+
+
+def test_tick_shocks(bot, engine, monkeypatch):
+    monkeypatch.setattr(bot, "V2_MOON_CHANCE", 1.0)
+    new_rm, new_rc, kinds = bot.v2_tick_reserves([1_000_000.0] * 50, [1_000.0] * 50)
+    assert kinds == ["MOON"] * 50
+    assert all(m / c > 1000.0 for m, c in zip(new_rm, new_rc))
+
+    monkeypatch.setattr(bot, "V2_MOON_CHANCE", 0.0)
+    monkeypatch.setattr(bot, "V2_CRASH_CHANCE", 1.0)
+    _rm, _rc, kinds = bot.v2_tick_reserves([1_000_000.0] * 50, [1_000.0] * 50)
+    assert kinds == ["CRASH"] * 50
+
+
+def test_market_tick_writes_every_market_once(bot, engine, monkeypatch):
+    _add_markets(bot, 40)
+    monkeypatch.setattr(bot, "V2_MOON_CHANCE", 0.5)
+    bot.v2_market_tick_once()
+
+    conn = bot.db_connect_read()
+    try:
+        markets = conn.execute(
+            "SELECT symbol, reserve_money, reserve_coin, last_price, last_tick_ts, day_open_price FROM crypto_v2_markets"
+        ).fetchall()
+        prices = dict(conn.execute("SELECT symbol, price FROM crypto_v2_prices").fetchall())
+        events = conn.execute("SELECT symbol FROM crypto_v2_events WHERE kind = 'MOON'").fetchall()
+    finally:
+        conn.close()
+    assert len(prices) == len(markets)
+    for sym, rm, rc, last_price, last_tick, day_open in markets:
+        assert last_price == pytest.approx(rm / rc)
+        assert prices[sym] == last_price and last_tick > 0
+        if sym.startswith("T"):
+            # Last tick was on day 0, so the open resets to the pre-tick price
+            assert day_open == pytest.approx(1000.0)
+    assert events
@@ -0,0 +1,46 @@
+import asyncio
+from types import SimpleNamespace
+
+
+def _guild(guild_id, member_ids, bots=()):
+    members = [SimpleNamespace(id=m, bot=False) for m in member_ids]
+    members += [SimpleNamespace(id=b, bot=True) for b in bots]
+    return SimpleNamespace(id=guild_id, members=members, chunked=True)
+
+
+def test_index_follows_joins_leaves_and_activation(bot):
+    for uid in (1, 2, 3):
+        bot.insert_user(uid, f"u{uid}")
+    index = bot.member_index.current()
+    index.load()
+    assert index.index_guild(10, [1, 2, 4]) == 2
+    assert index.members(10) == {1, 2}
+    assert index.members(11) is None
+
+    index.add_member(10, 3)
+    index.remove_member(10, 1)
+    index.add_member(10, 5)  # not activated
+    assert index.members(10) == {2, 3}
+
+    bot.insert_user(5, "u5")
+    index.add_member(10, 5)
+    assert index.members(10) == {2, 3, 5}
+
+    index.forget()
+    assert not index.loaded and index.members(10) is None
+
+
+def test_guild_activated_ids_builds_once_from_member_cache(bot):
+    for uid in (1, 2, 3):
+        bot.insert_user(uid, f"u{uid}")
+    guild = _guild(10, [1, 2, 7], bots=[3])
+    assert asyncio.run(bot.guild_activated_ids(guild)) == {1, 2}
+    guild.members = []  # later calls don't look at the member list again
+    assert asyncio.run(bot.guild_activated_ids(guild)) == {1, 2}
+
+
+def test_get_usernames_is_one_lookup_for_many_ids(bot):
+    bot.insert_user(1, "u1")
+    bot.insert_user(2, "u2")
+    assert bot.get_usernames([2, 1, 9, 2]) == {1: "u1", 2: "u2"}
+    assert bot.get_usernames([]) == {}
@@ -0,0 +1,58 @@
+import sqlite3
+
+import pytest
+
+
+def _user_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def test_fresh_database_is_migrated_to_latest(bot):
+    conn = bot.db_connect_read()
+    try:
+        assert _user_version(conn) == bot.SCHEMA_VERSION
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        conn.close()
+    assert {"users", "bets", "bet_wagers", "lottery_tickets", "crypto_v2_markets"} <= tables
+
+
+def test_migrate_is_a_noop_when_current(bot):
+    with bot.db_lock:
+        conn = bot.db_connect()
+        try:
+            assert bot.migrate_db_conn(conn) == bot.SCHEMA_VERSION
+            assert _user_version(conn) == bot.SCHEMA_VERSION
+        finally:
+            conn.close()
+
+
+def test_refuses_a_newer_schema(bot):
+    with bot.db_lock:
+        conn = bot.db_connect()
+        try:
+            conn.execute(f"PRAGMA user_version = {bot.SCHEMA_VERSION + 1}")
+            with pytest.raises(RuntimeError, match="newer than this build"):
+                bot.migrate_db_conn(conn)
+            assert _user_version(conn) == bot.SCHEMA_VERSION + 1
+        finally:
+            conn.close()
+
+
+def test_failed_migration_rolls_back(bot, monkeypatch, tmp_path):
+    def broken(conn):
+        conn.execute("CREATE TABLE half_done (x INTEGER)")
+        raise sqlite3.OperationalError("boom")
+
+    monkeypatch.setattr(bot, "DB_PATH", str(tmp_path / "broken.db"))
+    monkeypatch.setattr(bot, "SCHEMA_MIGRATIONS", bot.SCHEMA_MIGRATIONS + [(bot.SCHEMA_VERSION + 1, "broken", broken)])
+    monkeypatch.setattr(bot, "SCHEMA_VERSION", bot.SCHEMA_VERSION + 1)
+    with pytest.raises(sqlite3.OperationalError):
+        bot.init_db()
+
+    conn = bot.db_connect_read()
+    try:
+        assert _user_version(conn) == bot.SCHEMA_VERSION - 1
+        assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'half_done'").fetchone() is None
+    finally:
+        conn.close()
@@ -0,0 +1,142 @@
+import asyncio
+import os
+import threading
+import types
+
+import pytest
+
+
+@pytest.fixture
+def parts(bot, monkeypatch):
+    monkeypatch.setattr(bot, "DB_PARTITION_BY_GUILD", True)
+    monkeypatch.setattr(bot, "_open_partitions", set())
+    monkeypatch.setattr(bot, "_partition_open_lock", None)
+    yield bot
+    for guild_id in list(bot._open_partitions):
+        with bot.use_partition(guild_id):
+            bot.get_db_pool().close_all()
+            bot.get_db_read_pool().close_all()
+
+
+def _open(bot, *guild_ids):
+    async def run():
+        for guild_id in guild_ids:
+            await bot.open_partition(guild_id)
+    asyncio.run(run())
+
+
+def test_each_guild_gets_its_own_file_and_economy(parts):
+    bot = parts
+    _open(bot, 10, 20)
+    assert os.path.exists(bot.partition_db_path(10))
+    assert os.path.exists(bot.partition_db_path(20))
+    assert bot.list_partitions() == [10, 20]
+
+    with bot.use_partition(10):
+        bot.insert_user(1, "u1")
+        bot.add_balance(1, 500)
+    with bot.use_partition(20):
+        bot.insert_user(1, "u1")
+    assert bot.get_user(1) is None  # DB_PATH itself is untouched
+    with bot.use_partition(10):
+        assert bot.get_user(1)[2] == bot.START_BALANCE + 500
+    with bot.use_partition(20):
+        assert bot.get_user(1)[2] == bot.START_BALANCE
+
+
+def test_partitions_do_not_share_the_writer_lock(parts):
+    bot = parts
+    _open(bot, 10, 20)
+    got_other = threading.Event()
+
+    def other():
+        with bot.use_partition(20):
+            with bot.db_lock:
+                got_other.set()
+
+    with bot.use_partition(10):
+        with bot.db_lock:
+            t = threading.Thread(target=other)
+            t.start()
+            assert got_other.wait(2)
+            t.join()
+            assert bot.db_lock.locked()
+    assert not bot.db_lock.locked()
+
+
+def test_db_run_carries_the_partition_and_uses_its_own_writer(parts):
+    bot = parts
+    _open(bot, 10)
+
+    async def run():
+        with bot.use_partition(10):
+            path = await bot.db.run(bot.active_db_path)
+            writer = await bot.db.run(lambda: threading.current_thread().ident)
+        main_writer = await bot.db.run(lambda: threading.current_thread().ident)
+        results = dict(await bot.run_in_partitions(bot.active_db_path))
+        return path, writer, main_writer, results
+
+    path, writer, main_writer, results = asyncio.run(run())
+    assert path == bot.partition_db_path(10)
+    assert writer != main_writer
+    assert results == {None: bot.DB_PATH, 10: bot.partition_db_path(10)}
+
+
+def test_enter_guild_partition_routes_the_rest_of_the_task(parts):
+    bot = parts
+
+    async def command():
+        await bot.enter_guild_partition(30)
+        await bot.db.run(bot.insert_user, 5, "u5")
+        return await bot.db.read(bot.get_user, 5)
+
+    assert asyncio.run(command()) is not None
+    assert bot.get_user(5) is None
+
+
+def test_refuses_to_partition_a_db_path_that_has_users(parts, monkeypatch):
+    bot = parts
+    bot.insert_user(1, "u1")
+    with pytest.raises(RuntimeError, match="DB_PARTITION_ALLOW_EXISTING"):
+        _open(bot, 10)
+    assert bot.list_partitions() == [] and not bot._open_partitions
+
+    monkeypatch.setattr(bot, "DB_PARTITION_ALLOW_EXISTING", True)
+    _open(bot, 10)
+    with bot.use_partition(10):
+        assert bot.get_user(1) is None
+    assert bot.get_user(1)[2] == bot.START_BALANCE
+    # Once partitioned, users DB_PATH picks up later (outside any guild) don't block new guilds
+    monkeypatch.setattr(bot, "DB_PARTITION_ALLOW_EXISTING", False)
+    _open(bot, 20)
+    assert bot.list_partitions() == [10, 20]
+
+
+def test_only_commands_enter_a_partition(parts, monkeypatch):
+    bot = parts
+    invoked = []
+
+    async def get_context(message):
+        return types.SimpleNamespace(valid=message.content.startswith("!"))
+
+    async def invoke(ctx):
+        invoked.append((ctx.valid, bot.active_db_path()))
+
+    monkeypatch.setattr(bot.bot, "get_context", get_context, raising=False)
+    monkeypatch.setattr(bot.bot, "invoke", invoke, raising=False)
+
+    def message(content):
+        return types.SimpleNamespace(
+            content=content, author=types.SimpleNamespace(bot=False, id=1), guild=types.SimpleNamespace(id=10), reference=None
+        )
+
+    async def run(content):
+        await bot.on_message(message(content))
+
+    asyncio.run(run("just chatting"))
+    assert not bot._open_partitions
+    assert invoked == [(False, bot.DB_PATH)]
+
+    asyncio.run(run("!balance"))
+    assert bot._open_partitions == {10}
+    assert invoked[-1] == (True, bot.partition_db_path(10))
@@ -0,0 +1,61 @@
+import sqlite3
+
+
+def test_released_connection_is_reused(bot):
+    pool = bot.get_db_pool()
+    conn = bot.db_connect()
+    conn.close()
+    opened = pool.opened
+    again = bot.db_connect()
+    try:
+        assert again is conn
+        assert pool.opened == opened
+    finally:
+        again.close()
+
+
+def test_pooled_connections_get_the_configured_pragmas(bot):
+    conn = bot.db_connect()
+    try:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0].upper() == bot.DB_JOURNAL_MODE.upper()
+        assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+        assert conn.execute("PRAGMA cache_size").fetchone()[0] == -int(bot.DB_CACHE_SIZE_KB)
+    finally:
+        conn.close()
+
+
+def test_release_rolls_back_and_resets_state(bot):
+    bot.insert_user(1, "u1")
+    conn = bot.db_connect()
+    conn.execute("UPDATE users SET balance = 0 WHERE user_id = 1")
+    conn.balance_dirty.add(1)
+    conn.prices_recorded.append(("X", 1, 1.0))
+    conn.ledger_reason = "games"
+    conn.close()
+
+    again = bot.db_connect()
+    try:
+        assert again is conn
+        assert not again.in_transaction
+        assert not again.balance_dirty and not again.prices_recorded
+        assert again.ledger_reason == "other"
+    finally:
+        again.close()
+    assert bot.get_user(1)[2] == bot.START_BALANCE
+
+
+def test_pool_keeps_at_most_size_idle_connections(bot):
+    pool = bot.DBConnectionPool(bot.active_db_path(), size=2)
+    conns = [pool.acquire() for _ in range(4)]
+    for conn in conns:
+        conn.close()
+    assert len(pool._idle) == 2
+    # The surplus ones were closed for real
+    closed = [c for c in conns if c not in pool._idle]
+    for conn in closed:
+        try:
+            conn.execute("SELECT 1")
+        except sqlite3.ProgrammingError:
+            continue
+        raise AssertionError("surplus connection still open")
+    pool.close_all()
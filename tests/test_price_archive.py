@@ -0,0 +1,62 @@
+import random
+
+
+def _insert_prices(bot, rows):
+    conn = bot.db_connect()
+    try:
+        conn.executemany("INSERT INTO crypto_v2_prices (ts, symbol, price) VALUES (?, ?, ?)", rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _count(bot, table):
+    conn = bot.db_connect_read()
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_hour_encoding_is_lossless(bot):
+    rng = random.Random(3)
+    hour = 1_700_000_000 - 1_700_000_000 % 3600
+    price = 1234.5678
+    points = []
+    for ts in sorted(rng.sample(range(hour, hour + 3600), 200)) + [hour + 3599]:
+        price *= 1 + rng.gauss(0, 0.001)
+        points.append((ts, price))
+    ts_blob, price_blob = bot._v2_encode_price_hour(hour, points)
+    assert bot._v2_decode_price_hour(hour, ts_blob, price_blob) == points
+    assert len(ts_blob) + len(price_blob) < 16 * len(points)
+
+
+def test_archive_compacts_old_hours_and_reader_stitches(bot):
+    now = 1_800_000_000
+    start = now - 72 * 3600
+    rows = [(start + i * 20, sym, 100.0 + i * 0.01) for i in range(72 * 180) for sym in ("AAA", "BBB")]
+    _insert_prices(bot, rows)
+    before = bot.v2_get_price_series_since("AAA", start + 3000, limit=5000)
+
+    written = 0
+    while True:
+        n = bot.v2_archive_prices_once(now)
+        if not n:
+            break
+        written += n
+    assert written == 2 * 24  # closed hours older than the 48h horizon
+    assert _count(bot, "crypto_v2_prices") == 2 * 48 * 180
+    assert bot.v2_get_price_series_since("AAA", start + 3000, limit=5000) == before
+    assert bot.v2_get_price_series_since("BBB", 0, limit=50)[0] == (start, 100.0)
+
+
+def test_late_rows_merge_into_an_archived_hour(bot):
+    now = 1_800_000_000
+    hour = now - 60 * 3600
+    hour -= hour % 3600
+    _insert_prices(bot, [(hour + 10, "AAA", 1.0), (hour + 30, "AAA", 3.0)])
+    assert bot.v2_archive_prices_once(now) == 1
+    _insert_prices(bot, [(hour + 20, "AAA", 2.0)])
+    assert bot.v2_archive_prices_once(now) == 1
+    assert bot.v2_get_price_series_since("AAA", 0) == [(hour + 10, 1.0), (hour + 20, 2.0), (hour + 30, 3.0)]
+    assert _count(bot, "crypto_v2_price_archive") == 1
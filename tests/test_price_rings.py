@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+
+@pytest.fixture(params=[False, True], ids=["memory", "mmap"])
+def rings(bot, monkeypatch, request):
+    monkeypatch.setattr(bot, "CRYPTO_V2_RING_MMAP", request.param)
+    monkeypatch.setattr(bot, "CRYPTO_V2_RING_POINTS", 8)
+    return bot.price_rings
+
+
+def test_window_follows_trades_and_ticks(bot, rings):
+    bot.insert_user(1, "u1")
+    sym = bot.v2_list_markets()[0][0]
+    rings.load()
+    assert bot.v2_buy(1, sym, 500)[0]
+    bot.v2_market_tick_once()
+    assert bot.v2_sell(1, sym, bot.v2_get_holding(1, sym) / 2)[0]
+
+    raw = bot.v2_get_price_series_since(sym, 0)
+    assert rings.window(sym, 0) == raw
+    assert rings.window(sym, raw[-1][0] + 1) == []
+
+
+def test_wrapped_ring_only_answers_what_it_still_holds(bot, rings):
+    sym = bot.v2_list_markets()[0][0]
+    assert bot.v2_set_market(sym, 100.0, 1_000_000.0)[0]
+    rings.load()
+    start = bot.v2_get_price_series_since(sym, 0)[-1][0]
+    rings.extend((sym, start + i, 100.0 + i) for i in range(1, 20))
+
+    pts = rings.window(sym, start + 12)
+    assert pts == [(start + i, 100.0 + i) for i in range(12, 20)]
+    assert rings.window(sym, start + 15) == pts[3:]
+    assert rings.window(sym, start + 11) is None  # overwritten
+    # Points the ring already has (committed while load() was reading) are not added twice
+    rings.extend([(sym, start + 19, 119.0), (sym, start + 3, 1.0)])
+    assert rings.window(sym, start + 12) == pts
+
+
+def test_unseeded_history_is_not_covered(bot, rings):
+    sym = bot.v2_list_markets()[0][0]
+    conn = bot.db_connect()
+    try:
+        conn.executemany(
+            "INSERT INTO crypto_v2_prices (ts, symbol, price) VALUES (?, ?, ?)",
+            [(10 ** 9 + i, sym, 1.0 + i) for i in range(20)],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    rings.load()
+    raw = bot.v2_get_price_series_since(sym, 0)
+    assert rings.window(sym, raw[-8][0]) == raw[-8:]
+    assert rings.window(sym, raw[-9][0]) is None
+    assert rings.window("NOPE", 0) is None
+
+
+def test_mmap_restart_keeps_matching_rings(bot, monkeypatch):
+    monkeypatch.setattr(bot, "CRYPTO_V2_RING_MMAP", True)
+    syms = [row[0] for row in bot.v2_list_markets()[:2]]
+    rings = bot.price_rings
+    rings.load()
+    rings.extend([(syms[0], 2 * 10 ** 9, 5.0)])  # only in the ring, never committed
+    rings.close()
+    assert os.path.exists(bot.active_db_path() + bot.CRYPTO_V2_RING_SUFFIX)
+
+    bot.v2_market_tick_once()
+    rings.load()
+    # The first ring no longer matches the db and was reseeded, so the fake point is gone
+    assert rings.window(syms[0], 0) == bot.v2_get_price_series_since(syms[0], 0)
+
+    rings.close()
+    rings.load()
+    assert rings.window(syms[1], 0) == bot.v2_get_price_series_since(syms[1], 0)
+
+
+def test_window_matches_a_linear_scan_at_every_wrap_offset(bot, rings):
+    sym = bot.v2_list_markets()[0][0]
+    assert bot.v2_set_market(sym, 100.0, 1_000_000.0)[0]
+    rings.load()
+    start = bot.v2_get_price_series_since(sym, 0)[-1][0]
+    kept = [(start, 100.0)]
+    for i in range(1, 12):
+        rings.extend([(sym, start + 2 * i, float(i))])
+        kept = (kept + [(start + 2 * i, float(i))])[-8:]
+        for since in range(kept[0][0], kept[-1][0] + 2):
+            assert rings.window(sym, since) == [p for p in kept if p[0] >= since]
@@ -0,0 +1,43 @@
+def test_normalize_collapses_literals_and_in_lists(bot):
+    stats = bot.QueryStats()
+    a = stats.normalize("SELECT * FROM users\n   WHERE user_id IN (?, ?, ?) AND balance > 5")
+    b = stats.normalize("SELECT * FROM users WHERE user_id IN (?,?) AND balance > 900")
+    assert a == b == "SELECT * FROM users WHERE user_id IN (...) AND balance > ?"
+    assert stats.normalize("SELECT value FROM system_state WHERE key = 'x'") == "SELECT value FROM system_state WHERE key = ?"
+
+
+def test_histogram_percentiles(bot):
+    h = bot._Histogram()
+    for _ in range(98):
+        h.add(0.3)
+    h.add(40.0)
+    h.add(400.0)
+    assert h.n == 100
+    assert h.percentile(0.5) == 0.5  # upper bound of the bucket holding it
+    assert h.percentile(0.99) == 50
+    assert h.percentile(1.0) == 400.0
+
+
+def test_pooled_connection_records_statements(bot, monkeypatch):
+    stats = bot.QueryStats()
+    monkeypatch.setattr(bot, "query_stats", stats)
+    bot.insert_user(1, "u1")
+    bot.insert_user(2, "u2")
+    bot.get_user(1)
+    bot.get_user(2)
+
+    entries = {key: st for key, st in stats.statements.items()}
+    select = [st for key, st in entries.items() if key.startswith("SELECT user_id, username, balance") and "FROM users WHERE user_id = ?" in key]
+    assert select and select[0].hist.n == 2 and select[0].rows_returned == 2
+    insert = [st for key, st in entries.items() if key.startswith("INSERT INTO users")]
+    assert insert and insert[0].rows_changed == 2
+    assert stats.lock_wait.n >= 2
+
+
+def test_slow_queries_are_kept(bot, monkeypatch):
+    stats = bot.QueryStats()
+    monkeypatch.setattr(bot, "query_stats", stats)
+    monkeypatch.setattr(bot, "DB_SLOW_QUERY_MS", 0)
+    bot.get_user(1)
+    assert stats.slow
+    assert any("slow" in line.lower() for line in stats.report_lines())
@@ -0,0 +1,28 @@
+import sqlite3
+
+import pytest
+
+
+def test_reader_connections_reject_writes(bot):
+    bot.insert_user(1, "u1")
+    conn = bot.db_connect_read()
+    try:
+        with pytest.raises(sqlite3.OperationalError, match="readonly|query_only|read-only"):
+            conn.execute("UPDATE users SET balance = 0 WHERE user_id = 1")
+    finally:
+        conn.close()
+    assert bot.get_user(1)[2] == bot.START_BALANCE
+
+
+def test_readers_see_the_last_commit_while_a_write_is_open(bot):
+    bot.insert_user(1, "u1")
+    with bot.db_lock:
+        writer = bot.db_connect()
+        try:
+            writer.execute("UPDATE users SET balance = 7 WHERE user_id = 1")
+            # The writer holds its transaction open; a read neither waits nor sees it
+            assert bot.get_user(1)[2] == bot.START_BALANCE
+            writer.commit()
+        finally:
+            writer.close()
+    assert bot.get_user(1)[2] == 7
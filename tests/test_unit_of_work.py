@@ -0,0 +1,55 @@
+import pytest
+
+
+def _raw_balance(bot, user_id):
+    conn = bot.db_connect_read()
+    try:
+        return conn.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_commits_on_success_and_refreshes_cache(bot):
+    bot.insert_user(1, "u1")
+    bot.balance_cache.load()
+    with bot.unit_of_work() as conn:
+        conn.execute("UPDATE users SET balance = balance + 500 WHERE user_id = 1")
+        bot._balance_changed_conn(conn, 1)
+    assert _raw_balance(bot, 1) == bot.START_BALANCE + 500
+    assert bot.balance_cache.get(1) == bot.START_BALANCE + 500
+
+
+def test_exception_rolls_back_every_write(bot):
+    bot.insert_user(1, "u1")
+    bot.insert_user(2, "u2")
+    bot.balance_cache.load()
+    with pytest.raises(ValueError):
+        with bot.unit_of_work() as conn:
+            conn.execute("UPDATE users SET balance = balance - 300 WHERE user_id = 1")
+            conn.execute("UPDATE users SET balance = balance + 300 WHERE user_id = 2")
+            bot._balance_changed_conn(conn, 1, 2)
+            raise ValueError("fail half way")
+    assert _raw_balance(bot, 1) == bot.START_BALANCE
+    assert _raw_balance(bot, 2) == bot.START_BALANCE
+    assert bot.balance_cache.get(1) == bot.START_BALANCE
+
+
+def test_pooled_connection_is_clean_after_rollback(bot):
+    bot.insert_user(1, "u1")
+    with pytest.raises(RuntimeError):
+        with bot.unit_of_work() as conn:
+            bot._balance_changed_conn(conn, 1)
+            conn.execute("UPDATE users SET balance = 0 WHERE user_id = 1")
+            raise RuntimeError
+    with bot.unit_of_work() as conn:
+        assert not conn.in_transaction
+        assert not conn.balance_dirty
+
+
+def test_gift_is_all_or_nothing(bot):
+    bot.insert_user(1, "u1")
+    bot.insert_user(2, "u2")
+    status, sender_bal, _recipient_bal = bot.gift_balance(1, 2, bot.START_BALANCE + 1)
+    assert status != "ok"
+    assert _raw_balance(bot, 1) == bot.START_BALANCE
+    assert _raw_balance(bot, 2) == bot.START_BALANCE
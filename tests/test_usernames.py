@@ -0,0 +1,36 @@
+def _stored_name(bot, user_id):
+    conn = bot.db_connect_read()
+    try:
+        return conn.execute("SELECT username FROM users WHERE user_id = ?", (user_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_unchanged_name_queues_nothing(bot):
+    bot.insert_user(1, "alice")
+    assert not bot.usernames.note(1, "alice", stored="alice")
+    assert not bot.usernames.note(1, "alice")
+    assert bot.usernames.flush() == 0
+
+
+def test_renames_are_coalesced_into_one_flush(bot):
+    for uid in (1, 2):
+        bot.insert_user(uid, f"u{uid}")
+    assert bot.usernames.note(1, "a", stored="u1")
+    assert bot.usernames.note(1, "b")
+    assert bot.usernames.note(2, "c", stored="u2")
+    assert _stored_name(bot, 1) == "u1"
+    assert [name for name, _bal in bot.get_top_users(2)] == ["b", "c"]
+    assert bot.usernames.flush() == 2
+    assert (_stored_name(bot, 1), _stored_name(bot, 2)) == ("b", "c")
+    assert bot.usernames.flush() == 0
+
+
+def test_touch_user_does_not_write_the_name(bot):
+    bot.insert_user(1, "old")
+    with bot.unit_of_work() as conn:
+        row = bot._touch_user_conn(conn, 1, "new")
+        assert row[1] == "new"
+    assert _stored_name(bot, 1) == "old"
+    bot.usernames.flush()
+    assert _stored_name(bot, 1) == "new"